@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Measures how tokenize scales with the number of clauses in a query.
+
+    python -m benchmarks.clause_scaling [--packrat]
+
+--packrat turns on pyparsing's memoization to compare against it.
+"""
+import sys
+import timeit
+
+CLAUSES = [u'title:foo{}', u'due_date:>{}', u'(a:{} OR b:x)', u'word{}',
+           u'name:"x {}"', u'c:{} AND d:y']
+
+
+def make_query(clause_count):
+    return u' '.join(CLAUSES[i % len(CLAUSES)].format(i)
+                     for i in range(clause_count))
+
+
+def main(argv):
+    from plasticparser import tokenizer
+    if '--packrat' in argv:
+        from pyparsing import ParserElement
+        ParserElement.enablePackrat()
+    for clause_count in (10, 100, 1000):
+        query = make_query(clause_count)
+        number = max(1, 1000 // clause_count)
+        best = min(timeit.repeat(
+            lambda: tokenizer.tokenize(query), number=number, repeat=7))
+        per_parse = best / number
+        print("{:>5} clauses {:10.2f} ms/parse {:8.1f} us/clause".format(
+            clause_count, per_parse * 1000,
+            per_parse * 1000000 / clause_count))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Generates synthetic query corpora that cover every construct of the
+grammar, from single words to long queries with facets and nested lists.
+
+    python -m benchmarks.corpus [size] [complexity]
+"""
+import random
+import sys
+
+WORDS = [u'python', u'java', u'hello', u'world', u'data', u'search',
+         u'engineer', u'remote', u'senior', u'backend', u'c++', u'node.js']
+UNICODE_WORDS = [u'caf\xe9', u'na\xefve', u'東京', u'мир',
+                 u'αβγ', u'stra\xdfe', u'مرحبا']
+FIELDS = [u'title', u'description', u'name', u'due_date', u'salary',
+          u'messages.title', u'location.city', u'starred']
+OPERATORS = [u':', u':<', u':>', u':<=', u':>=', u':=']
+TYPES = [u'candidates', u'jobs', u'help', u'person']
+FACET_FIELDS = [u'skills', u'location.city', u'company', u'tags']
+NESTED_PATHS = [u'metadata', u'messages', u'location']
+
+# clauses per query for each complexity
+COMPLEXITY = {
+    'small': (1, 3),
+    'medium': (4, 10),
+    'large': (20, 50),
+}
+
+
+def free_text(rng):
+    return rng.choice(WORDS)
+
+
+def unicode_text(rng):
+    return rng.choice(UNICODE_WORDS)
+
+
+def compare(rng):
+    return u'{}{}{}'.format(rng.choice(FIELDS), rng.choice(OPERATORS),
+                            rng.choice(WORDS + [str(rng.randint(0, 9999))]))
+
+
+def quoted(rng):
+    return u'{}:"{} \\"{}\\" {}"'.format(
+        rng.choice(FIELDS), rng.choice(WORDS), rng.choice(WORDS),
+        rng.choice(UNICODE_WORDS))
+
+
+def paren_group(rng):
+    return u'({} {} {})'.format(compare(rng), rng.choice([u'OR', u'AND']),
+                                compare(rng))
+
+
+def filter_expression(rng):
+    return u'{}:({} {} {})'.format(
+        rng.choice(FIELDS), rng.choice(WORDS), rng.choice([u'OR', u'AND']),
+        rng.choice(WORDS))
+
+
+def facets(rng):
+    entries = []
+    for field in rng.sample(FACET_FIELDS, rng.randint(1, 3)):
+        if rng.random() < 0.5:
+            field = u'{}({})'.format(field, filter_expression(rng))
+        entries.append(field)
+    return u'facets:[{}]'.format(u', '.join(entries))
+
+
+def nested(rng):
+    return u'nested:[{}({})]'.format(rng.choice(NESTED_PATHS),
+                                     filter_expression(rng))
+
+
+CLAUSES = [free_text, unicode_text, compare, compare, quoted, paren_group]
+
+
+def make_query(rng, clause_count):
+    parts = []
+    if rng.random() < 0.3:
+        parts.append(u'type:{}'.format(rng.choice(TYPES)))
+    # a compare expression right before a list swallows it into the query
+    # string, so lists come first and free text keeps them apart
+    if rng.random() < 0.3:
+        parts.extend([facets(rng), free_text(rng)])
+    if rng.random() < 0.2:
+        parts.extend([nested(rng), free_text(rng)])
+    for _ in range(clause_count):
+        parts.append(rng.choice(CLAUSES)(rng))
+        if rng.random() < 0.3:
+            parts.append(rng.choice([u'AND', u'OR', u'and', u'or']))
+    return u' '.join(parts)
+
+
+def make_corpus(size=1000, complexity='medium', seed=2015):
+    """
+    returns size query strings of the given complexity, the same ones
+    for the same seed
+    """
+    rng = random.Random(seed)
+    low, high = COMPLEXITY[complexity]
+    return [make_query(rng, rng.randint(low, high)) for _ in range(size)]
+
+
+def main(size=10, complexity='medium'):
+    for query in make_corpus(int(size), complexity):
+        print(query.encode('utf-8'))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the pyparsing grammar with the hand written parser.
+
+    python -m benchmarks.engines
+"""
+import timeit
+
+QUERIES = [
+    u'title:hello',
+    u'title:hello OR description:"world"',
+    u'type:candidates (name:"John Doe" starred:true) (python or java)',
+    u'type:help facets: [ aaa.bb(abc:def) bbb(cc:ddd) ]',
+    u'type:help title:hello nested:[metadata(value:(no) name:(first))]',
+    u'first_name:asdasd AND (messages.title:(yes i will) OR due:(1234))',
+    u'due_date:<1234 due_date:>1234 due_date:>=1234 (due_date:>=1234)',
+    u'python java scala clojure haskell erlang elixir',
+]
+
+
+def main():
+    from plasticparser import tokenizer, fast_tokenizer
+    for query in QUERIES:
+        timings = {}
+        for name, tokenize in (('pyparsing', tokenizer.tokenize),
+                               ('fast', fast_tokenizer.tokenize)):
+            tokenize(query)
+            timings[name] = min(timeit.repeat(
+                lambda: tokenize(query), number=200, repeat=5)) / 200
+        print(u"{:>9.1f} us {:>7.1f} us {:>5.1f}x  {}".format(
+            timings['pyparsing'] * 1000000, timings['fast'] * 1000000,
+            timings['pyparsing'] / timings['fast'], query))
+
+
+if __name__ == '__main__':
+    main()
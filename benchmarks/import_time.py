@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the cold start cost of plasticparser in fresh interpreters.
+
+    python -m benchmarks.import_time [repeat]
+"""
+import subprocess
+import sys
+
+SNIPPETS = [
+    ("import plasticparser",
+     "from plasticparser import plasticparser, tokenizer"),
+    ("import + build grammar",
+     "from plasticparser import plasticparser, tokenizer\n"
+     "tokenizer.get_grammar()"),
+    ("import + first get_query_dsl",
+     "from plasticparser import plasticparser\n"
+     "plasticparser.get_query_dsl('a:b')"),
+    # what every import used to pay before the grammar was built lazily
+    ("legacy unicode_printables table",
+     "from pyparsing import Word\n"
+     "p = u''.join(unichr(c) for c in xrange(65536)"
+     " if not unichr(c).isspace())\n"
+     "Word(p, excludeChars=[')']); Word(p, excludeChars=[':', '(']);"
+     " Word(p)"),
+]
+
+TIMER = """
+import time
+_start = time.time()
+{}
+sys.stdout.write(repr(time.time() - _start))
+"""
+
+
+def time_snippet(snippet):
+    code = "import sys\n" + TIMER.format(snippet)
+    output = subprocess.check_output([sys.executable, "-c", code])
+    return float(output)
+
+
+def main(repeat=5):
+    for name, snippet in SNIPPETS:
+        timings = [time_snippet(snippet) for _ in range(repeat)]
+        print("{:<34} best {:8.2f} ms  worst {:8.2f} ms".format(
+            name, min(timings) * 1000, max(timings) * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
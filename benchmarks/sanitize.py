@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Times the escaping of reserved characters on large free text queries.
+
+    python -m benchmarks.sanitize
+"""
+import random
+import timeit
+
+WORDS = [u'python', u'java', u'c++', u'a-b', u'x&&y', u'p||q', u'(paren)',
+         u'why?', u'1/2', u'[list]', u'{set}', u'~fuzzy', u'wild*', u'!not',
+         u'plain', u'text', u'back\\slash', u'caret^']
+
+
+def make_free_text(word_count, seed=2015):
+    rng = random.Random(seed)
+    return u' '.join(rng.choice(WORDS) for _ in range(word_count))
+
+
+def main():
+    from plasticparser import grammar_parsers, fast_tokenizer
+    for word_count in (100, 1000, 10000):
+        text = make_free_text(word_count)
+        words = text.split()
+        for name, sanitize in (
+                ('sanitize_value', grammar_parsers.sanitize_value),
+                ('sanitize_facet_value', grammar_parsers.sanitize_facet_value),
+                ('sanitize_free_text', grammar_parsers.sanitize_free_text)):
+            seconds = min(timeit.repeat(
+                lambda: [sanitize(word) for word in words],
+                number=10, repeat=5)) / 10
+            print(u"{:>6} words {:>22} {:>10.1f} us".format(
+                word_count, name, seconds * 1000000))
+        seconds = min(timeit.repeat(
+            lambda: fast_tokenizer.tokenize(text), number=3, repeat=3)) / 3
+        print(u"{:>6} words {:>22} {:>10.1f} us".format(
+            word_count, 'fast_tokenizer', seconds * 1000000))
+
+
+if __name__ == '__main__':
+    main()
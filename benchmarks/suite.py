@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Runs get_query_dsl, get_document_types and is_facet_query over generated
+corpora and writes parses per second, p50/p99 latency, peak memory and
+import time as json, so two releases can be compared.
+
+    python -m benchmarks.suite [--size 1000] [--complexity small,medium,large]
+        [--engine pyparsing,fast] [--output results.json]
+        [--compare baseline.json] [--threshold 1.25]
+
+Every measurement runs in a fresh interpreter so its peak memory is its
+own. With --compare the comparison goes to stderr and the exit status is
+1 when any result is slower than the baseline by more than the threshold.
+"""
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+import timeit
+
+from . import import_time
+
+FUNCTIONS = ['get_query_dsl', 'get_document_types', 'is_facet_query']
+
+
+def percentile(sorted_values, fraction):
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def peak_memory_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macos bytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def measure(function_name, engine, complexity, size):
+    """
+    times function_name on each query of a corpus, in this process
+    """
+    from plasticparser import plasticparser
+    from .corpus import make_corpus
+    corpus = make_corpus(size, complexity)
+    function = getattr(plasticparser, function_name)
+    function(corpus[0], engine=engine)
+    memory_before = peak_memory_kb()
+    timer = timeit.default_timer
+    latencies = []
+    for query in corpus:
+        start = timer()
+        function(query, engine=engine)
+        latencies.append(timer() - start)
+    latencies.sort()
+    return {
+        'function': function_name,
+        'engine': engine,
+        'complexity': complexity,
+        'queries': size,
+        'parses_per_sec': size / sum(latencies),
+        'p50_us': percentile(latencies, 0.5) * 1000000,
+        'p99_us': percentile(latencies, 0.99) * 1000000,
+        'peak_memory_kb': peak_memory_kb(),
+        'memory_growth_kb': peak_memory_kb() - memory_before,
+    }
+
+
+def measure_in_subprocess(function_name, engine, complexity, size):
+    output = subprocess.check_output([
+        sys.executable, '-m', 'benchmarks.suite', '--measure',
+        function_name, engine, complexity, str(size)])
+    return json.loads(output)
+
+
+def run(sizes, complexities, engines):
+    import pyparsing
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'pyparsing': pyparsing.__version__,
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        'import_time': {},
+        'results': [],
+    }
+    for name, snippet in import_time.SNIPPETS[:3]:
+        results['import_time'][name] = min(
+            import_time.time_snippet(snippet) for _ in range(5))
+    for complexity in complexities:
+        for engine in engines:
+            for function_name in FUNCTIONS:
+                results['results'].append(measure_in_subprocess(
+                    function_name, engine, complexity, sizes[complexity]))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    prints each result against the baseline and returns the ones that
+    regressed by more than threshold
+    """
+    def key(result):
+        return result['function'], result['engine'], result['complexity']
+    previous = dict((key(result), result) for result in baseline['results'])
+    regressions = []
+    for result in results['results']:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        slowdown = max(old['parses_per_sec'] / result['parses_per_sec'],
+                       result['p99_us'] / old['p99_us'])
+        sys.stderr.write(
+            "{:<20} {:<10} {:<7} {:>10.0f}/s (was {:>10.0f}/s) "
+            "p99 {:>9.1f} us (was {:>9.1f} us) {:5.2f}x\n".format(
+                key(result)[0], key(result)[1], key(result)[2],
+                result['parses_per_sec'], old['parses_per_sec'],
+                result['p99_us'], old['p99_us'], slowdown))
+        if slowdown > threshold:
+            regressions.append(result)
+    return regressions
+
+
+def main(argv):
+    if argv[:1] == ['--measure']:
+        function_name, engine, complexity, size = argv[1:]
+        sys.stdout.write(json.dumps(
+            measure(function_name, engine, complexity, int(size))))
+        return 0
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--size', type=int, default=None,
+                        help='queries per corpus, by default 2000 small, '
+                             '1000 medium and 200 large ones')
+    parser.add_argument('--complexity', default='small,medium,large')
+    parser.add_argument('--engine', default='pyparsing,fast')
+    parser.add_argument('--output', help='file to write the json to')
+    parser.add_argument('--compare', help='json from an earlier run')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    args = parser.parse_args(argv)
+    sizes = {'small': 2000, 'medium': 1000, 'large': 200}
+    if args.size:
+        sizes = dict.fromkeys(sizes, args.size)
+    results = run(sizes, args.complexity.split(','), args.engine.split(','))
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
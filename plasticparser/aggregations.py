@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Compiles the facets of a query dsl into aggregations, which replaced
+facets in elasticsearch: a terms aggregation per facet, inside a filter
+aggregation when the facet has a filter and a nested aggregation when
+it counts nested documents.
+"""
+
+
+class Aggregations(object):
+    """
+    How get_query_dsl compiles facets:[ ] into aggregations.
+
+    param: size : the buckets of each terms aggregation, facets_query_size
+     when it is not given
+    param: sizes : {facet name: size} for the facets that need another size
+    param: field_names : {facet name: field} or a function returning the
+     field of a facet name. Facets it does not map count the field the
+     facets output uses, the last part of the name with _nonngram added.
+    param: shard_size : the buckets each shard returns, for more accurate
+     counts of big indices
+    param: execution_hint : how terms are collected, 'map' or
+     'global_ordinals'
+    """
+    def __init__(self, size=None, sizes=None, field_names=None,
+                 shard_size=None, execution_hint=None):
+        self.size = size
+        self.sizes = sizes or {}
+        self.field_names = field_names
+        self.shard_size = shard_size
+        self.execution_hint = execution_hint
+
+    def field_name(self, facet_name, default):
+        field_names = self.field_names
+        if callable(field_names):
+            field = field_names(facet_name)
+        elif field_names is not None:
+            field = field_names.get(facet_name)
+        else:
+            field = None
+        return default if field is None else field
+
+
+def facet_aggregation(name, facet, options):
+    """
+    returns the aggregation of one entry of the facets output
+    """
+    terms = {
+        "field": options.field_name(name, facet["terms"]["field"]),
+        "size": options.sizes.get(
+            name, options.size or facet["terms"]["size"]),
+    }
+    if options.shard_size is not None:
+        terms["shard_size"] = options.shard_size
+    if options.execution_hint is not None:
+        terms["execution_hint"] = options.execution_hint
+    aggregation = {"terms": terms}
+    facet_filter = facet.get("facet_filter")
+    if facet_filter is not None:
+        aggregation = {"filter": facet_filter, "aggs": {name: aggregation}}
+    if "nested" in facet:
+        aggregation = {"nested": {"path": facet["nested"]},
+                       "aggs": {name: aggregation}}
+    return aggregation
+
+
+def add_aggregations(query_dsl, options):
+    """
+    replaces the facets of a query dsl with aggregations of the same
+    names. Where a facet is filtered or nested its terms aggregation is
+    found under the same name inside the filter or nested one.
+    """
+    facets = query_dsl.pop("facets", {})
+    query_dsl["aggs"] = dict(
+        (name, facet_aggregation(name, facet, options))
+        for name, facet in facets.iteritems())
+    return query_dsl
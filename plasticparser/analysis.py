@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+from .cache import copy_dsl
+from .grammar_parsers import add_global_filters, sanitize_free_text
+from .nodes import Term, Compare, Paren, Range
+from .routing import add_routing, document_types
+from .tree_parser import flatten
+
+# free text the query_string query reads as a logical operator
+OPERATOR_WORDS = frozenset([u'AND', u'OR', u'NOT', u'&&', u'||', u'!'])
+PREFIX_OPERATORS = u'-+!'
+
+
+class lazy_property(object):
+    """
+    a property computed on first access and stored on the instance
+    """
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.__name__] = self.func(instance)
+        return value
+
+
+def _paren_depth(text):
+    return text.count(u'(') - text.count(u')')
+
+
+def _clauses(node):
+    """
+    yields the terms and compare expressions of a node, those inside
+    parens included, in the order the query has them. The words the
+    grammar splits off the parenthesised value of a compare expression
+    are left out.
+    """
+    if node is None:
+        return
+    depth = 0
+    for token in flatten(node):
+        if isinstance(token, basestring):
+            continue
+        text = token.text if type(token) is Term else getattr(
+            token, 'value', None)
+        if depth > 0:
+            if isinstance(text, basestring):
+                depth += _paren_depth(text)
+            continue
+        if type(token) is Paren:
+            for clause in _clauses(token.child):
+                yield clause
+            continue
+        if type(token) is Compare and isinstance(text, basestring):
+            depth = _paren_depth(text)
+        yield token
+
+
+class QueryAnalysis(object):
+    """
+    Everything the api reports about one query string, read from a single
+    parse: its syntax tree and the query dsl emitted from it. Each property
+    is worked out the first time it is used.
+    """
+    def __init__(self, query_string, tree, expression, global_filters=None,
+                 routing=None):
+        self.query_string = query_string
+        self._tree = tree
+        self._expression = expression
+        self._global_filters = global_filters
+        self._routing = routing
+
+    @lazy_property
+    def dsl(self):
+        """
+        the query dsl, as returned by get_query_dsl
+        """
+        query_dsl = copy_dsl(self._expression)
+        if self._routing is not None:
+            add_routing(query_dsl, self._routing)
+        return add_global_filters(query_dsl, self._global_filters)
+
+    @lazy_property
+    def _must_filters(self):
+        return self._expression['query']['filtered']['filter']['bool']['must']
+
+    @lazy_property
+    def document_types(self):
+        return document_types(self._expression)
+
+    @lazy_property
+    def facet_names(self):
+        return sorted(self._expression['facets'])
+
+    @lazy_property
+    def is_facet_query(self):
+        return True if self._expression['facets'] else False
+
+    @lazy_property
+    def nested_paths(self):
+        return [filter['nested']['path'] for filter in self._must_filters
+                if filter.keys()[0] == 'nested']
+
+    @lazy_property
+    def free_text_terms(self):
+        """
+        the words of the query that are not compared to a field,
+        escaped as they are in the query dsl
+        """
+        free_text_terms = []
+        for clause in _clauses(self._tree.query):
+            if type(clause) is not Term or clause.text in OPERATOR_WORDS:
+                continue
+            # the grammar leaves the parens of a group of words on its
+            # first and last word
+            text = clause.text.lstrip(u'(').rstrip(u')')
+            if text:
+                free_text_terms.append(sanitize_free_text(text))
+        return free_text_terms
+
+    @lazy_property
+    def field_names(self):
+        """
+        every field compared in the query, its nested paths and
+        facet filters, in the order they first appear
+        """
+        tree = self._tree
+        nodes = [tree.query]
+        nodes.extend(nested.filter for nested in tree.nested)
+        facet_filters = dict((facet.field, facet.filter)
+                             for facet in tree.facets)
+        nodes.extend(facet_filter for name, facet_filter
+                     in sorted(facet_filters.items()))
+        field_names = []
+        for node in nodes:
+            for clause in _clauses(node):
+                clause_type = type(clause)
+                if clause_type is not Compare and clause_type is not Range:
+                    continue
+                field = clause.field.lstrip(PREFIX_OPERATORS)
+                if field not in field_names:
+                    field_names.append(field)
+        return field_names
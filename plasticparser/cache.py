@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import OrderedDict
+
+
+def copy_dsl(value):
+    """
+    returns a deep copy of a query dsl made of dicts, lists and scalars
+    """
+    if isinstance(value, dict):
+        return dict((key, copy_dsl(val)) for key, val in value.iteritems())
+    if isinstance(value, list):
+        return [copy_dsl(val) for val in value]
+    return value
+
+
+class LRUCache(object):
+    """
+    A bounded, thread safe least recently used cache.
+    Entries older than ttl seconds are treated as missing when ttl is set.
+    """
+    def __init__(self, maxsize=128, ttl=None, timer=time.time):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and self.ttl is not None \
+                    and self.timer() - entry[1] > self.ttl:
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, self.timer())
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "maxsize": self.maxsize
+        }
+
+
+class TieredCache(object):
+    """
+    An LRUCache in front of a slower cache that other processes share,
+    such as an SQLiteCache. What is found in the shared cache is kept in
+    the LRUCache too.
+    """
+    def __init__(self, local, shared):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key, default=None):
+        value = self.local.get(key)
+        if value is None:
+            value = self.shared.get(key)
+            if value is None:
+                return default
+            self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        self.shared.set(key, value)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def __len__(self):
+        return len(self.local)
+
+    def stats(self):
+        stats = self.local.stats()
+        stats["shared"] = self.shared.stats()
+        return stats
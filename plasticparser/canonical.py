@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Puts query strings that mean the same into one normal form, so that they
+can share a cache entry: whitespace and operator case are normalized,
+clauses joined by the same operator and the entries of facets:[ ] are
+sorted and quotes around a single plain word are dropped. fingerprint
+hashes the normal form into a short key that is stable across processes.
+"""
+import hashlib
+import re
+
+from .nodes import (
+    Node, Term, Phrase, Compare, Bool, Paren, TypeTerms, SearchQuery)
+from .tokenizer import _sanitize_query
+from .tree_parser import (
+    TYPE_LIKE, chain, flatten, is_plain, joining_operator, parse_tree)
+
+# a quoted value that means the same without its quotes
+PLAIN_WORD = re.compile(u'[a-zA-Z0-9]+$')
+LUCENE_OPERATORS = frozenset([u'AND', u'OR', u'NOT', u'TO'])
+# the parser reads a clause starting with and or or after a space as an
+# operator, and elasticsearch reads NOT as one
+OPERATOR_LIKE = re.compile(u'[aA][nN][dD]|[oO][rR]|NOT$')
+
+
+def format_node(node):
+    node_type = type(node)
+    if node_type is Term:
+        return node.text
+    if node_type is Phrase:
+        return u'"{}"'.format(node.text)
+    if node_type is Compare:
+        value = node.value
+        if isinstance(value, Node):
+            value = format_node(value)
+        return u'{}{}{}'.format(node.field, node.operator, value)
+    if node_type is Paren:
+        return u'({})'.format(format_node(node.child))
+    if node_type is Bool:
+        return u' '.join(format_node(token) if isinstance(token, Node)
+                         else token for token in flatten(node))
+    raise TypeError("cannot format {!r}".format(node))
+
+
+def _format_entry(field, filter):
+    if filter is None:
+        return field
+    return u'{}({})'.format(field, format_node(filter))
+
+
+def _plain_tree(tree):
+    return is_plain(tree.query) and \
+        all(is_plain(facet.filter) for facet in tree.facets) and \
+        all(is_plain(nested.filter) for nested in tree.nested)
+
+
+def _pinned(atom):
+    """
+    whether the clause could parse differently somewhere else in the
+    query, so that its clauses keep their order
+    """
+    return OPERATOR_LIKE.match(format_node(atom)) is not None or (
+        type(atom) is Compare and TYPE_LIKE.match(atom.field) is not None)
+
+
+def _takes_operator(token):
+    return isinstance(token, Node) and \
+        OPERATOR_LIKE.match(format_node(token)) is not None
+
+
+def format_tree(tree):
+    """
+    returns a query string that parses to the query dsl of the
+    SearchQuery. The facets and nested lists go where the parser cannot
+    take them for a compare value or put two of them side by side.
+    """
+    lists = []
+    if tree.facets:
+        lists.append(u'facets:[{}]'.format(u', '.join(
+            _format_entry(facet.field, facet.filter)
+            for facet in tree.facets)))
+    for nested in tree.nested:
+        lists.append(u'nested:[{}]'.format(
+            _format_entry(nested.path, nested.filter)))
+    parts = []
+    if type(tree.type_filter) is TypeTerms:
+        parts.append(u'type:({})'.format(
+            u' OR '.join(tree.type_filter.names)))
+    elif tree.type_filter is not None:
+        parts.append(u'type:{}'.format(tree.type_filter.name))
+    # a list right after a compare expression, or an operator after one,
+    # is read as its value
+    after_compare = blocked = False
+    for token in flatten(tree.query) + [None]:
+        if lists and not blocked and not _takes_operator(token):
+            parts.append(lists.pop(0))
+            after_compare, blocked = False, True
+        if token is None:
+            break
+        if isinstance(token, Node):
+            parts.append(format_node(token))
+            after_compare = blocked = type(token) is Compare
+        else:
+            parts.append(token)
+            blocked = after_compare
+    parts.extend(lists)
+    return u' '.join(parts)
+
+
+def _canonical_atom(node):
+    node_type = type(node)
+    if node_type is Compare:
+        value = node.value
+        if type(value) is Phrase and PLAIN_WORD.match(value.text) and \
+                value.text not in LUCENE_OPERATORS:
+            return node.replace(value=value.text)
+    elif node_type is Paren:
+        return Paren(canonical_clauses(node.child))
+    return node
+
+
+def canonical_clauses(node):
+    """
+    sorts a chain of clauses when every one of them is joined by the
+    same operator, or all by the default operator
+    """
+    if node is None:
+        return None
+    tokens = [_canonical_atom(token) if isinstance(token, Node) else token
+              for token in flatten(node)]
+    operator = joining_operator(tokens, u'')
+    atoms = tokens[::2] if operator else tokens
+    if operator is None or any(_pinned(atom) for atom in atoms):
+        return chain(tokens)
+    atoms.sort(key=format_node)
+    tokens = atoms[:1]
+    for atom in atoms[1:]:
+        if operator:
+            tokens.append(operator)
+        tokens.append(atom)
+    return chain(tokens)
+
+
+def canonical_tree(tree):
+    """
+    returns the normal form of a SearchQuery
+    """
+    facets = {}
+    for facet in tree.facets:
+        # a later facet on the same field replaces an earlier one
+        facets[facet.field] = facet
+    return SearchQuery(
+        tree.type_filter,
+        tuple(facets[field] for field in sorted(facets)),
+        tuple(sorted(tree.nested, key=lambda nested: _format_entry(
+            nested.path, nested.filter))),
+        canonical_clauses(tree.query))
+
+
+def normal_form(query_string):
+    """
+    returns the normal form of a query string and the SearchQuery it
+    parses to. A query with characters that could parse differently once
+    moved, such as unbalanced parens or quotes, is its own normal form.
+    """
+    query = _sanitize_query(query_string)
+    tree = parse_tree(query)
+    if not _plain_tree(tree):
+        return query, tree
+    tree = canonical_tree(tree)
+    return format_tree(tree), tree
+
+
+def canonicalize(query_string):
+    """
+    returns the normal form of a query string. Queries with the same
+    normal form give the same results, e.g.
+    'a:1 AND b:"x"' and 'b:x  and a:1'.
+    """
+    return normal_form(query_string)[0]
+
+
+def fingerprint(query_string):
+    """
+    returns a hex digest of the normal form of a query string, to key
+    caches with
+    """
+    return hashlib.sha1(canonicalize(query_string).encode('utf-8')).hexdigest()
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""
+Turns a syntax tree from tree_parser into the elasticsearch query dsl.
+"""
+import re
+
+from .grammar_parsers import (
+    DEFAULT_FACETS_QUERY_SIZE, DEFAULT_OPERATOR, sanitize_value,
+    sanitize_facet_value, sanitize_free_text, facet_dsl, nested_dsl,
+    add_global_filters)
+from .nodes import (
+    Node, Term, Phrase, Compare, Bool, Paren, Range, TypeTerms)
+from .tree_parser import flatten, is_plain, joining_operator
+
+RANGE_OPERATORS = {u':<': 'lt', u':>': 'gt', u':<=': 'lte', u':>=': 'gte'}
+ESCAPED_CHAR = re.compile(u'\\\\(.)')
+# the fields and values a filter matches the same as the query_string
+# query: no prefix operators, wildcards, fuzziness, boosts, regular
+# expressions, ranges, groups or escapes
+FILTER_FIELD = re.compile(u'[\\w.]+$', re.UNICODE)
+VALUE_SPECIAL_CHARS = u'\\s()\\[\\]{}"*?~^/\\\\'
+FILTER_VALUE = re.compile(u'[^-+!{0}][^{0}]*$'.format(VALUE_SPECIAL_CHARS),
+                          re.UNICODE)
+# fields the query_string query reads as something else
+SPECIAL_FIELDS = frozenset([u'_exists_', u'_missing_'])
+# prefixes negating or requiring a clause
+PREFIX_OPERATORS = (u'-', u'+', u'!')
+# free text words negating the clause after them
+NEGATIONS = frozenset([u'NOT', u'!'])
+
+
+def _value_string(value):
+    if isinstance(value, Phrase):
+        return u'"{}"'.format(value.text)
+    return value
+
+
+def _bool_string(node, emit):
+    parts = []
+    if node.left is not None:
+        parts.append(emit(node.left))
+    if node.operator is not None:
+        parts.append(node.operator)
+    if node.right is not None:
+        parts.append(emit(node.right))
+    return u' '.join(parts)
+
+
+def emit_query_string(node):
+    """
+    returns the query_string query of the top level of a tree
+    """
+    node_type = type(node)
+    if node_type is Compare:
+        return u"{}{}{}".format(node.field, node.operator,
+                                sanitize_value(_value_string(node.value)))
+    if node_type is Term:
+        return sanitize_free_text(node.text)
+    if node_type is Bool:
+        return _bool_string(node, emit_query_string)
+    if node_type is Range:
+        return u"{}:{}{} TO {}{}".format(
+            node.field, u'[' if node.include_lower else u'{',
+            u'*' if node.lower is None else sanitize_value(node.lower),
+            u'*' if node.upper is None else sanitize_value(node.upper),
+            u']' if node.include_upper else u'}')
+    if node_type is Paren:
+        return u'({})'.format(emit_query_string(node.child))
+    raise TypeError("cannot emit {!r}".format(node))
+
+
+def emit_filter_string(node):
+    """
+    returns the query_string query of a facet or nested filter
+    """
+    node_type = type(node)
+    if node_type is Compare:
+        return u"{}{}{}".format(node.field, node.operator,
+                                sanitize_facet_value(node.value))
+    if node_type is Term:
+        return node.text
+    if node_type is Phrase:
+        return _value_string(node)
+    if node_type is Bool:
+        return _bool_string(node, emit_filter_string)
+    if node_type is Paren:
+        return u'({})'.format(emit_filter_string(node.child))
+    raise TypeError("cannot emit {!r}".format(node))
+
+
+def _filter_value(value):
+    if isinstance(value, Phrase):
+        return ESCAPED_CHAR.sub(u'\\1', value.text)
+    return value
+
+
+def _bool_filter(operator, filters):
+    if len(filters) == 1:
+        return filters[0]
+    return {"bool": {"must" if operator == u'AND' else "should": filters}}
+
+
+def _filterable(node):
+    """
+    whether a filter on the compare expression matches what the
+    query_string query does
+    """
+    if node.operator != u':' and node.operator not in RANGE_OPERATORS:
+        return False
+    if FILTER_FIELD.match(node.field) is None or \
+            node.field in SPECIAL_FIELDS:
+        return False
+    return isinstance(node.value, Phrase) or \
+        FILTER_VALUE.match(node.value) is not None
+
+
+def _compare_filter(node, schema):
+    value = _filter_value(node.value)
+    field = schema.field(node.field) if schema is not None else None
+    if node.operator in RANGE_OPERATORS:
+        query_filter = {"range": {
+            node.field: {RANGE_OPERATORS[node.operator]: value}}}
+    elif field is not None and field.analyzed:
+        # a term filter would miss analyzed values
+        match = "match_phrase" if isinstance(node.value, Phrase) \
+            else "match"
+        query_filter = {"query": {match: {node.field: value}}}
+    else:
+        query_filter = {"term": {node.field: value}}
+    if field is not None and field.nested_path is not None:
+        query_filter = {"nested": {
+            "path": field.nested_path, "filter": query_filter}}
+    return query_filter
+
+
+def _range_filter(node, schema):
+    bounds = {}
+    if node.lower is not None:
+        bounds['gte' if node.include_lower else 'gt'] = node.lower
+    if node.upper is not None:
+        bounds['lte' if node.include_upper else 'lt'] = node.upper
+    query_filter = {"range": {node.field: bounds}}
+    field = schema.field(node.field) if schema is not None else None
+    if field is not None and field.nested_path is not None:
+        query_filter = {"nested": {
+            "path": field.nested_path, "filter": query_filter}}
+    return query_filter
+
+
+def emit_filter(node, default_operator=DEFAULT_OPERATOR, schema=None):
+    """
+    returns the term, range and bool filters of a node made of compare
+    expressions, None when it has free text or mixes operators. Values
+    are matched exactly as they are indexed, unless a schema says that a
+    field is analyzed; fields of nested documents are wrapped in nested
+    filters.
+    """
+    node_type = type(node)
+    if node_type is Compare:
+        if not _filterable(node):
+            return None
+        return _compare_filter(node, schema)
+    if node_type is Range:
+        return _range_filter(node, schema)
+    if node_type is Paren:
+        return emit_filter(node.child, default_operator, schema)
+    if node_type is Bool:
+        tokens = flatten(node)
+        operator = joining_operator(tokens, default_operator.upper())
+        if operator is None:
+            return None
+        filters = []
+        for token in tokens:
+            if isinstance(token, Node):
+                query_filter = emit_filter(token, default_operator, schema)
+                if query_filter is None:
+                    return None
+                filters.append(query_filter)
+        return _bool_filter(operator, filters)
+    return None
+
+
+def check_fields(node, schema):
+    """
+    raises an UnknownFieldError for the first compare expression of a
+    node on a field the schema does not have
+    """
+    if node is None:
+        return
+    for token in flatten(node):
+        token_type = type(token)
+        if token_type is Compare or token_type is Range:
+            field = token.field
+            if field[:1] in PREFIX_OPERATORS:
+                field = field[1:]
+            schema.field(field)
+        elif token_type is Paren:
+            check_fields(token.child, schema)
+
+
+def _check_tree(tree, schema):
+    check_fields(tree.query, schema)
+    for facet in tree.facets:
+        schema.field(facet.field)
+        check_fields(facet.filter, schema)
+    for nested in tree.nested:
+        schema.check_nested_path(nested.path)
+        check_fields(nested.filter, schema)
+
+
+def _skeleton(tree, facets_query_size, schema=None):
+    """
+    returns the query dsl of the type filter, nested clauses and facets
+    of a tree, with its must list
+    """
+    must_list = []
+    type_filter = tree.type_filter
+    if type(type_filter) is TypeTerms:
+        must_list.append({"terms": {"_type": list(type_filter.names)}})
+    elif type_filter is not None:
+        must_list.append({"type": {"value": type_filter.name}})
+    for nested in tree.nested:
+        must_list.append(nested_dsl(
+            nested.path, emit_filter_string(nested.filter)))
+    facets = {}
+    for facet in tree.facets:
+        field = nested_path = None
+        if schema is not None:
+            schema_field = schema.field(facet.field)
+            if schema_field is not None:
+                field = schema_field.facet_field
+                nested_path = schema_field.nested_path
+        facets.update(facet_dsl(
+            facet.field, emit_filter_string(facet.filter)
+            if facet.filter is not None else None, facets_query_size,
+            field, nested_path))
+    query_dsl = {
+        "query": {
+            "filtered": {
+                "filter": {
+                    "bool": {
+                        "must": must_list,
+                        "should": [],
+                        "must_not": []
+                    }
+                }
+            }
+        },
+        "facets": facets
+    }
+    return query_dsl, must_list
+
+
+def _set_query_string(query_dsl, query, default_operator):
+    query_dsl["query"]["filtered"]["query"] = {
+        "query_string": {
+            "query": query,
+            "default_operator": default_operator
+        }
+    }
+
+
+def emit_query_dsl(tree, global_filters=None,
+                   facets_query_size=DEFAULT_FACETS_QUERY_SIZE,
+                   default_operator=DEFAULT_OPERATOR):
+    """
+    returns the query dsl of a SearchQuery, the same one get_query_dsl
+    returns for the query string it was parsed from
+    """
+    query_dsl = _skeleton(tree, facets_query_size)[0]
+    if tree.query is not None:
+        _set_query_string(
+            query_dsl, emit_query_string(tree.query), default_operator)
+    return add_global_filters(query_dsl, global_filters)
+
+
+def _signed_clauses(atoms):
+    """
+    returns (negated, clause, text) for the clauses of a chain joined by
+    AND, negated for the ones after NOT or ! or starting with - or !, and
+    text the query string of the clause as written. None when a negation
+    has no clause of its own after it.
+    """
+    clauses = []
+    negation = None
+    for atom in atoms:
+        if type(atom) is Term and atom.text in NEGATIONS:
+            if negation is not None:
+                return None
+            negation = atom.text
+            continue
+        text = emit_query_string(atom)
+        negated = negation is not None
+        if type(atom) is Compare and atom.field[:1] in PREFIX_OPERATORS:
+            if negated:
+                return None
+            negated = atom.field[0] != u'+'
+            atom = atom.replace(field=atom.field[1:])
+        if negation is not None:
+            text = u'{} {}'.format(negation, text)
+        clauses.append((negated, atom, text))
+        negation = None
+    if negation is not None:
+        return None
+    return clauses
+
+
+def emit_structured_dsl(tree, global_filters=None,
+                        facets_query_size=DEFAULT_FACETS_QUERY_SIZE,
+                        default_operator=DEFAULT_OPERATOR, schema=None):
+    """
+    returns the query dsl of a SearchQuery with its compare expressions
+    as term and range filters, joined by bool filters, in the cached
+    filter context, and the negated ones of a chain joined by AND as
+    must_not filters. Free text and values with wildcards, groups and
+    the like stay in the query_string query, and so does the whole query
+    when they are joined to the rest by OR, the operators are mixed or
+    the grammar split up a paren or quote.
+    A schema picks the filter of each field and rejects unknown fields.
+    """
+    if schema is not None:
+        _check_tree(tree, schema)
+    query_dsl, must_list = _skeleton(tree, facets_query_size, schema)
+    query = tree.query
+    if query is not None:
+        tokens = flatten(query)
+        operator = joining_operator(tokens, default_operator.upper())
+        atoms = [token for token in tokens if isinstance(token, Node)]
+        clauses = None
+        if operator == u'AND' and all(is_plain(atom) for atom in atoms):
+            clauses = _signed_clauses(atoms)
+        free_text = []
+        if clauses is not None:
+            must_not_list = query_dsl[
+                'query']['filtered']['filter']['bool']['must_not']
+            for negated, clause, text in clauses:
+                query_filter = emit_filter(clause, default_operator, schema)
+                if query_filter is None:
+                    free_text.append(text)
+                elif negated:
+                    must_not_list.append(query_filter)
+                else:
+                    must_list.append(query_filter)
+        else:
+            query_filter = emit_filter(query, default_operator, schema)
+            if query_filter is None:
+                free_text.append(emit_query_string(query))
+            else:
+                must_list.append(query_filter)
+        if free_text:
+            joiner = u' ' if default_operator.upper() == u'AND' else u' AND '
+            _set_query_string(
+                query_dsl, joiner.join(free_text), default_operator)
+    return add_global_filters(query_dsl, global_filters)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+
+class PlasticParserError(Exception):
+    pass
+
+
+class QueryError(PlasticParserError):
+    """
+    A query string that could not be turned into a query dsl.
+    """
+    def __init__(self, query_string, reason):
+        super(QueryError, self).__init__(query_string, reason)
+        self.query_string = query_string
+        self.reason = reason
+
+    def __str__(self):
+        return "{}: {!r}".format(self.reason, self.query_string)
+
+
+class QuerySyntaxError(QueryError):
+    """
+    A query string rejected by validate. offset is where in the query
+    string the expected token is missing.
+    """
+    def __init__(self, query_string, offset, expected, reason=None):
+        super(QuerySyntaxError, self).__init__(
+            query_string,
+            reason or "expected {} at offset {}".format(expected, offset))
+        self.args = (query_string, offset, expected, self.reason)
+        self.offset = offset
+        self.expected = expected
+
+
+class ParseTimeout(QueryError):
+    """
+    A query that was not parsed within timeout seconds.
+    """
+    def __init__(self, query_string, timeout):
+        super(ParseTimeout, self).__init__(
+            query_string, "not parsed within {} seconds".format(timeout))
+        self.args = (query_string, timeout)
+        self.timeout = timeout
+
+
+class ParseCancelled(QueryError):
+    """
+    A query whose parse was cancelled before it started.
+    """
+    def __init__(self, query_string):
+        super(ParseCancelled, self).__init__(query_string, "cancelled")
+        self.args = (query_string,)
+
+
+class QueryLimitExceeded(QueryError):
+    """
+    A query string over one of the limits set with set_limits. limit is
+    the limit and value how far the query string went.
+    """
+    description = "{value} over the limit of {limit}"
+
+    def __init__(self, query_string, limit, value):
+        super(QueryLimitExceeded, self).__init__(
+            query_string, self.description.format(limit=limit, value=value))
+        self.args = (query_string, limit, value)
+        self.limit = limit
+        self.value = value
+
+    def __str__(self):
+        # hostile queries can be long
+        return "{}: {!r}".format(self.reason, self.query_string[:200])
+
+
+class QueryTooLong(QueryLimitExceeded):
+    description = "{value} characters, more than the {limit} allowed"
+
+
+class TooManyClauses(QueryLimitExceeded):
+    description = "more than the {limit} clauses allowed"
+
+
+class QueryTooDeep(QueryLimitExceeded):
+    description = "parens nested deeper than the {limit} allowed"
+
+
+class TooManyEntries(QueryLimitExceeded):
+    description = "more than the {limit} facets and nested entries allowed"
+
+
+class ParseBudgetExceeded(QueryLimitExceeded):
+    """
+    A parse stopped for going over its budget.
+    """
+
+
+class ParseStepsExceeded(ParseBudgetExceeded):
+    description = "more than the {limit} parse steps allowed"
+
+
+class ParseTimeExceeded(ParseBudgetExceeded):
+    description = "parsing took longer than the {limit} seconds allowed"
+
+
+class UnknownFieldError(QueryError):
+    """
+    A field or nested path that the schema a query is compiled with
+    does not have.
+    """
+    def __init__(self, query_string, field):
+        super(UnknownFieldError, self).__init__(
+            query_string, "unknown field {!r}".format(field))
+        self.args = (query_string, field)
+        self.field = field
+
+
+class UnsatisfiableQuery(QueryError):
+    """
+    A query that the optimizer proved no document can match, so that it
+    need not be sent.
+    """
+    def __init__(self, query_string):
+        super(UnsatisfiableQuery, self).__init__(
+            query_string, "no document can match")
+        self.args = (query_string,)
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+A hand written recursive descent parser for the grammar built in
+tokenizer._construct_grammar. Every method mirrors one grammar element,
+including where pyparsing skips whitespace, and tokenize returns the same
+dict as tokenizer.tokenize without going through pyparsing.
+"""
+import re
+
+from pyparsing import ParseException
+
+from .grammar_parsers import (
+    DEFAULT_FACETS_QUERY_SIZE, DEFAULT_OPERATOR, parse_context, Facets,
+    parse_compare_expression, parse_facet_compare_expression,
+    parse_free_text, parse_single_facet_expression,
+    parse_single_nested_expression, parse_type_expression,
+    split_query_tokens, build_query_dsl)
+from .limits import step
+from .tokenizer import PRINTABLES_PATTERN, _sanitize_query
+
+WHITESPACE = u' \n\t\r'
+
+KEY = re.compile(PRINTABLES_PATTERN.format(re.escape(u':(')), re.UNICODE)
+# a key, the whitespace pyparsing skips and the longest operator of
+# oneOf(": :< :> :<= :>= :=")
+KEY_AND_OPERATOR = re.compile(
+    u'({})[ \n\t\r]*(:(?:<=|>=|[<>=])?)'.format(KEY.pattern), re.UNICODE)
+WORD = re.compile(PRINTABLES_PATTERN.format(re.escape(u')')), re.UNICODE)
+FREE_TEXT = re.compile(PRINTABLES_PATTERN.format(u''), re.UNICODE)
+QUOTED_WORD = re.compile(r'"(?:[^"\n\r\\]|(?:\\.))*"')
+
+TYPE_KEYWORD = re.compile(u'[type]+')
+TYPE_SEPARATOR = re.compile(u'[:]+')
+TYPE_VALUE = re.compile(u'[a-zA-Z0-9]+')
+FACETS_KEYWORD = re.compile(u'[facets:]+[ \n\t\r]*[[]+')
+NESTED_KEYWORD = re.compile(u'[nested:]+[ \n\t\r]*[[]+')
+FIELD = re.compile(u'[a-zA-Z0-9_.]+')
+CLOSE_BRACKETS = re.compile(u'[\\]]+')
+OPEN_PARENS = re.compile(u'[(]+')
+CLOSE_PARENS = re.compile(u'[)]+')
+
+
+class Parser(object):
+    """
+    Parses one sanitized query string. Every element method takes the
+    position to start at and returns (end, tokens), or None when the
+    element does not match there.
+    """
+    def __init__(self, query):
+        self.query = query
+        self.length = len(query)
+
+    def skip(self, pos):
+        query = self.query
+        if query[pos:pos + 1] not in WHITESPACE:
+            return pos
+        length = self.length
+        while pos < length and query[pos] in WHITESPACE:
+            pos += 1
+        return pos
+
+    def match(self, pattern, pos):
+        if self.query[pos:pos + 1] in u' \n\t\r':
+            pos = self.skip(pos)
+        return pattern.match(self.query, pos)
+
+    def literal(self, char, pos):
+        pos = self.skip(pos)
+        if self.query[pos:pos + 1] == char:
+            return pos + 1
+        return -1
+
+    def logical_operator(self, pos):
+        query = self.query
+        start = self.skip(pos)
+        if query[start:start + 3].upper() == u'AND':
+            return start + 3, u'AND'
+        if query[start:start + 2].upper() == u'OR':
+            return start + 2, u'OR'
+        # White().suppress() matches the skipped whitespace itself
+        if start > pos:
+            return start, None
+        return None
+
+    def value(self, pos):
+        pos = self.skip(pos)
+        match = QUOTED_WORD.match(self.query, pos) or \
+            WORD.match(self.query, pos)
+        if match is None:
+            return None
+        return match.end(), match.group()
+
+    def key_and_operator(self, pos):
+        match = self.match(KEY_AND_OPERATOR, pos)
+        if match is None:
+            return None
+        return match.end(), match.group(1), match.group(2)
+
+    def compare_expression(self, pos):
+        result = self.key_and_operator(pos)
+        if result is None:
+            return None
+        pos, key, operator = result
+        result = self.value(pos)
+        if result is None:
+            return None
+        return result[0], parse_compare_expression(
+            (key, operator, result[1]))
+
+    def base_logical_expression(self, pos):
+        result = self.compare_expression(pos)
+        if result is None:
+            match = self.match(FREE_TEXT, pos)
+            if match is None:
+                return None
+            return match.end(), parse_free_text((match.group(),))
+        pos, compare = result
+        operator = self.logical_operator(pos)
+        if operator is not None:
+            second = self.compare_expression(operator[0])
+            if second is not None:
+                if operator[1] is None:
+                    return second[0], u' '.join((compare, second[1]))
+                return second[0], u' '.join(
+                    (compare, operator[1], second[1]))
+        return pos, compare
+
+    def logical_expression(self, pos):
+        start = self.literal(u'(', pos)
+        if start >= 0:
+            result = self.base_logical_expression(start)
+            if result is not None:
+                end = self.literal(u')', result[0])
+                if end >= 0:
+                    return end, u'({})'.format(result[1])
+        return self.base_logical_expression(pos)
+
+    def paren_value(self, pos):
+        pos = self.literal(u'(', pos)
+        if pos < 0:
+            return None
+        words = []
+        matched = False
+        while True:
+            operator = self.logical_operator(pos)
+            if operator is not None:
+                pos = operator[0]
+                if operator[1] is not None:
+                    words.append(operator[1])
+            else:
+                result = self.value(pos)
+                if result is None:
+                    break
+                pos = result[0]
+                words.append(result[1])
+            matched = True
+        if not matched:
+            return None
+        pos = self.literal(u')', pos)
+        if pos < 0:
+            return None
+        return pos, u'({})'.format(u' '.join(words))
+
+    def facet_compare_expression(self, pos):
+        result = self.key_and_operator(pos)
+        if result is None:
+            return None
+        pos, key, operator = result
+        result = self.paren_value(pos)
+        if result is None:
+            return None
+        return result[0], parse_facet_compare_expression(
+            (key, operator, result[1]))
+
+    def facet_base_logical_expression(self, pos):
+        result = self.facet_compare_expression(pos)
+        if result is None:
+            return self.value(pos)
+        pos, compare = result
+        operator = self.logical_operator(pos)
+        if operator is None:
+            return pos, compare
+        if operator[1] is None:
+            return operator[0], compare
+        return operator[0], u' '.join((compare, operator[1]))
+
+    def facet_logical_expression(self, pos):
+        start = self.literal(u'(', pos)
+        if start >= 0:
+            result = self.facet_base_logical_expression(start)
+            if result is not None:
+                end = self.literal(u')', result[0])
+                if end >= 0:
+                    return end, u'({})'.format(result[1])
+        return self.facet_base_logical_expression(pos)
+
+    def filter_expression(self, pos):
+        match = self.match(OPEN_PARENS, pos)
+        if match is None:
+            return None
+        pos = match.end()
+        expressions = []
+        while True:
+            result = self.facet_logical_expression(pos)
+            if result is None:
+                break
+            pos = result[0]
+            expressions.append(result[1])
+        if not expressions:
+            return None
+        match = self.match(CLOSE_PARENS, pos)
+        if match is None:
+            return None
+        return match.end(), u' '.join(expressions)
+
+    def field_with_filter(self, pos):
+        step()
+        match = self.match(FIELD, pos)
+        if match is None:
+            return None
+        tokens = [match.group()]
+        pos = match.end()
+        result = self.filter_expression(pos)
+        if result is not None:
+            pos = result[0]
+            tokens.append(result[1])
+        return pos, tokens
+
+    def single_facet_expression(self, pos):
+        result = self.field_with_filter(pos)
+        if result is None:
+            return None
+        return result[0], parse_single_facet_expression(result[1])
+
+    def single_nested_expression(self, pos):
+        result = self.field_with_filter(pos)
+        # a nested path without a filter does not match
+        if result is None or len(result[1]) < 2:
+            return None
+        return result[0], parse_single_nested_expression(result[1])
+
+    def bracketed_list(self, keyword, parse_entry, pos):
+        match = self.match(keyword, pos)
+        if match is None:
+            return None
+        pos = match.end()
+        entries = []
+        while True:
+            result = parse_entry(pos)
+            if result is None:
+                break
+            pos = result[0]
+            entries.append(result[1])
+            comma = self.literal(u',', pos)
+            if comma >= 0:
+                pos = comma
+        if not entries:
+            return None
+        match = self.match(CLOSE_BRACKETS, pos)
+        if match is None:
+            return None
+        return match.end(), entries
+
+    def facets_expression(self, pos):
+        result = self.bracketed_list(
+            FACETS_KEYWORD, self.single_facet_expression, pos)
+        if result is None:
+            return None
+        facets = {}
+        for facet in result[1]:
+            facets.update(facet)
+        return result[0], Facets(facets)
+
+    def nested_expression(self, pos):
+        result = self.bracketed_list(
+            NESTED_KEYWORD, self.single_nested_expression, pos)
+        if result is None:
+            return None
+        # only the first nested path is kept, as in
+        # parse_base_nested_expression
+        return result[0], result[1][0]
+
+    def type_expression(self, pos):
+        tokens = []
+        for pattern in (TYPE_KEYWORD, TYPE_SEPARATOR, TYPE_VALUE):
+            match = self.match(pattern, pos)
+            if match is None:
+                return None
+            pos = match.end()
+            tokens.append(match.group())
+        start = self.skip(pos)
+        if self.query[start:start + 3].upper() == u'AND':
+            pos = start + 3
+        return pos, parse_type_expression((tokens[0], tokens[2]))
+
+    def clause(self, pos):
+        """
+        parses one top level expression and the logical operator after it
+        """
+        step()
+        result = self.facets_expression(pos) or \
+            self.nested_expression(pos) or \
+            self.logical_expression(pos)
+        if result is None:
+            return None
+        pos, tokens = result[0], [result[1]]
+        operator = self.logical_operator(pos)
+        if operator is not None:
+            pos = operator[0]
+            if operator[1] is not None:
+                tokens.append(operator[1])
+        return pos, tokens
+
+    def parse(self):
+        tokens = []
+        pos = 0
+        result = self.type_expression(pos)
+        if result is not None:
+            pos = result[0]
+            tokens.append(result[1])
+        expressions = []
+        # every expression needs at least one character
+        while self.skip(pos) < self.length:
+            result = self.clause(pos)
+            if result is None:
+                break
+            pos = result[0]
+            expressions.extend(result[1])
+        pos = self.skip(pos)
+        if pos != self.length:
+            raise ParseException(self.query, pos, "Expected end of text")
+        tokens.extend(split_query_tokens(expressions))
+        return build_query_dsl(tokens)
+
+
+def tokenize(query_string, facets_query_size=DEFAULT_FACETS_QUERY_SIZE,
+             default_operator=DEFAULT_OPERATOR):
+    parser = Parser(_sanitize_query(query_string))
+    with parse_context(facets_query_size, default_operator):
+        return parser.parse()
@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
-import plasticparser
+import re
+import threading
+from contextlib import contextmanager
+
+DEFAULT_FACETS_QUERY_SIZE = 20
+DEFAULT_OPERATOR = 'and'
 
 RESERVED_CHARS = ('\\', '+', '-', '&&',
                   '||', '!', '(', ')',
@@ -7,6 +12,43 @@ RESERVED_CHARS = ('\\', '+', '-', '&&',
                   '^', '~', '*',
                   '?', '/')
 
+# global filter entries that are elasticsearch filters already
+FILTER_TYPES = frozenset(['term', 'terms', 'range', 'exists', 'missing',
+                          'prefix'])
+
+class ParseContext(object):
+    """
+    Options of a single parse, read by the parse actions.
+    """
+    def __init__(self, facets_query_size=DEFAULT_FACETS_QUERY_SIZE,
+                 default_operator=DEFAULT_OPERATOR):
+        self.facets_query_size = facets_query_size
+        self.default_operator = default_operator
+
+
+_default_context = ParseContext()
+_local = threading.local()
+
+
+def get_parse_context():
+    return getattr(_local, 'context', _default_context)
+
+
+@contextmanager
+def parse_context(facets_query_size=DEFAULT_FACETS_QUERY_SIZE,
+                  default_operator=DEFAULT_OPERATOR):
+    """
+    makes the given options visible to the parse actions run by this
+    thread until the block exits
+    """
+    previous = get_parse_context()
+    _local.context = ParseContext(facets_query_size, default_operator)
+    try:
+        yield _local.context
+    finally:
+        _local.context = previous
+
+
 class Facets(object):
     def __init__(self, facets_dsl):
         self.facets_dsl = facets_dsl
@@ -39,31 +81,37 @@ class Query(object):
         return self.query.strip()
 
 
+def _reserved_chars_pattern(excluded_chars):
+    return re.compile(u'|'.join(
+        re.escape(char) for char in RESERVED_CHARS
+        if char not in excluded_chars))
+
+
+# escaping every reserved character in one pass gives the same result as
+# replacing them one after another: the backslash each escape adds is only
+# reserved itself, and it is the first character replaced
+ESCAPE = u'\\\\\\g<0>'
+VALUE_RESERVED_CHARS = _reserved_chars_pattern(['('])
+FACET_VALUE_RESERVED_CHARS = _reserved_chars_pattern(['"', '(', ')'])
+FREE_TEXT_RESERVED_CHARS = _reserved_chars_pattern(['(', ')'])
+
+
 def sanitize_value(value):
     if not isinstance(value, basestring):
         return value
-    for char in RESERVED_CHARS:
-        if char not in "(":
-            value = value.replace(char, u'\{}'.format(char))
-    return value
+    return VALUE_RESERVED_CHARS.sub(ESCAPE, value)
 
 
 def sanitize_facet_value(value):
     if not isinstance(value, basestring):
         return value
-    for char in RESERVED_CHARS:
-        if char not in ['"', '(', ')']:
-            value = value.replace(char, u'\{}'.format(char))
-    return value
+    return FACET_VALUE_RESERVED_CHARS.sub(ESCAPE, value)
 
 
 def sanitize_free_text(value):
     if not isinstance(value, basestring):
         return value
-    for char in RESERVED_CHARS:
-        if char not in ['(', ')']:
-            value = value.replace(char, u'\{}'.format(char))
-    return value
+    return FREE_TEXT_RESERVED_CHARS.sub(ESCAPE, value)
 
 
 def parse_free_text(tokens):
@@ -87,7 +135,10 @@ def parse_paren_base_logical_expression(tokens):
 
 
 def default_parse_func(tokens):
-    token_list = tokens.asList()
+    return split_query_tokens(tokens.asList())
+
+
+def split_query_tokens(token_list):
     return_list = []
     for token in token_list:
         if isinstance(token, Nested):
@@ -114,11 +165,15 @@ def parse_type_expression(tokens):
 
 
 def parse_type_logical_facets_expression(tokens):
+    return build_query_dsl(tokens.asList())
+
+
+def build_query_dsl(token_list):
     must_list = []
     should_list = []
     must_not_list = []
     facets = {}
-    for token in tokens.asList():
+    for token in token_list:
         if isinstance(token, Nested):
             nested = token.get_query()
             must_list.append(nested)
@@ -147,36 +202,173 @@ def parse_type_logical_facets_expression(tokens):
         query_dsl["query"]["filtered"]["query"] = {
             "query_string": {
                 "query": query,
-                "default_operator": getattr(
-                    plasticparser, 'DEFAULT_OPERATOR', 'and')
+                "default_operator": get_parse_context().default_operator
             }
         }
     return query_dsl
 
 
+def _hashable(value):
+    """
+    returns a key of a json value that is equal only for values encoded
+    the same; True, 1 and 1.0 are equal in python
+    """
+    if isinstance(value, dict):
+        return tuple(sorted(
+            (_hashable(key), _hashable(val))
+            for key, val in value.iteritems()))
+    if isinstance(value, list):
+        return tuple(_hashable(val) for val in value)
+    if isinstance(value, basestring):
+        return value
+    return type(value), value
+
+
+def _as_filter(entry):
+    """
+    returns the filter of a global filter entry: {field: value} is a
+    term filter, and an elasticsearch filter such as
+    {"range": {field: {"gte": 1}}} or {"exists": {"field": field}} is
+    used as it is
+    """
+    if len(entry) == 1:
+        filter_type, body = next(entry.iteritems())
+        if filter_type in FILTER_TYPES and isinstance(body, dict):
+            return entry
+    return {"term": entry}
+
+
+def _term_values(query_filter):
+    """
+    returns the field of a term or terms filter and the values it
+    matches any of, None for other filters
+    """
+    filter_type, body = next(query_filter.iteritems())
+    if filter_type not in ('term', 'terms') or len(body) != 1:
+        return None
+    field, values = next(body.iteritems())
+    if not isinstance(values, list):
+        values = [values]
+    return field, values
+
+
+def compile_global_filters(entries, merge_terms):
+    """
+    returns the filters of a list of global filter entries without
+    duplicates. With merge_terms, the values of every field that has
+    more than one entry go into a single terms filter, which matches the
+    same as any of the entries.
+    """
+    filters = []
+    seen = set()
+    # field: [index in filters, values, hashable values, merged]
+    terms = {}
+    for entry in entries:
+        query_filter = _as_filter(entry)
+        term = _term_values(query_filter) if merge_terms else None
+        if term is None:
+            key = _hashable(query_filter)
+            if key not in seen:
+                seen.add(key)
+                filters.append(query_filter)
+            continue
+        field, values = term
+        merged = terms.get(field)
+        if merged is None:
+            terms[field] = [len(filters), list(values),
+                            set(_hashable(value) for value in values), False]
+            filters.append(query_filter)
+            continue
+        for value in values:
+            value_key = _hashable(value)
+            if value_key not in merged[2]:
+                merged[2].add(value_key)
+                merged[1].append(value)
+                merged[3] = True
+    for field, (index, values, _, merged) in terms.iteritems():
+        if merged:
+            filters[index] = {"terms": {field: values}}
+    return filters
+
+
+def _implied_terms(filters):
+    terms = set()
+    for query_filter in filters:
+        term = _term_values(query_filter)
+        if term is not None and len(term[1]) == 1:
+            terms.add((term[0], _hashable(term[1][0])))
+    return terms
+
+
+def add_global_filters(query_dsl, global_filters):
+    """
+    adds the term, range and exists filters of global_filters['and'],
+    ['or'] and ['not'] to the must, should and must_not lists of a query
+    dsl, and global_filters['sort'] as its sort. Filters the query dsl
+    already has are left out, and when one of the 'or' filters already
+    must match they are all left out.
+    """
+    global_filters = global_filters if global_filters else {}
+    bool_lists = query_dsl['query']['filtered']['filter']['bool']
+    must_list = bool_lists['must']
+    implied = set(_hashable(query_filter) for query_filter in must_list)
+    for query_filter in compile_global_filters(
+            global_filters.get('and', []), False):
+        if _hashable(query_filter) not in implied:
+            implied.add(_hashable(query_filter))
+            must_list.append(query_filter)
+    should_filters = compile_global_filters(global_filters.get('or', []), True)
+    if should_filters and not bool_lists['should']:
+        implied_terms = _implied_terms(must_list)
+        for query_filter in should_filters:
+            term = _term_values(query_filter)
+            if _hashable(query_filter) in implied or term is not None and any(
+                    (term[0], _hashable(value)) in implied_terms
+                    for value in term[1]):
+                should_filters = []
+                break
+    bool_lists['should'].extend(should_filters)
+    bool_lists['must_not'].extend(
+        compile_global_filters(global_filters.get('not', []), True))
+    query_dsl['sort'] = global_filters.get('sort', [])
+    return query_dsl
+
+
 def parse_single_facet_expression(tokens):
-    facet_key = tokens[0]
+    return facet_dsl(tokens[0], tokens[1] if len(tokens) > 1 else None,
+                     get_parse_context().facets_query_size)
+
+
+def facet_dsl(facet_key, filter_query, facets_query_size, field=None,
+              nested_path=None):
+    """
+    returns the facet of facet_key. Without a field it counts the last
+    part of the key with _nonngram added, and is nested in the rest of
+    the key when it has a filter; a field from a schema is nested in
+    nested_path.
+    """
     filters = {
         facet_key: {}
     }
-    field = facet_key
-    if "." in facet_key:
-        nested_keys = facet_key.split(".")
-        nested_field = u".".join(nested_keys[:-1])
-        field = nested_keys[-1]
-
-    field = "{}_nonngram".format(field)
-    filters[facet_key]["terms"] = {"field": field, "size": getattr(
-        plasticparser, 'FACETS_QUERY_SIZE', 20)}
-    if len(tokens) > 1:
+    if field is None:
+        field = facet_key
+        if "." in facet_key:
+            nested_keys = facet_key.split(".")
+            if filter_query is not None:
+                nested_path = u".".join(nested_keys[:-1])
+            field = nested_keys[-1]
+        field = "{}_nonngram".format(field)
+    filters[facet_key]["terms"] = {
+        "field": field, "size": facets_query_size}
+    if filter_query is not None:
         filters[facet_key]["facet_filter"] = {
             "query": {
-                "query_string": {"query": tokens[1], "default_operator": "and"}
+                "query_string": {"query": filter_query, "default_operator": "and"}
             }
         }
 
-    if len(tokens) > 1 and "." in facet_key:
-        filters[facet_key]['nested'] = nested_field
+    if nested_path is not None:
+        filters[facet_key]['nested'] = nested_path
     return filters
 
 
@@ -204,14 +396,18 @@ def parse_base_nested_expression(tokens):
 
 
 def parse_single_nested_expression(tokens):
-    return Nested({
+    return Nested(nested_dsl(tokens[0], tokens[1]))
+
+
+def nested_dsl(path, filter_query):
+    return {
         "nested": {
-            "path": tokens[0],
+            "path": path,
             "query": {
                 "query_string": {
-                    "query": tokens[1],
+                    "query": filter_query,
                     "default_operator": "and"
                 }
             }
         }
-    })
+    }
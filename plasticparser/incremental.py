@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Parsing for search as you type. A ParseSession is fed the whole query
+string on every keystroke and parses again only the clauses after the
+last one the edit cannot have changed.
+"""
+import re
+
+from pyparsing import ParseException
+
+from . import plasticparser
+from .cache import copy_dsl
+from .exceptions import QueryLimitExceeded
+from .fast_tokenizer import Parser, QUOTED_WORD
+from .grammar_parsers import (
+    DEFAULT_FACETS_QUERY_SIZE, DEFAULT_OPERATOR, parse_context,
+    split_query_tokens, build_query_dsl, add_global_filters)
+from .tokenizer import _sanitize_query
+
+COMPLETE = 'complete'
+INVALID = 'invalid'
+INSIDE_QUOTE = 'inside unterminated quote'
+INSIDE_FACETS = 'inside facets:['
+INSIDE_NESTED = 'inside nested:['
+AFTER_KEY = 'after key:'
+INSIDE_PARENS = 'inside unclosed paren'
+
+# every element but a quoted value reads at most the whitespace and the two
+# runs of other characters that follow the position it starts at
+LOOKAHEAD = re.compile(u'[ \n\t\r]*[^ \n\t\r]*[ \n\t\r]*[^ \n\t\r]*')
+LINE_END = re.compile(u'[\n\r]')
+QUOTES = re.compile(r'"(?:[^"\n\r\\]|(?:\\.))*("?)')
+OPEN_LIST = re.compile(u'(facets|nested)[ \n\t\r]*:[ \n\t\r]*\\[')
+TRAILING_KEY = re.compile(u'(?:^|\\s)[^\\s:(]+[ \n\t\r]*:(?:<=|>=|[<>=])?$',
+                          re.UNICODE)
+
+
+class TrackingParser(Parser):
+    """
+    A Parser that keeps in horizon the end of the part of the query it
+    has read so far. Having read up to the end of the query counts as
+    reading one character past it.
+    """
+    def __init__(self, query):
+        super(TrackingParser, self).__init__(query)
+        self.horizon = 0
+
+    def read_up_to(self, end):
+        if end > self.horizon:
+            self.horizon = end
+
+    def skip(self, pos):
+        self.read_up_to(LOOKAHEAD.match(self.query, pos).end() + 1)
+        return Parser.skip(self, pos)
+
+    def match(self, pattern, pos):
+        self.read_up_to(LOOKAHEAD.match(self.query, pos).end() + 1)
+        return Parser.match(self, pattern, pos)
+
+    def value(self, pos):
+        start = self.skip(pos)
+        if self.query[start:start + 1] == u'"':
+            match = QUOTED_WORD.match(self.query, start)
+            if match is not None:
+                self.read_up_to(match.end())
+            else:
+                line_end = LINE_END.search(self.query, start)
+                self.read_up_to(line_end.end() if line_end is not None
+                                else self.length + 1)
+        return Parser.value(self, pos)
+
+
+def _common_prefix_length(first, second):
+    length = min(len(first), len(second))
+    if first[:length] == second[:length]:
+        return length
+    low, high = 0, length
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[:middle] == second[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def get_partial_state(query, complete):
+    """
+    returns where a query that is still being typed leaves off,
+    one of the states defined in this module
+    """
+    quote = None
+    for quote in QUOTES.finditer(query):
+        pass
+    if quote is not None and not quote.group(1):
+        return INSIDE_QUOTE
+    open_list = None
+    for open_list in OPEN_LIST.finditer(query):
+        pass
+    if open_list is not None and u']' not in query[open_list.end():]:
+        return INSIDE_FACETS if open_list.group(1) == u'facets' \
+            else INSIDE_NESTED
+    if TRAILING_KEY.search(query):
+        return AFTER_KEY
+    if query.count(u'(') > query.count(u')'):
+        return INSIDE_PARENS
+    return COMPLETE if complete else INVALID
+
+
+class PartialQuery(object):
+    """
+    The result of feeding a query string to a ParseSession.
+    dsl is the query dsl, or None with the exception in error when the
+    query does not parse. reused is how many characters of the query
+    were not parsed again.
+    """
+    def __init__(self, query_string, dsl, error, state, reused):
+        self.query_string = query_string
+        self.dsl = dsl
+        self.error = error
+        self.state = state
+        self.reused = reused
+
+
+class ParseSession(object):
+    """
+    Parses successive versions of one query string, as typed into a
+    search box, with the fast engine. Every clause is kept with the part
+    of the query read to parse it; the clauses the edit lies beyond are
+    reused and only the rest of the query is parsed again.
+
+    param: limits : the QueryLimits of the queries fed, by default those
+     set with set_limits. A query over a limit has the QueryLimitExceeded
+     as its error.
+    """
+    def __init__(self, global_filters=None,
+                 facets_query_size=DEFAULT_FACETS_QUERY_SIZE,
+                 default_operator=DEFAULT_OPERATOR, limits=None):
+        self.global_filters = global_filters
+        self.facets_query_size = facets_query_size
+        self.default_operator = default_operator
+        self.limits = limits
+        self._query = None
+        self._result = None
+        self._type_tokens = []
+        self._expressions = []
+        # (position, horizon, number of expressions) after each clause
+        self._checkpoints = []
+
+    def feed(self, query_string):
+        """
+        parses the current text of the query and returns a PartialQuery
+        """
+        query = _sanitize_query(query_string)
+        if query == self._query:
+            return self._result
+        limits = self.limits if self.limits is not None \
+            else plasticparser.get_limits()
+        try:
+            with parse_context(self.facets_query_size,
+                               self.default_operator):
+                if limits is None:
+                    result = self._parse(query_string, query)
+                else:
+                    limits.check(query_string)
+                    with limits.budget(query_string):
+                        result = self._parse(query_string, query)
+        except QueryLimitExceeded as error:
+            # the clauses kept may be of the query that was cut short
+            self._query = self._result = None
+            self._checkpoints = []
+            return PartialQuery(query_string, None, error,
+                                get_partial_state(query, False), 0)
+        self._query = query
+        self._result = result
+        return result
+
+    def _restore(self, parser, query):
+        unchanged = _common_prefix_length(query, self._query) \
+            if self._query is not None else 0
+        checkpoints = self._checkpoints
+        index = len(checkpoints) - 1
+        while index >= 0 and checkpoints[index][1] > unchanged:
+            index -= 1
+        if index < 0:
+            return None
+        del checkpoints[index + 1:]
+        pos, parser.horizon, count = checkpoints[index]
+        del self._expressions[count:]
+        return pos
+
+    def _parse(self, query_string, query):
+        parser = TrackingParser(query)
+        pos = self._restore(parser, query)
+        reused = pos or 0
+        if pos is None:
+            pos = 0
+            self._type_tokens = []
+            self._expressions = []
+            result = parser.type_expression(pos)
+            if result is not None:
+                pos = result[0]
+                self._type_tokens.append(result[1])
+            self._checkpoints = [(pos, parser.horizon, 0)]
+        expressions = self._expressions
+        while parser.skip(pos) < parser.length:
+            result = parser.clause(pos)
+            if result is None:
+                break
+            pos = result[0]
+            expressions.extend(result[1])
+            self._checkpoints.append(
+                (pos, parser.horizon, len(expressions)))
+        end = parser.skip(pos)
+        dsl, error = None, None
+        if end != parser.length:
+            error = ParseException(query, end, "Expected end of text")
+        else:
+            try:
+                dsl = build_query_dsl(self._type_tokens + split_query_tokens(
+                    list(expressions)))
+            except TypeError as type_error:
+                error = type_error
+            else:
+                dsl = add_global_filters(copy_dsl(dsl), self.global_filters)
+        return PartialQuery(query_string, dsl, error,
+                            get_partial_state(query, error is None), reused)
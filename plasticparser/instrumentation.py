@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Optional timings and counters for each parse. Nothing is measured until
+a callback is set or a collect() block is entered; parses then go
+through a separately built, instrumented copy of the grammar, so the
+shared grammar never pays for it.
+"""
+import random
+import threading
+import timeit
+from contextlib import contextmanager
+
+from pyparsing import ParserElement
+
+from .fast_tokenizer import Parser
+from .grammar_parsers import parse_context
+from .limits import step
+from .tokenizer import _construct_grammar, _sanitize_query, WARM_UP_QUERY
+
+# the elements of fast_tokenizer.Parser that are counted
+PARSER_ELEMENTS = (
+    'clause', 'logical_expression', 'base_logical_expression',
+    'compare_expression', 'key_and_operator', 'value', 'paren_value',
+    'facet_logical_expression', 'facet_base_logical_expression',
+    'facet_compare_expression', 'filter_expression',
+    'single_facet_expression', 'single_nested_expression',
+    'facets_expression', 'nested_expression', 'type_expression')
+
+# the names tokenizer gives the grammar elements, every one with a parse
+# action among them
+NAMED_ELEMENTS = frozenset([
+    'query', 'type_expression', 'clauses', 'clause', 'facets_expression',
+    'facets', 'facet', 'facet_filter', 'nested_expression', 'nesteds',
+    'nested', 'nested_filter', 'paren_logical_expression',
+    'logical_expression', 'compare_expression', 'free_text',
+    'paren_facet_logical_expression', 'facet_logical_expression',
+    'facet_compare_expression', 'paren_value', 'paren_words'])
+
+timer = timeit.default_timer
+
+_callback = None
+_sample_rate = 1.0
+_local = threading.local()
+# collect() blocks open in any thread, so that start can return at once
+# while nothing is measured
+_collecting = 0
+_collecting_lock = threading.Lock()
+
+
+class ParseStats(object):
+    """
+    What one parse cost. timings maps each stage that ran, out of
+    sanitize, match, parse_actions and global_filters, to seconds;
+    parse_actions is only timed for the pyparsing engine, the fast engine
+    counts its actions in match. elements maps a grammar element name to
+    how often it was tried, matched and, for pyparsing, had its parse
+    action run. An element tried more often than it matched was
+    backtracked over.
+    """
+    def __init__(self, operation, engine, query_string):
+        self.operation = operation
+        self.engine = engine
+        self.input_length = len(query_string)
+        self.cached = False
+        self.error = None
+        self.timings = {}
+        self.elements = {}
+
+    @property
+    def clause_count(self):
+        return self.elements.get('clause', {}).get('matches', 0)
+
+    def element(self, name):
+        counts = self.elements.get(name)
+        if counts is None:
+            counts = self.elements[name] = {
+                'attempts': 0, 'matches': 0, 'actions': 0}
+        return counts
+
+    def add_time(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def as_dict(self):
+        return {
+            'operation': self.operation,
+            'engine': self.engine,
+            'input_length': self.input_length,
+            'clause_count': self.clause_count,
+            'cached': self.cached,
+            'error': type(self.error).__name__ if self.error else None,
+            'timings': dict(self.timings),
+            'elements': dict((name, dict(counts))
+                             for name, counts in self.elements.items()),
+        }
+
+
+def set_callback(callback, sample_rate=1.0):
+    """
+    calls callback with the ParseStats of each parse in any thread.
+    param: sample_rate : the fraction of parses measured, chosen at random
+    """
+    global _callback, _sample_rate
+    _sample_rate = sample_rate
+    _callback = callback
+
+
+def clear_callback():
+    set_callback(None)
+
+
+@contextmanager
+def collect():
+    """
+    measures every parse this thread runs inside the block and
+    yields the list their ParseStats are appended to
+    """
+    global _collecting
+    previous = getattr(_local, 'collected', None)
+    collected = _local.collected = []
+    with _collecting_lock:
+        _collecting += 1
+    try:
+        yield collected
+    finally:
+        _local.collected = previous
+        with _collecting_lock:
+            _collecting -= 1
+
+
+def start(operation, engine, query_string):
+    """
+    returns the ParseStats to fill in for this parse,
+    None when it is not measured
+    """
+    if _callback is None and not _collecting:
+        return None
+    if getattr(_local, 'collected', None) is None:
+        if _callback is None or (_sample_rate < 1.0
+                                 and random.random() >= _sample_rate):
+            return None
+    return ParseStats(operation, engine, query_string)
+
+
+def report(stats):
+    collected = getattr(_local, 'collected', None)
+    if collected is not None:
+        collected.append(stats)
+    callback = _callback
+    if callback is not None:
+        callback(stats)
+
+
+@contextmanager
+def measure(stats):
+    """
+    reports stats when the block exits, with the error that ended it
+    """
+    try:
+        yield
+    except Exception as error:
+        stats.error = error
+        raise
+    finally:
+        report(stats)
+
+
+@contextmanager
+def stage(stats, name):
+    started = timer()
+    try:
+        yield
+    finally:
+        stats.add_time(name, timer() - started)
+
+
+def _on_attempt(instring, loc, element):
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.element(element.name)['attempts'] += 1
+
+
+def _on_attempt_step(instring, loc, element):
+    step()
+    _on_attempt(instring, loc, element)
+
+
+def _on_match(instring, start, loc, element, tokens):
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.element(element.name)['matches'] += 1
+
+
+def _on_failure(instring, loc, element, error):
+    pass
+
+
+def _timed_action(name, action):
+    def timed_action(instring, loc, tokens):
+        stats = getattr(_local, 'stats', None)
+        if stats is None:
+            return action(instring, loc, tokens)
+        stats.element(name)['actions'] += 1
+        started = timer()
+        try:
+            return action(instring, loc, tokens)
+        finally:
+            stats.add_time('parse_actions', timer() - started)
+    return timed_action
+
+
+def _named_elements(element, seen):
+    if id(element) in seen:
+        return
+    seen.add(id(element))
+    if getattr(element, 'name', None) in NAMED_ELEMENTS:
+        yield element
+    children = list(getattr(element, 'exprs', []))
+    if isinstance(getattr(element, 'expr', None), ParserElement):
+        children.append(element.expr)
+    for child in children:
+        for named in _named_elements(child, seen):
+            yield named
+
+
+_grammar = None
+_grammar_lock = threading.Lock()
+
+
+def get_grammar():
+    """
+    returns a grammar like tokenizer.get_grammar() whose named elements
+    count into the ParseStats being recorded by this thread
+    """
+    global _grammar
+    if _grammar is None:
+        with _grammar_lock:
+            if _grammar is None:
+                grammar = _construct_grammar()
+                grammar.streamline()
+                for element in _named_elements(grammar, set()):
+                    # keep counting the elements of tokenizer.count_steps
+                    # against the parse budget
+                    counts_steps = element.debugActions[0] is step
+                    element.setDebugActions(
+                        _on_attempt_step if counts_steps else _on_attempt,
+                        _on_match, _on_failure)
+                    element.parseAction = [
+                        _timed_action(element.name, action)
+                        for action in element.parseAction]
+                grammar.parseString(WARM_UP_QUERY, parseAll=True)
+                _grammar = grammar
+    return _grammar
+
+
+def _counted(name):
+    method = getattr(Parser, name)
+
+    def counted(self, *args):
+        counts = self.stats.element(name)
+        counts['attempts'] += 1
+        result = method(self, *args)
+        if result is not None and result != -1:
+            counts['matches'] += 1
+        return result
+    counted.__name__ = name
+    return counted
+
+
+class CountingParser(Parser):
+    """
+    A fast_tokenizer Parser that counts into stats how often each of
+    PARSER_ELEMENTS is tried and matches
+    """
+    def __init__(self, query, stats):
+        super(CountingParser, self).__init__(query)
+        self.stats = stats
+
+
+for _name in PARSER_ELEMENTS:
+    setattr(CountingParser, _name, _counted(_name))
+
+
+def tokenize(engine, stats, query_string, facets_query_size,
+             default_operator):
+    """
+    tokenizes query_string with engine, recording into stats
+    """
+    with stage(stats, 'sanitize'):
+        query = _sanitize_query(query_string)
+    grammar = get_grammar() if engine == 'pyparsing' else None
+    started = timer()
+    try:
+        with parse_context(facets_query_size, default_operator):
+            if grammar is None:
+                return CountingParser(query, stats).parse()
+            _local.stats = stats
+            try:
+                return grammar.parseString(query, parseAll=True).asList()[0]
+            finally:
+                _local.stats = None
+    finally:
+        stats.add_time('match', timer() - started
+                       - stats.timings.get('parse_actions', 0.0))
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Limits on the size and complexity of query strings, so that one hostile
+query cannot tie up a worker. The size limits are checked in one linear
+scan before parsing; the step and time budgets while parsing, counting
+every attempt at a clause or a facets or nested entry.
+"""
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from .exceptions import (
+    QueryTooLong, TooManyClauses, QueryTooDeep, TooManyEntries,
+    ParseStepsExceeded, ParseTimeExceeded)
+
+# a word, with any quoted parts it runs into, or a paren, bracket or comma.
+# An unterminated quote runs to the end of the query.
+SCAN_TOKEN = re.compile(
+    u'(?:"(?:[^"\\\\]|\\\\.)*"?|[^\\s"()\\[\\],])+|[()\\[\\],]', re.UNICODE)
+OPERATORS = frozenset([u'AND', u'OR', u'NOT'])
+
+_local = threading.local()
+
+
+class ParseBudget(object):
+    """
+    The steps and seconds one parse may still take
+    """
+    __slots__ = ('query_string', 'max_steps', 'max_seconds', 'steps',
+                 'deadline')
+
+    def __init__(self, query_string, max_steps=None, max_seconds=None):
+        self.query_string = query_string
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+        self.steps = 0
+        self.deadline = None if max_seconds is None \
+            else time.time() + max_seconds
+
+    def step(self):
+        self.steps += 1
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise ParseStepsExceeded(
+                self.query_string, self.max_steps, self.steps)
+        if self.deadline is not None and time.time() > self.deadline:
+            raise ParseTimeExceeded(
+                self.query_string, self.max_seconds,
+                self.max_seconds + time.time() - self.deadline)
+
+
+def step(*args):
+    """
+    counts a step of the parse running in this thread against its
+    budgets. Takes and ignores the arguments of a pyparsing debug action.
+    """
+    for budget in getattr(_local, 'budgets', ()):
+        budget.step()
+
+
+@contextmanager
+def parse_budget(budget):
+    """
+    makes step count against budget in this thread until the block exits,
+    as well as against the budgets of the blocks around it. None adds no
+    budget.
+    """
+    previous = getattr(_local, 'budgets', ())
+    if budget is not None:
+        _local.budgets = previous + (budget,)
+    try:
+        yield budget
+    finally:
+        _local.budgets = previous
+
+
+class QueryLimits(object):
+    """
+    What get_query_dsl parses, set with set_limits. Each limit is None
+    for no limit, and each one exceeded raises its own QueryLimitExceeded.
+
+    param: max_length : characters in the query string
+    param: max_clauses : its words and quoted phrases, operators left out
+    param: max_depth : how deep parens nest
+    param: max_entries : entries of the facets:[ ] and nested:[ ] lists
+    param: max_steps : clauses and entries the parser tries, more where
+     pyparsing backtracks than for the fast parser
+    param: max_seconds : time spent parsing
+    """
+    def __init__(self, max_length=None, max_clauses=None, max_depth=None,
+                 max_entries=None, max_steps=None, max_seconds=None):
+        self.max_length = max_length
+        self.max_clauses = max_clauses
+        self.max_depth = max_depth
+        self.max_entries = max_entries
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+
+    def check(self, query_string):
+        """
+        raises the QueryLimitExceeded of the first size limit the query
+        string goes over
+        """
+        max_length = self.max_length
+        if max_length is not None and len(query_string) > max_length:
+            raise QueryTooLong(query_string, max_length, len(query_string))
+        max_clauses = self.max_clauses
+        max_depth = self.max_depth
+        max_entries = self.max_entries
+        if max_clauses is None and max_depth is None and max_entries is None:
+            return
+        clauses = depth = entries = 0
+        # the paren depth of each open bracket
+        brackets = []
+        for match in SCAN_TOKEN.finditer(query_string):
+            token = match.group()
+            if token == u'(':
+                depth += 1
+                if max_depth is not None and depth > max_depth:
+                    raise QueryTooDeep(query_string, max_depth, depth)
+            elif token == u')':
+                depth = max(depth - 1, 0)
+            elif token == u'[':
+                brackets.append(depth)
+            elif token == u']':
+                if brackets:
+                    brackets.pop()
+            elif token != u',' and token.upper() not in OPERATORS:
+                clauses += 1
+                if max_clauses is not None and clauses > max_clauses:
+                    raise TooManyClauses(query_string, max_clauses, clauses)
+                if brackets and brackets[-1] == depth:
+                    entries += 1
+                    if max_entries is not None and entries > max_entries:
+                        raise TooManyEntries(
+                            query_string, max_entries, entries)
+
+    def budget(self, query_string):
+        """
+        returns a context in which steps count against the budget of
+        one parse of the query string
+        """
+        if self.max_steps is None and self.max_seconds is None:
+            return parse_budget(None)
+        return parse_budget(ParseBudget(
+            query_string, self.max_steps, self.max_seconds))
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+The syntax tree of a query string. Nodes are small values: they compare
+and hash by their fields and pickle. They are never changed once built;
+replace() makes a changed copy to transform a tree.
+"""
+
+
+class Node(object):
+    __slots__ = ()
+
+    def fields(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def replace(self, **values):
+        """
+        returns a copy of the node with the given fields changed
+        """
+        return type(self)(*[values.get(name, getattr(self, name))
+                            for name in self.__slots__])
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.fields() == other.fields()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((type(self).__name__,) + self.fields())
+
+    def __reduce__(self):
+        return type(self), self.fields()
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join(
+            repr(value) for value in self.fields()))
+
+
+class Term(Node):
+    """
+    a word of free text, or an unquoted value inside a filter
+    """
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class Phrase(Node):
+    """
+    a double quoted value; text is what is between the quotes,
+    escapes included
+    """
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class Compare(Node):
+    """
+    field operator value, e.g. due_date:>=1234. value is a string or a
+    Phrase; inside a filter it is the whole parenthesised value.
+    """
+    __slots__ = ('field', 'operator', 'value')
+
+    def __init__(self, field, operator, value):
+        self.field = field
+        self.operator = operator
+        self.value = value
+
+
+class Bool(Node):
+    """
+    left and right joined by operator, 'AND', 'OR' or None where the
+    query only leaves a space. A side is None when the query starts or
+    ends with the operator.
+    """
+    __slots__ = ('operator', 'left', 'right')
+
+    def __init__(self, operator, left, right):
+        self.operator = operator
+        self.left = left
+        self.right = right
+
+
+class Paren(Node):
+    __slots__ = ('child',)
+
+    def __init__(self, child):
+        self.child = child
+
+
+class TypeFilter(Node):
+    """
+    the document type of a type: expression
+    """
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+
+class TypeTerms(Node):
+    """
+    the document types of type:(a OR b) and of type: expressions after
+    the first, read when parsing for routing
+    """
+    __slots__ = ('names',)
+
+    def __init__(self, names):
+        self.names = names
+
+
+class Facet(Node):
+    """
+    an entry of facets:[ ]; filter is None or the tree inside its parens
+    """
+    __slots__ = ('field', 'filter')
+
+    def __init__(self, field, filter):
+        self.field = field
+        self.filter = filter
+
+
+class NestedClause(Node):
+    """
+    the entry of a nested:[ ] list, only the first of which is used
+    """
+    __slots__ = ('path', 'filter')
+
+    def __init__(self, path, filter):
+        self.path = path
+        self.filter = filter
+
+
+class SearchQuery(Node):
+    """
+    The root of a tree. facets are the entries of the last facets:[ ]
+    list, nested the nested clauses in order and query the rest of the
+    query string, or None when there is none.
+    """
+    __slots__ = ('type_filter', 'facets', 'nested', 'query')
+
+    def __init__(self, type_filter, facets, nested, query):
+        self.type_filter = type_filter
+        self.facets = facets
+        self.nested = nested
+        self.query = query
+
+
+class Range(Node):
+    """
+    field between lower and upper, either of which is None when it is
+    open. The optimizer makes it from the range compare expressions on
+    one field.
+    """
+    __slots__ = ('field', 'lower', 'include_lower', 'upper', 'include_upper')
+
+    def __init__(self, field, lower, include_lower, upper, include_upper):
+        self.field = field
+        self.lower = lower
+        self.include_lower = include_lower
+        self.upper = upper
+        self.include_upper = include_upper
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Parses queries off the calling thread, for servers whose event loop must
+not stall on a pathological query: cheap queries are parsed inline and
+expensive ones in a worker thread or process, with a cap on the parses in
+flight and a timeout per call. Results come back as a QueryFuture.
+"""
+import multiprocessing
+import threading
+import time
+from collections import deque
+
+from .exceptions import (
+    QueryError, ParseCancelled, ParseTimeout, ParseTimeExceeded)
+from .limits import ParseBudget, parse_budget
+
+EXECUTORS = ('thread', 'process')
+# queries that cost less are parsed inline, about 3ms of parsing
+INLINE_COST = 512
+# nested parens make the grammar backtrack, so each one counts as much as
+# this many characters
+PAREN_COST = 16
+
+
+def estimate_cost(query_string):
+    """
+    a cheap estimate of how long a query string takes to parse, in
+    characters
+    """
+    return len(query_string) + PAREN_COST * query_string.count(u'(')
+
+
+class QueryFuture(object):
+    """
+    The pending result of a parse, with the methods of
+    concurrent.futures.Future that event loops wrap
+    """
+    def __init__(self, query_string):
+        self.query_string = query_string
+        self._condition = threading.Condition()
+        self._finished = False
+        self._cancelled = False
+        self._result = None
+        self._error = None
+        self._callbacks = []
+        # the process parsing the query, to terminate when it times out
+        self._process = None
+
+    def _finish(self, result=None, error=None, cancelled=False):
+        with self._condition:
+            if self._finished:
+                return False
+            self._finished = True
+            self._cancelled = cancelled
+            self._result = result
+            self._error = error
+            callbacks, self._callbacks = self._callbacks, []
+            self._condition.notify_all()
+        for callback in callbacks:
+            callback(self)
+        return True
+
+    def set_result(self, result):
+        return self._finish(result=result)
+
+    def set_exception(self, error):
+        return self._finish(error=error)
+
+    def done(self):
+        return self._finished
+
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        """
+        cancels the parse if it has not started yet
+        """
+        return False
+
+    def add_done_callback(self, callback):
+        with self._condition:
+            if not self._finished:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def exception(self, timeout=None):
+        with self._condition:
+            if not self._finished:
+                self._condition.wait(timeout)
+            if not self._finished:
+                raise ParseTimeout(self.query_string, timeout)
+        if self._cancelled:
+            raise ParseCancelled(self.query_string)
+        return self._error
+
+    def result(self, timeout=None):
+        error = self.exception(timeout)
+        if error is not None:
+            raise error
+        return self._result
+
+
+class _Task(QueryFuture):
+    def __init__(self, offloader, parse, args, query_string):
+        super(_Task, self).__init__(query_string)
+        self._offloader = offloader
+        self._parse = parse
+        self._args = args
+        self._timer = None
+        self._timeout = None
+        self._deadline = None
+
+    def cancel(self):
+        if not self._offloader._remove_pending(self):
+            return self._cancelled
+        return self._finish(cancelled=True)
+
+    def _expire(self, timeout):
+        self._offloader._remove_pending(self)
+        if self._finish(error=ParseTimeout(self.query_string, timeout)):
+            process = self._process
+            if process is not None:
+                process.terminate()
+
+    def _finish(self, result=None, error=None, cancelled=False):
+        timer = self._timer
+        if timer is not None and timer is not threading.current_thread():
+            timer.cancel()
+            # so that no timer outlives its parse
+            timer.join()
+        return super(_Task, self)._finish(result, error, cancelled)
+
+
+def _parse_in_process(connection, parse, args, query_string):
+    try:
+        connection.send((True, parse(*args)))
+    except Exception as error:
+        try:
+            connection.send((False, error))
+        except Exception:
+            # the error did not pickle
+            connection.send((False, QueryError(query_string, "{}: {}".format(
+                type(error).__name__, error))))
+    finally:
+        connection.close()
+
+
+class Offloader(object):
+    """
+    Routes parses by estimated cost: those under inline_cost run in the
+    calling thread, the rest in a thread or process of their own.
+
+    param: executor : 'thread' or 'process'. Threads share the cache and
+     are cheap to start, but only interleave with the calling thread; a
+     parse that times out stops at its next step, as over a time budget
+     of set_limits. Each process is forked for one parse and terminated
+     when it times out.
+    param: max_in_flight : the most parses running off the calling thread
+     at once; others wait for a slot
+    param: inline_cost : the estimated cost from which a query is parsed
+     off the calling thread, 0 to offload every query
+    param: cost : a function estimating the cost of a query string
+    """
+    def __init__(self, executor='thread', max_in_flight=4,
+                 inline_cost=INLINE_COST, cost=estimate_cost):
+        if executor not in EXECUTORS:
+            raise ValueError("unknown executor: {}".format(executor))
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        self.executor = executor
+        self.max_in_flight = max_in_flight
+        self.inline_cost = inline_cost
+        self.cost = cost
+        self.in_flight = 0
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+    def submit(self, parse, args, query_string, timeout=None):
+        """
+        returns a QueryFuture of parse(*args). timeout is in seconds from
+        now, time waiting for a slot included.
+        """
+        if self.cost(query_string) < self.inline_cost:
+            future = QueryFuture(query_string)
+            try:
+                future.set_result(parse(*args))
+            except Exception as error:
+                future.set_exception(error)
+            return future
+        task = _Task(self, parse, args, query_string)
+        if timeout is not None:
+            task._timeout = timeout
+            task._deadline = time.time() + timeout
+            task._timer = threading.Timer(timeout, task._expire, (timeout,))
+            task._timer.daemon = True
+            task._timer.start()
+        with self._lock:
+            if self.in_flight >= self.max_in_flight:
+                self._pending.append(task)
+                return task
+            self.in_flight += 1
+        self._start(task)
+        return task
+
+    def _remove_pending(self, task):
+        with self._lock:
+            try:
+                self._pending.remove(task)
+            except ValueError:
+                return False
+            return True
+
+    def _start(self, task):
+        target = self._run_in_thread if self.executor == 'thread' \
+            else self._run_in_process
+        thread = threading.Thread(target=target, args=(task,))
+        thread.daemon = True
+        thread.start()
+
+    def _release(self):
+        with self._lock:
+            task = self._pending.popleft() if self._pending else None
+            if task is None:
+                self.in_flight -= 1
+        if task is not None:
+            self._start(task)
+
+    def _run_in_thread(self, task):
+        try:
+            if task.done():
+                return
+            budget = None
+            if task._deadline is not None:
+                # a thread cannot be stopped, so the parse is, once it
+                # times out, instead of holding its slot until it ends
+                budget = ParseBudget(task.query_string, max_seconds=max(
+                    0, task._deadline - time.time()))
+            try:
+                with parse_budget(budget):
+                    task.set_result(task._parse(*task._args))
+            except ParseTimeExceeded as error:
+                if budget is not None and time.time() >= task._deadline:
+                    task._expire(task._timeout)
+                else:
+                    task.set_exception(error)
+            except Exception as error:
+                task.set_exception(error)
+        finally:
+            self._release()
+
+    def _run_in_process(self, task):
+        try:
+            if task.done():
+                return
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(
+                target=_parse_in_process,
+                args=(sender, task._parse, task._args, task.query_string))
+            process.daemon = True
+            process.start()
+            task._process = process
+            sender.close()
+            if task.done():
+                # timed out while the process started
+                process.terminate()
+            try:
+                succeeded, value = receiver.recv()
+            except (EOFError, IOError):
+                task.set_exception(QueryError(
+                    task.query_string, "the parsing process exited"))
+            else:
+                if succeeded:
+                    task.set_result(value)
+                else:
+                    task.set_exception(value)
+            finally:
+                receiver.close()
+            process.join()
+        finally:
+            self._release()
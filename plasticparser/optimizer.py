@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Rewrites the syntax tree of a query into a smaller one that matches the
+same documents, before it is emitted: clauses repeated in a chain joined
+by one operator are dropped, parens that change nothing are removed, the
+range compare expressions on one field that must all hold become one
+range, and a query no document can match is found before it is sent.
+
+Ranges assume that the field holds one value per document: a field
+holding several can match due:>10 AND due:<5 with two of them. Numbers
+are only compared as numbers on the fields a schema gives a numeric type;
+elsewhere elasticsearch may order them as strings, where "2" is within
+code:>10 AND code:<5, so their ranges are left as written. Dates written
+the same way order alike as dates and as strings.
+"""
+import re
+
+from .canonical import format_node
+from .nodes import Node, Compare, Bool, Paren, Range
+from .schema import NUMERIC_TYPES
+from .tree_parser import chain, flatten, is_plain, joining_operator
+
+# lower bounds, (operator, whether the bound is included)
+LOWER_OPERATORS = {u':>': False, u':>=': True}
+UPPER_OPERATORS = {u':<': False, u':<=': True}
+NUMBER = re.compile(u'-?[0-9]+(?:\\.[0-9]+)?$')
+# dates written the same way compare as strings
+DATE = re.compile(u'[0-9]{4}-[0-9]{2}-[0-9]{2}(?:T[0-9:.]+Z?)?$')
+
+# a clause that negates or requires the clause after it, or itself;
+# chains with one are left as they are written
+NEGATION = re.compile(u'NOT$|[-+!]')
+
+# a chain no document can match
+UNSATISFIABLE = object()
+
+
+def _ordering_key(value, numeric):
+    """
+    returns a key that orders the range bound, None when the optimizer
+    cannot tell how elasticsearch orders it. Keys only compare when
+    their first items are the same.
+    param: numeric : whether the field is known to hold numbers
+    """
+    if not isinstance(value, basestring):
+        return None
+    if NUMBER.match(value):
+        return (u'number', float(value)) if numeric else None
+    if DATE.match(value):
+        return (u'date {}'.format(len(value)), value)
+    return None
+
+
+def _tightest(bounds, lower):
+    """
+    returns the (value, included, key) of the bound that the others
+    follow from, None when they do not compare
+    """
+    tightest = None
+    for bound in bounds:
+        if bound[2] is None:
+            return None
+        if tightest is None:
+            tightest = bound
+            continue
+        if bound[2][0] != tightest[2][0]:
+            return None
+        if bound[2][1] == tightest[2][1]:
+            if not bound[1]:
+                tightest = bound
+        elif (bound[2][1] > tightest[2][1]) == lower:
+            tightest = bound
+    return tightest
+
+
+def _merge_range(field, lowers, uppers):
+    """
+    returns the node of the bounds on one field, UNSATISFIABLE when no
+    value is within them, None when they cannot be merged
+    """
+    lower = _tightest(lowers, True) if lowers else None
+    upper = _tightest(uppers, False) if uppers else None
+    if (lowers and lower is None) or (uppers and upper is None):
+        return None
+    if lower is not None and upper is not None:
+        if lower[2][0] != upper[2][0]:
+            return None
+        if lower[2][1] > upper[2][1] or (
+                lower[2][1] == upper[2][1] and not (lower[1] and upper[1])):
+            return UNSATISFIABLE
+        return Range(field, lower[0], lower[1], upper[0], upper[1])
+    if lower is not None:
+        return Compare(field, u':>=' if lower[1] else u':>', lower[0])
+    return Compare(field, u':<=' if upper[1] else u':<', upper[0])
+
+
+def _numeric(field, schema):
+    if schema is None:
+        return False
+    field = schema.field(field)
+    return field is not None and field.type in NUMERIC_TYPES
+
+
+def _merge_ranges(atoms, schema):
+    bounds = {}
+    for atom in atoms:
+        if type(atom) is Compare and isinstance(atom.value, basestring):
+            if atom.operator in LOWER_OPERATORS:
+                side, included = 0, LOWER_OPERATORS[atom.operator]
+            elif atom.operator in UPPER_OPERATORS:
+                side, included = 1, UPPER_OPERATORS[atom.operator]
+            else:
+                continue
+            bounds.setdefault(atom.field, ([], []))[side].append(
+                (atom.value, included, _ordering_key(
+                    atom.value, _numeric(atom.field, schema))))
+    merged = {}
+    for field, (lowers, uppers) in bounds.iteritems():
+        if len(lowers) + len(uppers) < 2:
+            continue
+        node = _merge_range(field, lowers, uppers)
+        if node is UNSATISFIABLE:
+            return UNSATISFIABLE
+        if node is not None:
+            merged[field] = node
+    if not merged:
+        return atoms
+    merged_fields = frozenset(merged)
+    result = []
+    for atom in atoms:
+        if type(atom) is Compare and atom.field in merged_fields and \
+                isinstance(atom.value, basestring) and (
+                    atom.operator in LOWER_OPERATORS or
+                    atom.operator in UPPER_OPERATORS):
+            # the merged range takes the place of the first bound
+            node = merged.pop(atom.field, None)
+            if node is not None:
+                result.append(node)
+            continue
+        result.append(atom)
+    return result
+
+
+def _negated(atom):
+    return NEGATION.match(format_node(atom)) is not None
+
+
+def _unwrap(node, operator, default_operator):
+    """
+    returns the nodes a paren stands for in a chain joined by operator:
+    its child when that is one clause or joined by the same operator
+    """
+    if type(node.child) is not Bool:
+        return [node.child]
+    tokens = flatten(node.child)
+    atoms = [token for token in tokens if isinstance(token, Node)]
+    if joining_operator(tokens, default_operator) == operator and \
+            not any(_negated(atom) for atom in atoms):
+        return atoms
+    return [node]
+
+
+def optimize_clauses(node, default_operator, schema=None):
+    """
+    returns the optimized node, UNSATISFIABLE when no document can match
+    it. Chains with words that could be part of a paren or quote the
+    grammar split up, or with negated or required clauses, are left as
+    they are. The types of the fields of schema tell which ranges are
+    numeric.
+    """
+    if node is None:
+        return None
+    default_operator = default_operator.upper()
+    tokens = flatten(node)
+    atoms = [token for token in tokens if isinstance(token, Node)]
+    if not all(is_plain(atom) for atom in atoms) or \
+            any(_negated(atom) for atom in atoms):
+        return node
+    operator = joining_operator(tokens, default_operator)
+    optimized = []
+    for atom in atoms:
+        if type(atom) is Paren:
+            child = optimize_clauses(atom.child, default_operator, schema)
+            if child is UNSATISFIABLE:
+                if operator == u'AND':
+                    return UNSATISFIABLE
+                if operator == u'OR':
+                    continue
+                # a chain of mixed operators is not reasoned about
+                optimized.append(atom)
+                continue
+            atom = Paren(child)
+            if operator is None:
+                if type(child) is not Bool:
+                    atom = child
+                optimized.append(atom)
+            else:
+                optimized.extend(_unwrap(atom, operator, default_operator))
+        else:
+            optimized.append(atom)
+    if operator is None:
+        # only parens around one clause are dropped, in place
+        index = 0
+        result = []
+        for token in tokens:
+            if isinstance(token, Node):
+                token = optimized[index]
+                index += 1
+            result.append(token)
+        return chain(result)
+    if not optimized:
+        return UNSATISFIABLE
+    unique = []
+    seen = set()
+    for atom in optimized:
+        if atom not in seen:
+            seen.add(atom)
+            unique.append(atom)
+    if operator == u'AND':
+        unique = _merge_ranges(unique, schema)
+        if unique is UNSATISFIABLE:
+            return UNSATISFIABLE
+    explicit = len(tokens) > len(atoms)
+    result = unique[:1]
+    for atom in unique[1:]:
+        if explicit:
+            result.append(operator)
+        result.append(atom)
+    return chain(result)
+
+
+def optimize_tree(tree, default_operator, schema=None):
+    """
+    returns the optimized SearchQuery, None when no document can match
+    it
+    """
+    query = optimize_clauses(tree.query, default_operator, schema)
+    if query is UNSATISFIABLE:
+        return None
+    return tree.replace(query=query)
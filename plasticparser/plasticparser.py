@@ -1,8 +1,204 @@
 # -*- coding: utf-8 -*-
-from . import tokenizer
+import functools
+import multiprocessing
+from collections import deque
+
+from . import tokenizer, fast_tokenizer, instrumentation, serializer
+from .aggregations import Aggregations, add_aggregations
+from .analysis import QueryAnalysis
+from .cache import LRUCache, TieredCache, copy_dsl
+from .canonical import canonicalize, fingerprint, normal_form
+from .exceptions import QueryError, UnknownFieldError, UnsatisfiableQuery
+from .emitter import emit_query_dsl, emit_structured_dsl
+from .grammar_parsers import add_global_filters
+from .limits import QueryLimits
+from .offload import Offloader
+from .optimizer import optimize_tree
+from .routing import Routing, add_routing
+from .schema import Field, Schema
+from .sqlite_cache import SQLiteCache
+from .template import compile_template
+from .tree_parser import parse_tree
+from .validation import validate
+
+ENGINES = {
+    'pyparsing': tokenizer.tokenize,
+    'fast': fast_tokenizer.tokenize,
+}
+
+_default_engine = 'pyparsing'
+_query_cache = None
+_canonical_cache_keys = False
+_offloader = None
+_limits = None
+
+
+def set_default_engine(engine):
+    """
+    selects the parser used when a call does not name an engine.
+    param: engine : 'pyparsing' for the pyparsing grammar or 'fast' for
+     the hand written parser, both produce the same query dsl
+    """
+    global _default_engine
+    if engine not in ENGINES:
+        raise ValueError("unknown parser engine: {}".format(engine))
+    _default_engine = engine
+
+
+def get_default_engine():
+    return _default_engine
+
+
+def _get_tokenize(engine):
+    engine = engine or _default_engine
+    if engine not in ENGINES:
+        raise ValueError("unknown parser engine: {}".format(engine))
+    return ENGINES[engine]
+
+
+def enable_cache(maxsize=128, ttl=None, canonical=False, path=None,
+                 shared_maxsize=10000):
+    """
+    caches parsed query dsls, keyed on the sanitized query string,
+    facets_query_size and default_operator.
+    param: maxsize : the most entries kept before the least recently
+     used one is evicted
+    param: ttl : seconds after which an entry is parsed again,
+     None to keep entries until they are evicted
+    param: canonical : also key entries on the normal form of the query,
+     so that queries canonicalize() turns into the same string share the
+     query dsl of that normal form
+    param: path : an SQLite file to share parsed queries through with
+     the other processes that enable it, behind the maxsize entries kept
+     in memory. Entries of other plasticparser versions are dropped.
+    param: shared_maxsize : about the most entries kept in the file
+    """
+    global _query_cache, _canonical_cache_keys
+    _query_cache = LRUCache(maxsize, ttl)
+    if path is not None:
+        _query_cache = TieredCache(
+            _query_cache, SQLiteCache(path, shared_maxsize, ttl))
+    _canonical_cache_keys = canonical
+
+
+def disable_cache():
+    global _query_cache
+    _query_cache = None
+
+
+def get_cache_stats():
+    """
+    returns hits, misses, evictions and size of the query cache,
+    None when caching is disabled
+    """
+    return _query_cache.stats() if _query_cache is not None else None
+
+
+def set_limits(limits=None, **options):
+    """
+    limits the queries get_query_dsl and the other parsing functions
+    take, to keep hostile queries from tying up a worker. A query over a
+    limit raises the QueryLimitExceeded of that limit.
+    param: limits : a QueryLimits, or None for no limits
+    param: options : the arguments of a QueryLimits to set instead,
+     e.g. set_limits(max_length=4096, max_depth=8, max_seconds=0.1)
+    """
+    global _limits
+    _limits = QueryLimits(**options) if options else limits
+
+
+def get_limits():
+    return _limits
+
+
+def _parse(parse, query_string, *args):
+    limits = _limits
+    if limits is None:
+        return parse(query_string, *args)
+    with limits.budget(query_string):
+        return parse(query_string, *args)
+
+
+def _emit(query_string, tree, facets_query_size, default_operator,
+          structured, schema, optimize=False):
+    try:
+        if optimize:
+            tree = optimize_tree(tree, default_operator, schema)
+            if tree is None:
+                raise UnsatisfiableQuery(query_string)
+        if schema is None:
+            emit = emit_structured_dsl if structured else emit_query_dsl
+            return emit(tree, None, facets_query_size, default_operator)
+        return emit_structured_dsl(tree, None, facets_query_size,
+                                   default_operator, schema)
+    except UnknownFieldError as error:
+        # the optimizer and the emitter only see the tree
+        raise UnknownFieldError(query_string, error.field)
+
+
+def _tokenize_tree(query_string, facets_query_size, default_operator,
+                   structured=True, schema=None, optimize=False, types=False):
+    return _emit(query_string, parse_tree(query_string, types),
+                 facets_query_size, default_operator, structured, schema,
+                 optimize)
+
+
+def _tokenize(query_string, facets_query_size, default_operator, engine,
+              stats=None, structured=False, copy=True, schema=None,
+              optimize=False, types=False):
+    tokenize = _get_tokenize(engine)
+    emit_options = (structured, schema, optimize)
+    if schema is not None or structured or optimize or types:
+        tokenize = functools.partial(
+            _tokenize_tree, structured=structured, schema=schema,
+            optimize=optimize, types=types)
+        if schema is not None:
+            # entries compiled with different schemas are kept apart
+            structured = schema.fingerprint
+        if optimize:
+            structured = (structured, u'optimized')
+        if types:
+            structured = (structured, u'types')
+    elif stats is not None:
+        tokenize = functools.partial(
+            instrumentation.tokenize, stats.engine, stats)
+    if _limits is not None:
+        # cached queries are checked too, so that the limits hold however
+        # the cache was filled
+        _limits.check(query_string)
+    cache = _query_cache
+    if cache is None:
+        return _parse(
+            tokenize, query_string, facets_query_size, default_operator)
+    key = (tokenizer._sanitize_query(query_string),
+           facets_query_size, default_operator, structured)
+    expression = cache.get(key)
+    # the normal form has only the first type: expression in its type filter
+    if expression is None and _canonical_cache_keys and not types:
+        normal_query, tree = _parse(normal_form, query_string)
+        canonical_key = (normal_query, facets_query_size, default_operator,
+                         structured)
+        expression = cache.get(canonical_key)
+        if expression is None:
+            expression = _emit(query_string, tree, facets_query_size,
+                               default_operator, *emit_options)
+            cache.set(canonical_key, expression)
+        elif stats is not None:
+            stats.cached = True
+        cache.set(key, expression)
+    elif expression is None:
+        expression = _parse(
+            tokenize, query_string, facets_query_size, default_operator)
+        cache.set(key, expression)
+    elif stats is not None:
+        stats.cached = True
+    return copy_dsl(expression) if copy else expression
+
 
 def get_query_dsl(
-        query_string, global_filters=None, facets_query_size=20, default_operator='and'):
+        query_string, global_filters=None, facets_query_size=20, default_operator='and',
+        engine=None, structured=False, aggregations=None, schema=None,
+        optimize=False, routing=None):
     """
     returns an elasticsearch query dsl for a query string
     param: query_string : an expression of the form
@@ -14,31 +210,388 @@ def get_query_dsl(
      {user_id: 1234}. This gets added as a filter to the query
      so that the query can be narrowed down to fewer documents.
      It is translated into an elastic search term filter.
+
+    param: engine : the parser to use, 'pyparsing' or 'fast'.
+     Defaults to the engine chosen with set_default_engine.
+
+    param: structured : compiles compare expressions into term, range
+     and bool filters that elasticsearch can cache, leaving only free
+     text in the query_string query. Values are then matched exactly,
+     as they are indexed. Parses with the hand written parser.
+
+    param: aggregations : an Aggregations, or True for the default one,
+     to compile facets:[ ] into aggregations under "aggs" instead of
+     the facets elasticsearch 2 removed
+
+    param: schema : a Schema of the fields of the index. Compiles like
+     structured, with match queries for analyzed fields, nested filters
+     for the fields of nested documents and the facet fields of the
+     schema, and raises an UnknownFieldError for fields it does not have.
+
+    param: optimize : drops repeated clauses and parens that change
+     nothing and merges the ranges on a field into one before compiling,
+     and raises an UnsatisfiableQuery for a query no document can match,
+     such as due_date:>10 due_date:<5, so that it need not be sent.
+     Numbers are only compared on the numeric fields of the schema.
+
+    param: routing : a Routing, or True for the default one, to read
+     type:(a OR b) and the type: expressions after the first into one
+     terms filter on _type, and to add a "routing" hint with the types
+     and the indices to search, which is popped off before sending.
+     Parses with the hand written parser.
+    """
+    if routing is True:
+        routing = Routing()
+    elif not routing:
+        routing = None
+    stats = instrumentation.start(
+        'get_query_dsl', engine or _default_engine, query_string)
+    if stats is not None:
+        with instrumentation.measure(stats):
+            expression = _tokenize(query_string, facets_query_size,
+                                   default_operator, engine, stats,
+                                   structured, schema=schema,
+                                   optimize=optimize,
+                                   types=routing is not None)
+            if routing is not None:
+                add_routing(expression, routing)
+            with instrumentation.stage(stats, 'global_filters'):
+                query_dsl = add_global_filters(expression, global_filters)
+    else:
+        expression = _tokenize(query_string, facets_query_size,
+                               default_operator, engine,
+                               structured=structured, schema=schema,
+                               optimize=optimize, types=routing is not None)
+        if routing is not None:
+            add_routing(expression, routing)
+        query_dsl = add_global_filters(expression, global_filters)
+    if aggregations:
+        if aggregations is True:
+            aggregations = Aggregations()
+        add_aggregations(query_dsl, aggregations)
+    return query_dsl
+
+
+def get_query_json(
+        query_string, global_filters=None, facets_query_size=20, default_operator='and',
+        engine=None, structured=False, aggregations=None, schema=None,
+        optimize=False, routing=None, buffer=None):
+    """
+    returns the query dsl of get_query_dsl encoded as compact json bytes,
+    written without building the whole dsl first.
+    Takes the same arguments as get_query_dsl.
+
+    param: buffer : a bytearray to append the json to, or a file like
+     object to write it to, which is then returned instead
+    """
+    if buffer is None:
+        parts = []
+        write = parts.append
+    else:
+        write = getattr(buffer, 'write', None) or buffer.extend
+    if aggregations is True:
+        aggregations = Aggregations()
+    elif not aggregations:
+        aggregations = None
+    if routing is True:
+        routing = Routing()
+    elif not routing:
+        routing = None
+    stats = instrumentation.start(
+        'get_query_json', engine or _default_engine, query_string)
+    if stats is not None:
+        with instrumentation.measure(stats):
+            expression = _tokenize(query_string, facets_query_size,
+                                   default_operator, engine, stats,
+                                   structured, copy=False, schema=schema,
+                                   optimize=optimize,
+                                   types=routing is not None)
+            with instrumentation.stage(stats, 'global_filters'):
+                serializer.write_query_json(
+                    write, expression, global_filters, aggregations,
+                    routing)
+    else:
+        expression = _tokenize(query_string, facets_query_size,
+                               default_operator, engine,
+                               structured=structured, copy=False,
+                               schema=schema, optimize=optimize,
+                               types=routing is not None)
+        serializer.write_query_json(
+            write, expression, global_filters, aggregations, routing)
+    if buffer is None:
+        return b''.join(parts)
+    return buffer
+
+
+def configure_async(executor='thread', max_in_flight=4, inline_cost=None,
+                    cost=None):
+    """
+    sets where get_query_dsl_async parses queries.
+    param: executor : 'thread' to parse expensive queries in threads,
+     'process' to fork a process for each so that they run in parallel
+     and are terminated when they time out
+    param: max_in_flight : the most expensive queries parsed at once,
+     others wait for one of them to finish
+    param: inline_cost : the estimated cost from which a query is not
+     parsed in the calling thread, 0 to never parse there
+    param: cost : a function estimating the cost of parsing a query
+     string, by default its length with each paren counted as 16
+     characters
+    """
+    global _offloader
+    options = {}
+    if inline_cost is not None:
+        options['inline_cost'] = inline_cost
+    if cost is not None:
+        options['cost'] = cost
+    _offloader = Offloader(executor, max_in_flight, **options)
+
+
+def get_query_dsl_async(
+        query_string, global_filters=None, facets_query_size=20, default_operator='and',
+        engine=None, structured=False, aggregations=None, schema=None,
+        optimize=False, routing=None, timeout=None):
+    """
+    returns a QueryFuture of the query dsl of get_query_dsl, to keep
+    pathological queries from blocking an event loop. Cheap queries are
+    parsed right away and expensive ones as set with configure_async.
+    Takes the same arguments as get_query_dsl.
+
+    param: timeout : seconds after which the future fails with
+     ParseTimeout if the query is not parsed yet
+    """
+    if _offloader is None:
+        configure_async()
+    return _offloader.submit(
+        get_query_dsl,
+        (query_string, global_filters, facets_query_size, default_operator,
+         engine, structured, aggregations, schema, optimize, routing),
+        query_string, timeout)
+
+
+def _init_batch_worker(engine):
+    if engine == 'pyparsing':
+        tokenizer.get_grammar()
+
+
+def _parse_batch_query(args):
+    query_string, facets_query_size, default_operator, engine = args
+    try:
+        return _tokenize(
+            query_string, facets_query_size, default_operator, engine)
+    except QueryError as error:
+        return error
+    except Exception as error:
+        return QueryError(query_string, "{}: {}".format(
+            type(error).__name__, error))
+
+
+def _start_batch_pool(workers, engine):
+    return multiprocessing.Pool(
+        workers, initializer=_init_batch_worker, initargs=(engine,))
+
+
+def _parse_batch_chunk(tasks):
+    return [_parse_batch_query(task) for task in tasks]
+
+
+class _BatchQuery(object):
+    """
+    a distinct query of a batch, with the number of its copies read and
+    not yet yielded
+    """
+    __slots__ = ('key', 'task', 'count', 'parsed', 'result', 'chunk')
+
+    def __init__(self, key, task):
+        self.key = key
+        self.task = task
+        self.count = 0
+        self.parsed = False
+        self.result = None
+        # the pending result of the queries sent to a worker with this one
+        self.chunk = None
+
+
+def _send_batch_chunk(pool, queries):
+    chunk = (pool.apply_async(_parse_batch_chunk,
+                              ([query.task for query in queries],)),
+             queries)
+    for query in queries:
+        query.chunk = chunk
+
+
+def _receive_batch_chunk(chunk):
+    pending, queries = chunk
+    for query, result in zip(queries, pending.get()):
+        query.result = result
+        query.parsed = True
+        query.chunk = None
+
+
+def get_query_dsl_many(
+        queries, global_filters=None, facets_query_size=20, default_operator='and',
+        engine=None, workers=None, chunksize=64):
+    """
+    yields the query dsl of each query string in queries, in order, as
+    queries are read. Identical queries read before the first of them is
+    yielded are parsed once. A query that cannot be parsed yields a
+    QueryError in its place instead of ending the batch.
+
+    param: global_filters, facets_query_size, default_operator, engine :
+     as for get_query_dsl, applied to every query
+
+    param: workers : the number of processes that parse in parallel.
+     Defaults to the number of cpus; 1 parses in this process.
+
+    param: chunksize : how many queries are sent to a worker at once.
+     Twice as many chunks as workers are read ahead of the results.
+    """
+    engine = engine or _default_engine
+    _get_tokenize(engine)
+    workers = workers or multiprocessing.cpu_count()
+    read_ahead = chunksize * workers * 2 if workers > 1 else chunksize
+    queries = iter(queries)
+    # the queries read and not yet yielded, a QueryError in place of
+    # those that did not sanitize
+    pending = deque()
+    distinct = {}
+    unsent = []
+    exhausted = False
+    pool = None
+    try:
+        while True:
+            while not exhausted and len(pending) < read_ahead:
+                try:
+                    query_string = next(queries)
+                except StopIteration:
+                    exhausted = True
+                    break
+                try:
+                    key = tokenizer._sanitize_query(query_string)
+                except Exception as error:
+                    pending.append(QueryError(query_string, "{}: {}".format(
+                        type(error).__name__, error)))
+                    continue
+                query = distinct.get(key)
+                if query is None:
+                    query = distinct[key] = _BatchQuery(key, (
+                        query_string, facets_query_size, default_operator,
+                        engine))
+                    unsent.append(query)
+                query.count += 1
+                pending.append(query)
+                if workers > 1 and len(unsent) >= chunksize:
+                    pool = pool or _start_batch_pool(workers, engine)
+                    _send_batch_chunk(pool, unsent)
+                    unsent = []
+            if not pending:
+                break
+            query = pending.popleft()
+            if isinstance(query, QueryError):
+                yield query
+                continue
+            if not query.parsed and query.chunk is None:
+                if workers == 1 or (pool is None and len(unsent) == 1):
+                    # no worker is worth starting for one query
+                    unsent.remove(query)
+                    query.result = _parse_batch_query(query.task)
+                    query.parsed = True
+                else:
+                    pool = pool or _start_batch_pool(workers, engine)
+                    _send_batch_chunk(pool, unsent)
+                    unsent = []
+            if not query.parsed:
+                _receive_batch_chunk(query.chunk)
+            query.count -= 1
+            result = query.result
+            if query.count:
+                result = copy_dsl(result)
+            else:
+                del distinct[query.key]
+            if isinstance(result, QueryError):
+                yield result
+            else:
+                yield add_global_filters(result, global_filters)
+        if pool is not None:
+            pool.close()
+            pool.join()
+            pool = None
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def _analyze_tree(query_string, facets_query_size, default_operator, types,
+                  stats=None):
+    """
+    returns the tree of a query string and the query dsl emitted from it,
+    cached together
+    """
+    if _limits is not None:
+        _limits.check(query_string)
+    cache = _query_cache
+    if cache is None:
+        tree = _parse(parse_tree, query_string, types)
+        return tree, emit_query_dsl(
+            tree, None, facets_query_size, default_operator)
+    key = (tokenizer._sanitize_query(query_string),
+           facets_query_size, default_operator, (types, u'tree'))
+    entry = cache.get(key)
+    if entry is None:
+        tree = _parse(parse_tree, query_string, types)
+        entry = tree, emit_query_dsl(
+            tree, None, facets_query_size, default_operator)
+        # an SQLiteCache leaves the entry out, trees do not marshal
+        cache.set(key, entry)
+    elif stats is not None:
+        stats.cached = True
+    return entry
+
+
+def analyze(
+        query_string, global_filters=None, facets_query_size=20, default_operator='and',
+        engine=None, routing=None):
+    """
+    parses the query string once and returns a QueryAnalysis with its
+    query dsl, document types, facet names, nested paths, free text
+    terms and field names.
+    Takes the same arguments as get_query_dsl. Parses with the hand
+    written parser, whichever the engine, and emits the query dsl from
+    its tree.
     """
-    global FACETS_QUERY_SIZE, DEFAULT_OPERATOR
-    FACETS_QUERY_SIZE = facets_query_size
-    DEFAULT_OPERATOR = default_operator
+    # an unknown engine fails as it does for get_query_dsl
+    _get_tokenize(engine)
+    stats = instrumentation.start(
+        'analyze', engine or _default_engine, query_string)
+    if routing is True:
+        routing = Routing()
+    elif not routing:
+        routing = None
+    if stats is not None:
+        with instrumentation.measure(stats):
+            tree, expression = _analyze_tree(
+                query_string, facets_query_size, default_operator,
+                routing is not None, stats)
+    else:
+        tree, expression = _analyze_tree(
+            query_string, facets_query_size, default_operator,
+            routing is not None)
+    return QueryAnalysis(
+        query_string, tree, expression, global_filters, routing)
 
-    global_filters = global_filters if global_filters else {}
-    expression = tokenizer.tokenize(query_string)
-    bool_lists = expression['query']['filtered']['filter']['bool']
-    [bool_lists['should'].append({"term": orele}) for orele in global_filters.get('or', [])]
-    [bool_lists['must'].append({"term": andele}) for andele in global_filters.get('and', [])]
-    [bool_lists['must_not'].append({"term": notele}) for notele in global_filters.get('not', [])]
-    expression['sort'] = global_filters.get('sort', [])
-    return expression
 
-def get_document_types(query_string):
+def get_document_types(query_string, engine=None, routing=None):
     """
     returns all the document types in a given query string
      param: query_string : an expression of the form
      type: person title:foo AND description:bar
      where type corresponds to an elastic search document type
+     param: routing : also returns the types of type:(a OR b) and of the
+     type: expressions after the first, as get_query_dsl reads them with
+     routing
     """
-    expression = tokenizer.tokenize(query_string)
-    must_filters = expression['query']['filtered']['filter']['bool']['must']
-    return [filter['type']['value'] for filter in must_filters if filter.keys()[0]=='type']
+    return analyze(query_string, engine=engine,
+                   routing=routing).document_types
 
-def is_facet_query(query_string):
-    expression = tokenizer.tokenize(query_string)
-    return True if expression['facets'] else False
\ No newline at end of file
+def is_facet_query(query_string, engine=None):
+    return analyze(query_string, engine=engine).is_facet_query
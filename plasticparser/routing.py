@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Routing hints for the document types a query names, so that a client
+sends the search only to the indices that hold them instead of fanning
+it out to the shards of every index.
+"""
+
+
+class Routing(object):
+    """
+    How get_query_dsl reads the document types of a query and the hint it
+    adds under "routing", {"types": [...], "indices": [...]}. The hint is
+    not part of the query dsl and has to be popped off before sending it.
+
+    param: indices : {document type: index or list of indices} of the
+     indices each type is in. The hint names no indices, None, when the
+     query names no type or a type this does not map, for every index
+     has to be searched then.
+    """
+    def __init__(self, indices=None):
+        self.indices = indices or {}
+
+    def target(self, types):
+        """
+        returns the routing hint of a list of document types
+        """
+        indices = [] if types else None
+        for name in types:
+            index = self.indices.get(name)
+            if index is None:
+                indices = None
+                break
+            if isinstance(index, basestring):
+                index = [index]
+            for index_name in index:
+                if index_name not in indices:
+                    indices.append(index_name)
+        return {"types": list(types), "indices": indices}
+
+
+def document_types(query_dsl):
+    """
+    returns the document types of the type filter of a query dsl, the
+    first filter of its must list
+    """
+    must_list = query_dsl['query']['filtered']['filter']['bool']['must']
+    if must_list:
+        type_filter = must_list[0]
+        if 'type' in type_filter:
+            return [type_filter['type']['value']]
+        if '_type' in type_filter.get('terms', ()):
+            return list(type_filter['terms']['_type'])
+    return []
+
+
+def add_routing(query_dsl, options):
+    """
+    adds the routing hint of the document types of a query dsl
+    """
+    query_dsl["routing"] = options.target(document_types(query_dsl))
+    return query_dsl
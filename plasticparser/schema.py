@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+A registry of the fields of an index, so that queries compile into the
+cheapest filter that is correct for each field: term filters for keyword
+fields, match queries for analyzed text, range filters for the range
+operators and nested filters around the fields of nested documents.
+Unknown fields are rejected before the query reaches the cluster.
+"""
+import hashlib
+import json
+
+from .exceptions import UnknownFieldError
+
+# elasticsearch types whose values are analyzed unless mapped otherwise
+ANALYZED_TYPES = frozenset(['text', 'string'])
+# elasticsearch types whose ranges compare numbers
+NUMERIC_TYPES = frozenset(['long', 'integer', 'short', 'byte', 'double',
+                           'float', 'half_float', 'scaled_float'])
+NESTED_TYPE = 'nested'
+
+
+class Field(object):
+    """
+    A field of the index.
+
+    param: name : the full dotted name queries use
+    param: type : the elasticsearch type, e.g. 'keyword', 'text', 'long'
+     or 'date'
+    param: analyzed : whether the values are analyzed, so that a term
+     filter would miss them. Defaults to True for text and string fields.
+    param: nested_path : the path of the nested documents the field is
+     in. Defaults to the longest nested path of the schema that the name
+     starts with.
+    param: facet_field : the field facets and aggregations count, such as
+     a not analyzed copy of an analyzed field. Defaults to the field
+     itself when it is not analyzed.
+    """
+    __slots__ = ('name', 'type', 'analyzed', 'nested_path', 'facet_field')
+
+    def __init__(self, name, type='keyword', analyzed=None,
+                 nested_path=None, facet_field=None):
+        self.name = name
+        self.type = type
+        self.analyzed = type in ANALYZED_TYPES if analyzed is None \
+            else analyzed
+        self.nested_path = nested_path
+        self.facet_field = facet_field
+
+    def describe(self):
+        return [self.name, self.type, self.analyzed, self.nested_path,
+                self.facet_field]
+
+    def __repr__(self):
+        return "Field({})".format(", ".join(
+            repr(value) for value in self.describe()))
+
+
+def _mapping_fields(properties, prefix, nested_path, fields, nested_paths):
+    for name, mapping in sorted(properties.items()):
+        path = prefix + name
+        field_type = mapping.get('type', 'object')
+        if field_type == NESTED_TYPE:
+            nested_paths.append(path)
+        if 'properties' in mapping:
+            _mapping_fields(
+                mapping['properties'], path + u'.',
+                path if field_type == NESTED_TYPE else nested_path,
+                fields, nested_paths)
+            continue
+        analyzed = field_type in ANALYZED_TYPES and \
+            mapping.get('index') != 'not_analyzed'
+        facet_field = None
+        for sub_name, sub_mapping in sorted(
+                mapping.get('fields', {}).items()):
+            sub_type = sub_mapping.get('type', field_type)
+            if sub_type not in ANALYZED_TYPES or \
+                    sub_mapping.get('index') == 'not_analyzed':
+                facet_field = u'{}.{}'.format(path, sub_name)
+                break
+        fields.append(Field(path, field_type, analyzed, nested_path,
+                            facet_field))
+
+
+class Schema(object):
+    """
+    The fields of an index, compiled into lookup tables once.
+
+    param: fields : Fields, or (name, type) pairs
+    param: nested_paths : the paths of the nested documents
+    param: strict : rejects fields the schema does not have with an
+     UnknownFieldError, otherwise they compile as without a schema
+    """
+    def __init__(self, fields, nested_paths=(), strict=True):
+        self.nested_paths = frozenset(nested_paths)
+        self.strict = strict
+        self._fields = {}
+        # the longest nested path first, to find the innermost one
+        paths = sorted(self.nested_paths, key=len, reverse=True)
+        for field in fields:
+            if not isinstance(field, Field):
+                field = Field(*field)
+            nested_path = field.nested_path
+            if nested_path is None:
+                for path in paths:
+                    if field.name.startswith(path + u'.'):
+                        nested_path = path
+                        break
+            facet_field = field.facet_field
+            if facet_field is None and not field.analyzed:
+                facet_field = field.name
+            self._fields[field.name] = Field(
+                field.name, field.type, field.analyzed, nested_path,
+                facet_field)
+        self.fingerprint = hashlib.sha1(json.dumps(
+            [sorted(field.describe() for field in self._fields.values()),
+             sorted(self.nested_paths), strict])).hexdigest()
+
+    @classmethod
+    def from_mapping(cls, mapping, strict=True):
+        """
+        returns the schema of an elasticsearch mapping, the dict under
+        the name of a document type with its "properties". An analyzed
+        field counts the first not analyzed field of its "fields" in
+        facets.
+        """
+        fields = []
+        nested_paths = []
+        _mapping_fields(mapping.get('properties', {}), u'', None, fields,
+                        nested_paths)
+        return cls(fields, nested_paths, strict)
+
+    def field(self, name):
+        """
+        returns the Field of a name, None for a name the schema does not
+        have when it is not strict
+        """
+        field = self._fields.get(name)
+        if field is None and self.strict:
+            raise UnknownFieldError(None, name)
+        return field
+
+    def facet_field(self, name):
+        """
+        returns the field the facet of a name counts, None when the
+        schema does not say. Pass it to Aggregations as field_names.
+        """
+        field = self.field(name)
+        return field.facet_field if field is not None else None
+
+    def check_nested_path(self, path):
+        if self.strict and path not in self.nested_paths:
+            raise UnknownFieldError(None, path)
+
+    def __contains__(self, name):
+        return name in self._fields
+
+    def __len__(self):
+        return len(self._fields)
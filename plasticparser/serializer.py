@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Writes a parsed query with its global filters as compact json without
+building the query dsl first: the fixed parts of the dsl are written as
+encoded fragments, and the encoded global filters are kept and reused
+while the same global filters come back.
+"""
+import json
+
+from .aggregations import add_aggregations, facet_aggregation
+from .cache import LRUCache, copy_dsl
+from .grammar_parsers import FILTER_TYPES, add_global_filters, _hashable
+from .routing import add_routing, document_types
+
+encode = json.JSONEncoder(separators=(',', ':')).encode
+
+QUERY_START = b'{"query":{"filtered":{'
+QUERY_KEY = b'"query":'
+FILTER_START = b'"filter":{"bool":{"must":['
+SHOULD_START = b'],"should":['
+MUST_NOT_START = b'],"must_not":['
+FILTER_END = b']}}}},'
+FACETS_KEY = b'"facets":'
+AGGREGATIONS_KEY = b'"aggs":'
+SORT_START = b',"sort":'
+ROUTING_KEY = b',"routing":'
+QUERY_END = b'}'
+
+
+class GlobalFilterBlock(object):
+    """
+    The encoded filters and sort that one global_filters dict adds to
+    every query dsl
+    """
+    def __init__(self, global_filters):
+        query_dsl = add_global_filters({
+            'query': {'filtered': {'filter': {'bool': {
+                'must': [], 'should': [], 'must_not': []}}}}
+        }, global_filters)
+        bool_lists = query_dsl['query']['filtered']['filter']['bool']
+        self.must = b','.join(encode(item) for item in bool_lists['must'])
+        self.should = b','.join(
+            encode(item) for item in bool_lists['should'])
+        self.must_not = b','.join(
+            encode(item) for item in bool_lists['must_not'])
+        self.sort = encode(query_dsl['sort'])
+
+
+_blocks = LRUCache(maxsize=64)
+
+
+def get_global_filter_block(global_filters):
+    key = _hashable(global_filters or {})
+    try:
+        block = _blocks.get(key)
+    except TypeError:
+        # a value that cannot be hashed, such as a set
+        return GlobalFilterBlock(global_filters)
+    if block is None:
+        block = GlobalFilterBlock(global_filters)
+        _blocks.set(key, block)
+    return block
+
+
+def _write_list(write, items, encoded_items):
+    if items:
+        write(b','.join(encode(item) for item in items))
+        if encoded_items:
+            write(b',')
+    write(encoded_items)
+
+
+def _implies_filters(must_list):
+    """
+    whether the must list of a query has filters that global filters
+    could be folded into
+    """
+    for query_filter in must_list:
+        for filter_type in query_filter:
+            if filter_type in FILTER_TYPES:
+                return True
+    return False
+
+
+def write_query_json(write, expression, global_filters, aggregations=None,
+                     routing=None):
+    """
+    writes the json of a tokenized query expression with global_filters
+    added, its facets as aggregations when aggregations are given and the
+    hint of routing when it is given, the same as encoding the query dsl
+    get_query_dsl returns
+    """
+    bool_lists = expression['query']['filtered']['filter']['bool']
+    if bool_lists['should'] or bool_lists['must_not'] or \
+            _implies_filters(bool_lists['must']):
+        query_dsl = copy_dsl(expression)
+        if routing is not None:
+            add_routing(query_dsl, routing)
+        query_dsl = add_global_filters(query_dsl, global_filters)
+        if aggregations is not None:
+            add_aggregations(query_dsl, aggregations)
+        write(encode(query_dsl))
+        return
+    block = get_global_filter_block(global_filters)
+    write(QUERY_START)
+    query = expression['query']['filtered'].get('query')
+    if query is not None:
+        write(QUERY_KEY)
+        write(encode(query))
+        write(b',')
+    write(FILTER_START)
+    _write_list(write, bool_lists['must'], block.must)
+    write(SHOULD_START)
+    write(block.should)
+    write(MUST_NOT_START)
+    write(block.must_not)
+    write(FILTER_END)
+    if aggregations is None:
+        write(FACETS_KEY)
+        write(encode(expression['facets']))
+    else:
+        write(AGGREGATIONS_KEY)
+        write(encode(dict(
+            (name, facet_aggregation(name, facet, aggregations))
+            for name, facet in expression['facets'].iteritems())))
+    write(SORT_START)
+    write(block.sort)
+    if routing is not None:
+        write(ROUTING_KEY)
+        write(encode(routing.target(document_types(expression))))
+    write(QUERY_END)
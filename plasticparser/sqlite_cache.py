@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+A parse cache in an SQLite file that the worker processes of a host
+share, so that a query parsed by one of them is parsed by none of the
+others. Entries are marshalled query dsls keyed on the cache key and the
+version of the parser, so that a new release or a grammar change starts
+from an empty cache.
+"""
+import hashlib
+import inspect
+import json
+import marshal
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from . import (
+    __version__, canonical, emitter, fast_tokenizer, grammar_parsers,
+    nodes, optimizer, tokenizer, tree_parser)
+
+# the modules whose changes can change the query dsl of a query
+GRAMMAR_MODULES = (tokenizer, grammar_parsers, fast_tokenizer, tree_parser,
+                   nodes, emitter, canonical, optimizer)
+# entries over maxsize are evicted every this many sets
+EVICT_INTERVAL = 64
+# a hit only records when the entry was used when it was last recorded
+# longer ago than this, so that hits rarely write
+TOUCH_INTERVAL = 60
+
+SCHEMA = (
+    u'CREATE TABLE IF NOT EXISTS entries ('
+    u'version TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, '
+    u'created REAL NOT NULL, accessed REAL NOT NULL, '
+    u'PRIMARY KEY (version, key))',
+    u'CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)',
+)
+
+_version = None
+
+
+def cache_version():
+    """
+    returns a string that changes with the plasticparser version, the
+    source of the grammar and the python version, which sets the format
+    of marshalled values
+    """
+    global _version
+    if _version is None:
+        digest = hashlib.sha1()
+        for module in GRAMMAR_MODULES:
+            try:
+                source = inspect.getsource(module)
+            except (IOError, TypeError):
+                # installed without sources, the release has to do
+                source = module.__name__
+            digest.update(source.encode('utf-8'))
+        _version = u'{}-py{}.{}-{}'.format(
+            __version__, sys.version_info[0], sys.version_info[1],
+            digest.hexdigest()[:12])
+    return _version
+
+
+def _encode_key(key):
+    return json.dumps(key, separators=(',', ':'))
+
+
+class SQLiteCache(object):
+    """
+    A bounded cache in an SQLite file, safe to share between threads and
+    processes. Failing to read or write the file, such as when another
+    process holds it locked for longer than timeout, counts as a miss.
+
+    param: path : the file, created when it does not exist
+    param: maxsize : about the most entries kept. The least recently used
+     are evicted every EVICT_INTERVAL sets, so it can be passed by that
+     many entries for each process.
+    param: ttl : seconds after which an entry is parsed again,
+     None to keep entries until they are evicted
+    param: timeout : seconds to wait for another process writing the file
+    """
+    def __init__(self, path, maxsize=10000, ttl=None, timeout=1.0,
+                 timer=time.time):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timeout = timeout
+        self.timer = timer
+        self.version = cache_version()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        self._sets = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # create the file and drop entries of other versions up front
+        with self._connection() as connection:
+            connection.execute(
+                u'DELETE FROM entries WHERE version != ?', (self.version,))
+
+    def _connection(self):
+        """
+        returns the connection of this thread, reopened after a fork
+        """
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            connection.execute(u'PRAGMA journal_mode=WAL')
+            connection.execute(u'PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            connection.commit()
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key, default=None):
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                u'SELECT value, created, accessed FROM entries '
+                u'WHERE version = ? AND key = ?',
+                (self.version, _encode_key(key))).fetchone()
+            now = self.timer()
+            if row is not None and self.ttl is not None \
+                    and now - row[1] > self.ttl:
+                row = None
+            if row is not None and now - row[2] > TOUCH_INTERVAL:
+                with connection:
+                    connection.execute(
+                        u'UPDATE entries SET accessed = ? '
+                        u'WHERE version = ? AND key = ?',
+                        (now, self.version, _encode_key(key)))
+        except sqlite3.Error:
+            self._count('errors')
+            row = None
+        if row is None:
+            self._count('misses')
+            return default
+        self._count('hits')
+        return marshal.loads(bytes(row[0]))
+
+    def set(self, key, value):
+        try:
+            data = marshal.dumps(value)
+        except ValueError:
+            # not made of plain values, such as a Facets object
+            return
+        now = self.timer()
+        try:
+            with self._connection() as connection:
+                connection.execute(
+                    u'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                    (self.version, _encode_key(key), sqlite3.Binary(data),
+                     now, now))
+            with self._lock:
+                self._sets += 1
+                evict = self._sets % EVICT_INTERVAL == 0
+            if evict:
+                self.evict()
+        except sqlite3.Error:
+            self._count('errors')
+
+    def evict(self):
+        """
+        drops the least recently used entries over maxsize
+        """
+        with self._connection() as connection:
+            cursor = connection.execute(
+                u'DELETE FROM entries WHERE rowid IN ('
+                u'SELECT rowid FROM entries ORDER BY accessed LIMIT '
+                u'max(0, (SELECT count(*) FROM entries) - ?))',
+                (self.maxsize,))
+        with self._lock:
+            self.evictions += max(cursor.rowcount, 0)
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute(u'DELETE FROM entries')
+
+    def __len__(self):
+        return self._connection().execute(
+            u'SELECT count(*) FROM entries WHERE version = ?',
+            (self.version,)).fetchone()[0]
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "errors": self.errors,
+            "size": len(self),
+            "maxsize": self.maxsize
+        }
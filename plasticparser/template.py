@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Query templates: a query string with {name} placeholders is parsed once
+into its query dsl, and render fills the values into a copy of it, so
+rendering never parses.
+"""
+import marshal
+import re
+from string import Formatter
+
+from .cache import copy_dsl
+from .emitter import emit_query_dsl, emit_structured_dsl
+from .grammar_parsers import (
+    DEFAULT_FACETS_QUERY_SIZE, DEFAULT_OPERATOR, sanitize_value)
+from .tree_parser import parse_tree
+
+# a word that parses as a plain value or free text wherever a value can
+# stand, marking where each placeholder ended up in the query dsl
+SLOT = u'plasticslot{}x'
+SLOT_PATTERN = re.compile(u'plasticslot([0-9]+)x')
+NEEDS_QUOTES = re.compile(u'[\\s"(]')
+QUOTE_OR_ESCAPE = re.compile(u'\\\\.|"')
+PHRASE_RESERVED_CHARS = re.compile(u'[\\\\"]')
+
+
+def quote_value(value):
+    """
+    escapes a value like sanitize_value, and quotes it when it has
+    whitespace, quotes or parens so that it stays one value
+    """
+    text = sanitize_value(value if isinstance(value, basestring)
+                          else unicode(value))
+    if not text or NEEDS_QUOTES.search(text):
+        return u'"{}"'.format(text.replace(u'"', u'\\"'))
+    return text
+
+
+def quote_phrase_value(value):
+    """
+    escapes a value that goes between the quotes of a phrase
+    """
+    text = value if isinstance(value, basestring) else unicode(value)
+    return PHRASE_RESERVED_CHARS.sub(u'\\\\\\g<0>', text)
+
+
+def _quoted_slots(parts):
+    """
+    returns the indexes of the slots in parts, split around them, that
+    are between the quotes of a phrase
+    """
+    quoted = set()
+    inside = False
+    for index, part in enumerate(parts):
+        if index % 2 == 0:
+            for match in QUOTE_OR_ESCAPE.finditer(part):
+                if match.group() == u'"':
+                    inside = not inside
+        elif inside:
+            quoted.add(index)
+    return quoted
+
+
+class QueryTemplate(object):
+    """
+    A parsed query template. render(**values) returns the query dsl of
+    the template with each placeholder replaced by its value.
+    """
+    def __init__(self, template_string, query_dsl, names):
+        self.template_string = template_string
+        self.names = names
+        self._query_dsl = query_dsl
+        try:
+            # loading a marshalled copy is several times faster than
+            # copy_dsl
+            self._frozen = marshal.dumps(query_dsl)
+        except ValueError:
+            self._frozen = None
+        # (path to the string, its text split around the slots,
+        #  whether it is query_string syntax, the slots between quotes)
+        self._slots = []
+        self._find_slots(query_dsl, ())
+
+    def _find_slots(self, value, path):
+        if isinstance(value, dict):
+            items = value.iteritems()
+        elif isinstance(value, list):
+            items = enumerate(value)
+        else:
+            if isinstance(value, basestring) and SLOT_PATTERN.search(value):
+                parts = SLOT_PATTERN.split(value)
+                for index in range(1, len(parts), 2):
+                    parts[index] = self.names[int(parts[index])]
+                is_query_string = path[-2:] == ('query_string', 'query')
+                self._slots.append(
+                    (path, parts, is_query_string,
+                     _quoted_slots(parts) if is_query_string else ()))
+            return
+        for key, item in items:
+            if isinstance(key, basestring) and SLOT_PATTERN.search(key):
+                raise ValueError(
+                    "a placeholder can only stand for a value: {!r}".format(
+                        self.template_string))
+            self._find_slots(item, path + (key,))
+
+    def render(self, **values):
+        if self._frozen is not None:
+            query_dsl = marshal.loads(self._frozen)
+        else:
+            query_dsl = copy_dsl(self._query_dsl)
+        for path, parts, is_query_string, quoted in self._slots:
+            if len(parts) == 3 and not parts[0] and not parts[2] \
+                    and not is_query_string:
+                text = values[parts[1]]
+            else:
+                text = []
+                for index, part in enumerate(parts):
+                    if index % 2 == 0:
+                        text.append(part)
+                    elif index in quoted:
+                        text.append(quote_phrase_value(values[part]))
+                    elif is_query_string:
+                        text.append(quote_value(values[part]))
+                    else:
+                        value = values[part]
+                        text.append(value if isinstance(value, basestring)
+                                    else unicode(value))
+                text = u''.join(text)
+            container = query_dsl
+            for key in path[:-1]:
+                container = container[key]
+            container[path[-1]] = text
+        return query_dsl
+
+
+def compile_template(template_string, global_filters=None,
+                     facets_query_size=DEFAULT_FACETS_QUERY_SIZE,
+                     default_operator=DEFAULT_OPERATOR, structured=False,
+                     schema=None):
+    """
+    parses a query string with {name} placeholders, e.g.
+    'type:candidates status:{status} facets:[location]', and returns a
+    QueryTemplate. A placeholder stands for one value or word of free
+    text; {{ and }} are literal braces.
+    Takes the other arguments of get_query_dsl.
+    """
+    if SLOT_PATTERN.search(template_string):
+        raise ValueError("the template has a reserved word: {!r}".format(
+            template_string))
+    names = []
+    query = []
+    for literal, name, format_spec, conversion in \
+            Formatter().parse(template_string):
+        query.append(literal)
+        if name is None:
+            continue
+        if not name or format_spec or conversion:
+            raise ValueError("placeholders are {{name}}: {!r}".format(
+                template_string))
+        query.append(SLOT.format(len(names)))
+        names.append(name)
+    tree = parse_tree(u''.join(query))
+    if schema is not None:
+        query_dsl = emit_structured_dsl(tree, global_filters,
+                                        facets_query_size, default_operator,
+                                        schema)
+    else:
+        emit = emit_structured_dsl if structured else emit_query_dsl
+        query_dsl = emit(tree, global_filters, facets_query_size,
+                         default_operator)
+    return QueryTemplate(template_string, query_dsl, names)
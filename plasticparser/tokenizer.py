@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
+import re
+import threading
 
 from pyparsing import (
-    Word, QuotedString, oneOf, CaselessLiteral, White,
+    Word, QuotedString, oneOf, CaselessLiteral, White, Regex,
     OneOrMore, Optional, alphanums, srange, ZeroOrMore)
 from .grammar_parsers import (
+    DEFAULT_FACETS_QUERY_SIZE, DEFAULT_OPERATOR, parse_context,
     parse_logical_expression, parse_compare_expression, parse_free_text,
     parse_paren_base_logical_expression, join_brackets, join_words,
     parse_facet_compare_expression, parse_one_or_more_facets_expression,
@@ -11,24 +14,33 @@ from .grammar_parsers import (
     parse_single_facet_expression, parse_base_facets_expression,
     parse_type_expression, parse_one_or_more_logical_expressions,
     parse_type_logical_facets_expression)
+from .limits import step
 
-unicode_printables = u''.join(unichr(c) for c in xrange(65536)
-                              if not unichr(c).isspace())
+
+PRINTABLES_PATTERN = u'[^\\s{}]+'
+
+
+def get_printables(exclude_chars=u''):
+    """
+    returns an element matching a run of non whitespace characters,
+    leaving out exclude_chars
+    """
+    return Regex(PRINTABLES_PATTERN.format(re.escape(exclude_chars)),
+                 re.UNICODE)
 
 
 def get_word():
-    return Word(unicode_printables, excludeChars=[')'])
+    return get_printables(u')')
 
 
 def get_value():
-    word = Word(unicode_printables, excludeChars=[')'])
+    word = get_printables(u')')
     quoted_word = QuotedString('"', unquoteResults=False, escChar='\\')
     return quoted_word | word
 
 
 def get_key():
-    return Word(unicode_printables,
-                excludeChars=[':', ':>', ':>=', ':<', ':<=', '('])
+    return get_printables(u':(')
 
 
 def get_operator():
@@ -43,13 +55,19 @@ def get_logical_expression():
     logical_operator = get_logical_operator()
     compare_expression = get_key() + get_operator() + get_value()
     compare_expression.setParseAction(parse_compare_expression)
+    compare_expression.setName('compare_expression')
+    # a lone compare expression is the prefix of a pair; matching it once
+    # keeps a failed pair from parsing the same compare expression again.
+    # The tail must not skip whitespace so that White() can still match it.
+    pair_tail = logical_operator + compare_expression
+    pair_tail.skipWhitespace = False
     base_logical_expression = (compare_expression
-                               + logical_operator
-                               + compare_expression).setParseAction(
-        parse_logical_expression) | compare_expression | Word(
-        unicode_printables).setParseAction(parse_free_text)
+                               + Optional(pair_tail)).setParseAction(
+        parse_logical_expression).setName('logical_expression') | \
+        get_printables().setParseAction(parse_free_text).setName('free_text')
     logical_expression = ('(' + base_logical_expression + ')').setParseAction(
-        parse_paren_base_logical_expression) | base_logical_expression
+        parse_paren_base_logical_expression).setName(
+        'paren_logical_expression') | base_logical_expression
     return logical_expression
 
 
@@ -60,34 +78,54 @@ def get_nested_logical_expression():
     key = get_key()
 
     paren_value = '(' + OneOrMore(
-        logical_operator | value).setParseAction(join_words) + ')'
+        logical_operator | value).setParseAction(join_words).setName(
+        'paren_words') + ')'
     paren_value.setParseAction(join_brackets)
+    paren_value.setName('paren_value')
     facet_compare_expression = key + operator + paren_value | value
     facet_compare_expression.setParseAction(parse_facet_compare_expression)
+    facet_compare_expression.setName('facet_compare_expression')
     facet_base_logical_expression = (facet_compare_expression
                                      + Optional(logical_operator)).setParseAction(
-                                         parse_logical_expression) | value
+                                         parse_logical_expression).setName(
+        'facet_logical_expression') | value
     facet_logical_expression = ('(' + facet_base_logical_expression
                                 + ')').setParseAction(
-        parse_paren_base_logical_expression) | facet_base_logical_expression
+        parse_paren_base_logical_expression).setName(
+        'paren_facet_logical_expression') | facet_base_logical_expression
     return facet_logical_expression
 
 
+def _no_action(*args):
+    pass
+
+
+def count_steps(element):
+    """
+    counts every attempt at the element against the parse budget
+    """
+    return element.setDebugActions(step, _no_action, _no_action)
+
+
 def get_facet_expression():
     facet_logical_expression = get_nested_logical_expression()
     single_facet_expression = Word(
         srange("[a-zA-Z0-9_.]")) +\
         Optional(
             Word('(').suppress() +
-            OneOrMore(facet_logical_expression).setParseAction(parse_one_or_more_facets_expression) +
+            OneOrMore(facet_logical_expression).setParseAction(parse_one_or_more_facets_expression).setName('facet_filter') +
             Word(')').suppress())
     single_facet_expression.setParseAction(parse_single_facet_expression)
+    single_facet_expression.setName('facet')
+    count_steps(single_facet_expression)
     base_facets_expression = OneOrMore(single_facet_expression
                                        + Optional(',').suppress())
     base_facets_expression.setParseAction(parse_base_facets_expression)
+    base_facets_expression.setName('facets')
     facets_expression = Word('facets:').suppress() \
         + Word('[').suppress() \
         + base_facets_expression + Word(']').suppress()
+    facets_expression.setName('facets_expression')
     return facets_expression
 
 
@@ -97,16 +135,20 @@ def get_nested_expression():
         srange("[a-zA-Z0-9_.]")) +\
         Optional(
             Word('(').suppress() +
-            OneOrMore(facet_logical_expression).setParseAction(parse_one_or_more_facets_expression) +
+            OneOrMore(facet_logical_expression).setParseAction(parse_one_or_more_facets_expression).setName('nested_filter') +
             Word(')').suppress())
     single_nested_expression.setParseAction(parse_single_nested_expression)
+    single_nested_expression.setName('nested')
+    count_steps(single_nested_expression)
     base_nested_expression = OneOrMore(single_nested_expression
                                        + Optional(',').suppress())
     base_nested_expression.setParseAction(parse_base_nested_expression)
+    base_nested_expression.setName('nesteds')
     nested_expression = Word('nested:').suppress()\
         + Word('[').suppress()\
         + base_nested_expression\
         + Word(']').suppress()
+    nested_expression.setName('nested_expression')
     return nested_expression
 
 
@@ -123,14 +165,16 @@ def _construct_grammar():
         + Word(alphanums)\
         + Optional(CaselessLiteral('AND')).suppress()
     type_expression.setParseAction(parse_type_expression)
+    type_expression.setName('type_expression')
 
+    clause = facets_expression | nested_expression | logical_expression
+    clause.setName('clause')
+    count_steps(clause)
     base_expression = Optional(type_expression)\
-        + ZeroOrMore((facets_expression
-                      | nested_expression
-                      | logical_expression)
-                     + Optional(logical_operator)).setParseAction(
-            parse_one_or_more_logical_expressions)
+        + ZeroOrMore(clause + Optional(logical_operator)).setParseAction(
+            parse_one_or_more_logical_expressions).setName('clauses')
     base_expression.setParseAction(parse_type_logical_facets_expression)
+    base_expression.setName('query')
 
     return base_expression
 
@@ -141,9 +185,38 @@ def _sanitize_query(query_string):
         query_string = query_string.replace(char, u' ')
     return query_string.strip()
 
-grammar = _construct_grammar()
 
-def tokenize(query_string):
-    return grammar.parseString(_sanitize_query(query_string),
-                               parseAll=True).asList()[0]
+# runs every parse action once so pyparsing settles how many arguments
+# each one takes before threads share the grammar
+WARM_UP_QUERY = u'type:a facets:[b(c:(d) AND (e:(f)))] r ' \
+    u'nested:[g(h:(i) (j:(k)))] (n:o p:q) l:m'
+
+_grammar = None
+_grammar_lock = threading.Lock()
+
+
+def get_grammar():
+    """
+    returns the query grammar, constructing it on first use.
+    Call it before forking worker processes to share one prebuilt grammar.
+    The grammar is never modified after it is returned, so any number of
+    threads can parse with it at once.
+    """
+    global _grammar
+    if _grammar is None:
+        with _grammar_lock:
+            if _grammar is None:
+                grammar = _construct_grammar()
+                grammar.streamline()
+                grammar.parseString(WARM_UP_QUERY, parseAll=True)
+                _grammar = grammar
+    return _grammar
+
+
+def tokenize(query_string, facets_query_size=DEFAULT_FACETS_QUERY_SIZE,
+             default_operator=DEFAULT_OPERATOR):
+    grammar = get_grammar()
+    with parse_context(facets_query_size, default_operator):
+        return grammar.parseString(_sanitize_query(query_string),
+                                   parseAll=True).asList()[0]
 
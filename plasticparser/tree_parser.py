@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+Builds the syntax tree of a query string in one pass of the hand written
+parser, for emitter.emit_query_dsl to turn into the same query dsl the
+engines build.
+"""
+from pyparsing import ParseException
+
+import re
+
+from .fast_tokenizer import (
+    Parser, QUOTED_WORD, FREE_TEXT, OPEN_PARENS, CLOSE_PARENS, FACETS_KEYWORD,
+    TYPE_KEYWORD, TYPE_SEPARATOR, TYPE_VALUE, WHITESPACE)
+from .nodes import (
+    Node, Term, Phrase, Compare, Bool, Paren, TypeFilter, TypeTerms, Facet,
+    NestedClause, SearchQuery)
+from .tokenizer import _sanitize_query
+
+# type: expressions after the first need the keyword itself, so that
+# compare expressions on fields such as yet: stay in the query
+REPEATED_TYPE_KEYWORD = re.compile(u'type')
+# free text that joins the clause after it by OR or negates it, when the
+# grammar reads an operator as a word
+NOT_AND_JOINING = frozenset([u'OR', u'||', u'NOT', u'!', u'-'])
+# the field of a compare expression that could parse as the type
+# expression when it starts the query
+TYPE_LIKE = re.compile(u'[type]+$')
+# characters that can make a field or value parse differently once it is
+# moved or the whitespace around it changes
+SPECIAL_CHARS = re.compile(u'[()\\[\\]"\\\\]')
+TERM_SPECIAL_CHARS = re.compile(u'[()\\[\\]"\\\\:]')
+
+
+def chain(tokens):
+    """
+    joins a sequence of nodes and logical operators, in the order the
+    query has them, into one left leaning tree
+    """
+    tree = None
+    operator = None
+    for token in tokens:
+        if not isinstance(token, Node):
+            if operator is not None:
+                tree = Bool(operator, tree, None)
+            operator = token
+        elif tree is None and operator is None:
+            tree = token
+        else:
+            tree = Bool(operator, tree, token)
+            operator = None
+    if operator is not None:
+        tree = Bool(operator, tree, None)
+    return tree
+
+
+def flatten(node):
+    """
+    returns the nodes and logical operators a chain of Bool nodes was
+    built from, in order
+    """
+    tokens = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if type(node) is Bool:
+            stack.append(node.right)
+            if node.operator is not None:
+                stack.append(node.operator)
+            stack.append(node.left)
+        elif node is not None:
+            tokens.append(node)
+    return tokens
+
+
+def joining_operator(tokens, default_operator):
+    """
+    returns the operator that joins every two neighbouring nodes of
+    flattened tokens, default_operator where none is written. None when
+    they are joined by different ones or an operator lacks a node on
+    either side.
+    """
+    operators = set()
+    after_node = False
+    for token in tokens:
+        if not isinstance(token, Node):
+            if not after_node:
+                return None
+            operators.add(token)
+        elif after_node:
+            operators.add(default_operator)
+        after_node = isinstance(token, Node)
+    if not after_node or len(operators) > 1:
+        return None
+    return operators.pop() if operators else default_operator
+
+
+def is_plain(node):
+    """
+    whether the node parses back to itself from canonical.format_node
+    wherever a clause can stand
+    """
+    node_type = type(node)
+    if node_type is Term:
+        return TERM_SPECIAL_CHARS.search(node.text) is None
+    if node_type is Phrase:
+        return True
+    if node_type is Compare:
+        value = node.value
+        if type(value) is Phrase:
+            value = u''
+        elif value[:1] == u'(' and value[-1:] == u')':
+            # the parenthesised value of a facet or nested filter
+            value = value[1:-1]
+        if value[:1] == u':' and TYPE_LIKE.match(node.field):
+            # type : :x would become type::x, a type expression
+            return False
+        return SPECIAL_CHARS.search(node.field) is None and \
+            SPECIAL_CHARS.search(value) is None
+    if node_type is Paren:
+        return is_plain(node.child)
+    if node_type is Bool:
+        return all(is_plain(token) for token in flatten(node)
+                   if isinstance(token, Node))
+    return node is None
+
+
+def make_value(text):
+    if text[:1] == u'"':
+        match = QUOTED_WORD.match(text)
+        if match is not None and match.end() == len(text):
+            return Phrase(text[1:-1])
+    return text
+
+
+class TreeParser(Parser):
+    """
+    A Parser whose elements return nodes instead of query strings and
+    dicts. Filter expressions and the top level query are lists of nodes
+    and logical operators until they are chained.
+    With types, type:(a OR b) and the type: expressions the rest of the
+    query must match are read into the type filter as well.
+    """
+    def __init__(self, query, types=False):
+        Parser.__init__(self, query)
+        self.types = types
+
+    def compare_expression(self, pos):
+        result = self.key_and_operator(pos)
+        if result is None:
+            return None
+        pos, key, operator = result
+        result = self.value(pos)
+        if result is None:
+            return None
+        return result[0], Compare(key, operator, make_value(result[1]))
+
+    def base_logical_expression(self, pos, split_types=False):
+        result = self.compare_expression(pos)
+        if result is None:
+            match = self.match(FREE_TEXT, pos)
+            if match is None:
+                return None
+            return match.end(), Term(match.group())
+        pos, compare = result
+        operator = self.logical_operator(pos)
+        if operator is not None and split_types and operator[1] != u'OR' \
+                and self.repeated_type_expression(operator[0], ()):
+            # the second compare expression is read into the type filter
+            return pos, compare
+        if operator is not None:
+            second = self.compare_expression(operator[0])
+            if second is not None:
+                return second[0], Bool(operator[1], compare, second[1])
+        return pos, compare
+
+    def logical_expression(self, pos):
+        start = self.literal(u'(', pos)
+        if start >= 0:
+            result = self.base_logical_expression(start)
+            if result is not None:
+                end = self.literal(u')', result[0])
+                if end >= 0:
+                    return end, Paren(result[1])
+        return self.base_logical_expression(pos, self.types)
+
+    def facet_compare_expression(self, pos):
+        result = self.key_and_operator(pos)
+        if result is None:
+            return None
+        pos, key, operator = result
+        result = self.paren_value(pos)
+        if result is None:
+            return None
+        return result[0], Compare(key, operator, result[1])
+
+    def facet_base_logical_expression(self, pos):
+        result = self.facet_compare_expression(pos)
+        if result is None:
+            result = self.value(pos)
+            if result is None:
+                return None
+            value = make_value(result[1])
+            if not isinstance(value, Phrase):
+                value = Term(value)
+            return result[0], [value]
+        pos, compare = result
+        operator = self.logical_operator(pos)
+        if operator is None:
+            return pos, [compare]
+        if operator[1] is None:
+            return operator[0], [compare]
+        return operator[0], [compare, operator[1]]
+
+    def facet_logical_expression(self, pos):
+        start = self.literal(u'(', pos)
+        if start >= 0:
+            result = self.facet_base_logical_expression(start)
+            if result is not None:
+                end = self.literal(u')', result[0])
+                if end >= 0:
+                    return end, [Paren(chain(result[1]))]
+        return self.facet_base_logical_expression(pos)
+
+    def filter_expression(self, pos):
+        match = self.match(OPEN_PARENS, pos)
+        if match is None:
+            return None
+        pos = match.end()
+        tokens = []
+        while True:
+            result = self.facet_logical_expression(pos)
+            if result is None:
+                break
+            pos = result[0]
+            tokens.extend(result[1])
+        if not tokens:
+            return None
+        match = self.match(CLOSE_PARENS, pos)
+        if match is None:
+            return None
+        return match.end(), chain(tokens)
+
+    def single_facet_expression(self, pos):
+        result = self.field_with_filter(pos)
+        if result is None:
+            return None
+        tokens = result[1]
+        return result[0], Facet(
+            tokens[0], tokens[1] if len(tokens) > 1 else None)
+
+    def single_nested_expression(self, pos):
+        result = self.field_with_filter(pos)
+        if result is None or len(result[1]) < 2:
+            return None
+        return result[0], NestedClause(*result[1])
+
+    def facets_expression(self, pos):
+        result = self.bracketed_list(
+            FACETS_KEYWORD, self.single_facet_expression, pos)
+        if result is None:
+            return None
+        return result[0], tuple(result[1])
+
+    def type_expression(self, pos):
+        result = Parser.type_expression(self, pos)
+        if result is None:
+            return None
+        return result[0], TypeFilter(
+            result[1].get_query()['type']['value'])
+
+    def type_names(self, keyword, pos):
+        """
+        parses type:name or type:(name OR name ...) and the AND after it
+        into (end, names)
+        """
+        for pattern in (keyword, TYPE_SEPARATOR):
+            match = self.match(pattern, pos)
+            if match is None:
+                return None
+            pos = match.end()
+        start = self.literal(u'(', pos)
+        names = []
+        while True:
+            match = self.match(TYPE_VALUE, pos if start < 0 else start)
+            if match is None:
+                return None
+            pos = match.end()
+            names.append(match.group())
+            if start < 0:
+                break
+            operator = self.logical_operator(pos)
+            if operator is None or operator[1] != u'OR':
+                pos = self.literal(u')', pos)
+                if pos < 0:
+                    return None
+                break
+            start = operator[0]
+        start = self.skip(pos)
+        if self.query[start:start + 3].upper() == u'AND':
+            pos = start + 3
+        return pos, names
+
+    def followed_by_or(self, pos):
+        operator = self.logical_operator(pos)
+        return operator is not None and operator[1] == u'OR'
+
+    def repeated_type_expression(self, pos, tokens):
+        """
+        parses a type: expression after the first, when it is neither
+        negated nor joined to the clauses around it by OR
+        """
+        if tokens:
+            last = tokens[-1]
+            if isinstance(last, Term):
+                last = last.text.upper()
+            if last in NOT_AND_JOINING:
+                return None
+        result = self.type_names(REPEATED_TYPE_KEYWORD, pos)
+        # the value has to be a whole word, not the start of one
+        if result is None or \
+                self.query[result[0]:result[0] + 1] not in WHITESPACE:
+            return None
+        if self.followed_by_or(result[0]):
+            return None
+        return result
+
+    def parse(self):
+        type_filter = None
+        type_names = []
+        pos = 0
+        if self.types:
+            result = self.type_names(TYPE_KEYWORD, pos)
+            if result is not None and not self.followed_by_or(result[0]):
+                pos = result[0]
+                type_names.extend(result[1])
+        else:
+            result = self.type_expression(pos)
+            if result is not None:
+                pos, type_filter = result
+        tokens = []
+        after_type = False
+        while self.skip(pos) < self.length:
+            if self.types:
+                result = self.repeated_type_expression(pos, tokens)
+                if result is not None:
+                    pos = result[0]
+                    type_names.extend(result[1])
+                    after_type = True
+                    continue
+            result = self.clause(pos)
+            if result is None:
+                break
+            pos = result[0]
+            tokens.extend(result[1])
+            after_type = False
+        pos = self.skip(pos)
+        if pos != self.length:
+            raise ParseException(self.query, pos, "Expected end of text")
+        if after_type and tokens and not isinstance(tokens[-1], Node):
+            # the operator joined the query to a type: expression
+            tokens.pop()
+        if type_names:
+            type_filter = make_type_filter(type_names)
+        return build_tree(type_filter, tokens)
+
+
+def make_type_filter(names):
+    """
+    returns the TypeFilter of one document type, the TypeTerms of several
+    """
+    unique = []
+    for name in names:
+        if name not in unique:
+            unique.append(name)
+    if len(unique) == 1:
+        return TypeFilter(unique[0])
+    return TypeTerms(tuple(unique))
+
+
+def build_tree(type_filter, tokens):
+    """
+    takes the facets and nested lists out of the top level tokens the
+    way grammar_parsers.split_query_tokens does, so that two lists in a
+    row fail the same way
+    """
+    facets = ()
+    nested = []
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        if isinstance(token, NestedClause):
+            nested.append(token)
+            del tokens[index]
+        elif isinstance(token, tuple):
+            facets = token
+            del tokens[index]
+        index += 1
+    for token in tokens:
+        if isinstance(token, (NestedClause, tuple)):
+            raise TypeError(
+                "facets and nested lists need an expression between them")
+    return SearchQuery(type_filter, facets, tuple(nested), chain(tokens))
+
+
+def parse_tree(query_string, types=False):
+    """
+    returns the SearchQuery tree of a query string
+    param: types : reads type:(a OR b) and the type: expressions after
+     the first into the type filter of the tree
+    """
+    return TreeParser(_sanitize_query(query_string), types).parse()
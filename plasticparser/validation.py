@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+A strict, linear check of a query string that runs before any parsing.
+It rejects what users most often get wrong: unbalanced parens, brackets
+and quotes, malformed facets:[ ] and nested:[ ] lists and a compare
+expression with no value, reporting where the query goes wrong.
+"""
+import re
+
+from .exceptions import QuerySyntaxError
+
+WHITESPACE = u' \n\t\r\xa0'
+
+TOKEN = re.compile(
+    u'"|[()\\[\\]]|(?<![^{0}(])(facets|nested)[{0}]*:[{0}]*(?=\\[)'.format(
+        WHITESPACE))
+FILTER_TOKEN = re.compile(u'["()]')
+QUOTED = re.compile(r'"(?:[^"\n\r\\]|(?:\\.))*"')
+FIELD = re.compile(u'[a-zA-Z0-9_.]+')
+SPACES = re.compile(u'[{}]*'.format(WHITESPACE))
+# a key and operator with no value after them, matched against the
+# reversed query string so that it is only tried at its end
+KEY_WITHOUT_VALUE_REVERSED = re.compile(
+    u'[{0}]*(?:=<|=>|[<>=])?:[{0}]*[^\\s:(]'.format(WHITESPACE),
+    re.UNICODE)
+
+
+def _skip(query_string, pos):
+    return SPACES.match(query_string, pos).end()
+
+
+def _quote_end(query_string, pos):
+    match = QUOTED.match(query_string, pos)
+    if match is None:
+        raise QuerySyntaxError(
+            query_string, len(query_string), u'\'"\'',
+            u"unterminated quote at offset {}".format(pos))
+    return match.end()
+
+
+def _filter_end(query_string, pos):
+    """
+    returns the end of the parenthesised filter opening at pos
+    """
+    depth = 0
+    while True:
+        match = FILTER_TOKEN.search(query_string, pos)
+        if match is None:
+            raise QuerySyntaxError(query_string, len(query_string), u"')'")
+        pos = match.end()
+        token = match.group()
+        if token == u'"':
+            pos = _quote_end(query_string, match.start())
+        elif token == u'(':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return pos
+
+
+def _list_end(query_string, keyword, pos):
+    """
+    returns the end of the facets or nested list whose '[' is at pos
+    """
+    pos = _skip(query_string, pos + 1)
+    while True:
+        match = FIELD.match(query_string, pos)
+        if match is None:
+            raise QuerySyntaxError(query_string, pos, u'field name')
+        pos = _skip(query_string, match.end())
+        if query_string[pos:pos + 1] == u'(':
+            start = _skip(query_string, pos + 1)
+            pos = _filter_end(query_string, pos)
+            if start == pos - 1:
+                raise QuerySyntaxError(query_string, start, u'filter')
+            pos = _skip(query_string, pos)
+        elif keyword == u'nested':
+            raise QuerySyntaxError(query_string, pos, u"'('")
+        if query_string[pos:pos + 1] == u',':
+            pos = _skip(query_string, pos + 1)
+        if query_string[pos:pos + 1] == u']':
+            return pos + 1
+        if FIELD.match(query_string, pos) is None:
+            raise QuerySyntaxError(query_string, pos, u"',' or ']'")
+
+
+def check_query(query_string):
+    """
+    raises a QuerySyntaxError for the first problem found in the query
+    """
+    parens = []
+    brackets = []
+    pos = 0
+    while True:
+        match = TOKEN.search(query_string, pos)
+        if match is None:
+            break
+        token = match.group()
+        pos = match.end()
+        if token == u'"':
+            pos = _quote_end(query_string, match.start())
+        elif token == u'(':
+            parens.append(match.start())
+        elif token == u')':
+            if not parens:
+                raise QuerySyntaxError(
+                    query_string, match.start(), u"'('",
+                    u"unmatched ')' at offset {}".format(match.start()))
+            parens.pop()
+        elif token == u'[':
+            brackets.append(match.start())
+        elif token == u']':
+            if not brackets:
+                raise QuerySyntaxError(
+                    query_string, match.start(), u"'['",
+                    u"unmatched ']' at offset {}".format(match.start()))
+            brackets.pop()
+        else:
+            pos = _skip(query_string, _list_end(
+                query_string, match.group(1), pos))
+            following = TOKEN.match(query_string, pos)
+            # the parser cannot take two lists in a row
+            if following is not None and following.group(1):
+                raise QuerySyntaxError(
+                    query_string, pos, u'expression',
+                    u"expected an expression between the lists "
+                    u"at offset {}".format(pos))
+    if parens:
+        raise QuerySyntaxError(
+            query_string, len(query_string), u"')'",
+            u"unclosed '(' at offset {}".format(parens[-1]))
+    if brackets:
+        raise QuerySyntaxError(
+            query_string, len(query_string), u"']'",
+            u"unclosed '[' at offset {}".format(brackets[-1]))
+    if KEY_WITHOUT_VALUE_REVERSED.match(query_string[::-1]):
+        raise QuerySyntaxError(query_string, len(query_string), u'value')
+
+
+def validate(query_string):
+    """
+    returns None for a well formed query string, otherwise a
+    QuerySyntaxError with the offset and the token expected there.
+    Much stricter and cheaper than parsing: use it to turn away bad
+    input before get_query_dsl sees it.
+    """
+    try:
+        check_query(query_string)
+    except QuerySyntaxError as error:
+        return error
+    return None
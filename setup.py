@@ -1,13 +1,23 @@
 # -*- coding: utf-8 -*-
 
+import io
+import os
+import re
 from distutils.core import setup
 
+# read rather than imported, so that setup.py runs before pyparsing is
+# installed
+with io.open(os.path.join(os.path.dirname(__file__), 'plasticparser',
+                          '__init__.py'), encoding='utf-8') as init_file:
+    version = re.search(r"^__version__ = '([^']+)'", init_file.read(),
+                        re.M).group(1)
+
 long_description = """
  Let's to convert Google Like Query Language into ElasticSearch understandable Query DSL
  """
 
 setup(name='plasticparser',
-      version='0.2.8',
+      version=version,
       description='An Elastic Search Query Parser',
       long_description=long_description,
       url='https://github.com/Aplopio/plasticparser',
@@ -2,3 +2,18 @@
 
 from test_plasticparser import *
 from test_tokenizer import *
+from test_cache import *
+from test_fast_tokenizer import *
+from test_grammar_parsers import *
+from test_incremental import *
+from test_validation import *
+from test_instrumentation import *
+from test_tree_parser import *
+from test_canonical import *
+from test_template import *
+from test_offload import *
+from test_limits import *
+from test_sqlite_cache import *
+from test_schema import *
+from test_optimizer import *
+from test_routing import *
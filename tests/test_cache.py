@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from plasticparser.cache import LRUCache, copy_dsl
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_should_evict_least_recently_used_entry(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats(), {
+            'hits': 3, 'misses': 1, 'evictions': 1,
+            'size': 2, 'maxsize': 2})
+
+    def test_should_expire_entries_older_than_ttl(self):
+        timer = FakeTimer()
+        cache = LRUCache(maxsize=2, ttl=10, timer=timer)
+        cache.set('a', 1)
+        timer.now = 10
+        self.assertEqual(cache.get('a'), 1)
+        timer.now = 11
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_should_reject_empty_cache(self):
+        self.assertRaises(ValueError, LRUCache, 0)
+
+
+class CopyDslTest(unittest.TestCase):
+    def test_should_copy_nested_dicts_and_lists(self):
+        dsl = {'query': {'bool': {'must': [{'term': {'a': 1}}]}}}
+        copied = copy_dsl(dsl)
+        self.assertEqual(copied, dsl)
+        copied['query']['bool']['must'].append({'term': {'b': 2}})
+        self.assertEqual(len(dsl['query']['bool']['must']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import random
+import unittest
+
+from plasticparser import plasticparser
+from plasticparser.canonical import normal_form
+from plasticparser.emitter import emit_query_dsl
+
+from tests.test_fast_tokenizer import QUERIES, make_query
+
+
+class CanonicalizeTest(unittest.TestCase):
+    def test_should_put_equivalent_queries_in_one_form(self):
+        for query_strings in [
+                [u'a:1 AND b:2', u'b:2 and a:1', u'  b:2   AND\ta:1 '],
+                [u'x y title:"hello"', u'title:hello y x'],
+                [u'(b:2 OR a:1) c', u'c (a:1 or b:2)'],
+                [u'type:help facets:[tags, location(a:(b))] r',
+                 u'type:help facets:[location(a:(b)) , tags] r'],
+                [u'facets:[a] r nested:[n(m:(1))] q:1',
+                 u'facets:[a] q:1 r nested:[n(m:(1))]']]:
+            forms = set(plasticparser.canonicalize(query_string)
+                        for query_string in query_strings)
+            self.assertEqual(len(forms), 1, forms)
+            fingerprints = set(plasticparser.fingerprint(query_string)
+                               for query_string in query_strings)
+            self.assertEqual(len(fingerprints), 1)
+
+    def test_should_keep_queries_that_differ_apart(self):
+        for first, second in [
+                (u'a:1 AND b:2', u'a:1 OR b:2'),
+                (u'a:1 AND b:2 OR c:3', u'c:3 AND b:2 OR a:1'),
+                (u'title:"hello world"', u'title:hello world'),
+                (u'a:1', u'a:>1')]:
+            self.assertNotEqual(plasticparser.canonicalize(first),
+                                plasticparser.canonicalize(second))
+
+    def test_should_keep_clauses_in_order_where_they_would_parse_differently(self):
+        self.assertEqual(plasticparser.canonicalize(u'x andrew'),
+                         u'rew AND x')
+        self.assertEqual(plasticparser.canonicalize(u'orb  b'), u'orb b')
+        self.assertEqual(plasticparser.canonicalize(u'r pet:x'), u'r pet:x')
+        self.assertEqual(plasticparser.canonicalize(u'b ((a'), u'b ((a')
+
+    def test_should_parse_normal_form_to_the_dsl_of_its_tree(self):
+        rng = random.Random(2015)
+        for query_string in QUERIES + [make_query(rng) for _ in range(1000)]:
+            try:
+                normal_query, tree = normal_form(query_string)
+            except Exception:
+                continue
+            self.assertEqual(plasticparser.get_query_dsl(normal_query),
+                             emit_query_dsl(tree), query_string)
+            self.assertEqual(plasticparser.canonicalize(normal_query),
+                             normal_query)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import random
+import unittest
+
+from plasticparser import plasticparser, tokenizer, fast_tokenizer
+
+PIECES = [u'a', u'b1', u'x.y', u'_', u'andy', u'orb', u'AND', u'and', u'Or',
+          u'type', u'yet', u'test', u'facets', u'nested', u'"', u'"q w"',
+          u'"e\\"s"', u'\\', u'(', u')', u'((', u'))', u'[', u']', u':',
+          u':<', u':>=', u':=', u':<=', u',', u' ', u'\r', u'\t', u'\n',
+          u'\xa0', u' ', u'\xe9', u'&&', u'||', u'-', u'+', u'!', u'*',
+          u'{', u'}', u'^', u'~', u'?', u'/']
+
+QUERIES = [
+    u'', u'   ', u'type:help', u'yet:foo bar', u'type : help andrew',
+    u'type:help-x', u'a:1 andrew', u'a : b', u'a:1 AND', u'(a:1 b:2',
+    u'test[x]', u'facets:[a] facets:[b]', u'facets[abc]',
+    u'nested:[a]', u'nested:[a(x:(1)) b(y:(2))]',
+    u'facets:[aaa(foo bar) b(c:(d) AND e:(f)), c]',
+    u'facets:[aaa((a:(b))))] x', u'facets:[aaa(andy:(and x) (b:(c)))]',
+    u'name:"x \\" y" other:"unterminated',
+    u'first_name:asdasd AND (c.d:(yes i will) OR due_date:(1234))',
+    u'x y', u'ı:ſ',
+]
+
+
+def make_fragment(rng, depth=0):
+    roll = rng.random()
+    if depth > 3 or roll < 0.35:
+        return u''.join(rng.choice(PIECES) for _ in range(rng.randint(1, 3)))
+    if roll < 0.5:
+        return u'{}:{}'.format(make_fragment(rng, depth + 1),
+                               make_fragment(rng, depth + 1))
+    if roll < 0.6:
+        return u'({})'.format(u' '.join(
+            make_fragment(rng, depth + 1) for _ in range(rng.randint(0, 3))))
+    if roll < 0.7:
+        return u'{}[{}]'.format(
+            rng.choice([u'facets:', u'nested:', u'facets: ', u'cat']),
+            rng.choice([u' ', u',', u', ']).join(
+                make_fragment(rng, depth + 1)
+                for _ in range(rng.randint(0, 3))))
+    if roll < 0.8:
+        return u'{}({})'.format(
+            rng.choice([u'aaa', u'a.b', u'x_1']),
+            u' '.join(make_fragment(rng, depth + 1)
+                      for _ in range(rng.randint(0, 3))))
+    if roll < 0.9:
+        return u'{} {} {}'.format(
+            make_fragment(rng, depth + 1),
+            rng.choice([u'AND', u'or', u'', u'and']),
+            make_fragment(rng, depth + 1))
+    return u'type{}{}'.format(rng.choice([u':', u' : ', u'::']),
+                              make_fragment(rng, depth + 1))
+
+
+def make_query(rng):
+    return u' '.join(make_fragment(rng) for _ in range(rng.randint(1, 4)))
+
+
+def parse(tokenize, query_string):
+    try:
+        return True, tokenize(query_string)
+    except Exception as error:
+        return False, type(error)
+
+
+class DifferentialTest(unittest.TestCase):
+    """
+    fast_tokenizer must accept and reject exactly what the pyparsing
+    grammar does and build the same dict for everything it accepts.
+    """
+    def assertSameParse(self, query_string):
+        self.assertEqual(parse(fast_tokenizer.tokenize, query_string),
+                         parse(tokenizer.tokenize, query_string),
+                         u'engines differ on {!r}'.format(query_string))
+
+    def test_should_match_pyparsing_on_corner_cases(self):
+        for query_string in QUERIES:
+            self.assertSameParse(query_string)
+
+    def test_should_match_pyparsing_on_generated_queries(self):
+        rng = random.Random(2015)
+        for _ in range(2000):
+            self.assertSameParse(make_query(rng))
+
+    def test_should_match_pyparsing_with_query_options(self):
+        query_string = u'type:help facets:[aaa(b:(c))] x:1 or y'
+        for engine in ('pyparsing', 'fast'):
+            self.assertEqual(
+                plasticparser.get_query_dsl(
+                    query_string, facets_query_size=3,
+                    default_operator='or', engine=engine)['facets'],
+                {u'aaa': {'terms': {'field': 'aaa_nonngram', 'size': 3},
+                          'facet_filter': {'query': {'query_string': {
+                              'query': u'b:(c)',
+                              'default_operator': 'and'}}}}})
+
+
+if __name__ == '__main__':
+    unittest.main()
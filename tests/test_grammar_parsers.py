@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import json
+import random
+import unittest
+
+from plasticparser.grammar_parsers import (
+    RESERVED_CHARS, sanitize_value, sanitize_facet_value, sanitize_free_text,
+    add_global_filters)
+from plasticparser.emitter import emit_structured_dsl
+from plasticparser.tokenizer import tokenize
+from plasticparser.tree_parser import parse_tree
+
+
+def replace_each(value, excluded_chars):
+    for char in RESERVED_CHARS:
+        if char not in excluded_chars:
+            value = value.replace(char, u'\\{}'.format(char))
+    return value
+
+
+class SanitizeTest(unittest.TestCase):
+    """
+    The single pass escapers must match replacing each reserved
+    character in turn.
+    """
+    sanitizers = [(sanitize_value, ['(']),
+                  (sanitize_facet_value, ['"', '(', ')']),
+                  (sanitize_free_text, ['(', ')'])]
+
+    def assertSameEscaping(self, value):
+        for sanitize, excluded_chars in self.sanitizers:
+            self.assertEqual(sanitize(value),
+                             replace_each(value, excluded_chars),
+                             u'{} differs on {!r}'.format(
+                                 sanitize.__name__, value))
+
+    def test_should_escape_reserved_chars(self):
+        self.assertEqual(sanitize_value(u'a+b-(c)&&d||e'),
+                         u'a\\+b\\-(c\\)\\&&d\\||e')
+        self.assertEqual(sanitize_facet_value(u'"a\\b"(c)'),
+                         u'"a\\\\b"(c)')
+        self.assertEqual(sanitize_free_text(u'[a]!{b}^~*?/'),
+                         u'\\[a\\]\\!\\{b\\}\\^\\~\\*\\?\\/')
+
+    def test_should_escape_runs_of_multi_char_operators(self):
+        for value in [u'&', u'&&&', u'&&&&', u'|||', u'&|&|', u'\\&&',
+                      u'&&\\||', u'\\\\']:
+            self.assertSameEscaping(value)
+
+    def test_should_match_replace_loop_on_generated_values(self):
+        rng = random.Random(2015)
+        alphabet = list(RESERVED_CHARS) + [u'&', u'|', u'"', u'a', u' ',
+                                           u'\xe9']
+        for _ in range(2000):
+            self.assertSameEscaping(u''.join(
+                rng.choice(alphabet) for _ in range(rng.randint(0, 12))))
+
+    def test_should_pass_through_non_strings(self):
+        for sanitize, _ in self.sanitizers:
+            self.assertEqual(sanitize(12), 12)
+            self.assertIs(sanitize(None), None)
+
+
+
+class GlobalFiltersTest(unittest.TestCase):
+    def get_bool_lists(self, global_filters, query_string=u'title:hello'):
+        return add_global_filters(tokenize(query_string), global_filters)[
+            'query']['filtered']['filter']['bool']
+
+    def test_should_merge_values_of_a_field_into_terms_filter(self):
+        bool_lists = self.get_bool_lists({
+            'or': [{'client_id': 1}, {'client_id': 2}, {'client_id': 1},
+                   {'client_id': [3, 2]}, {'owner': 'a'}],
+            'not': [{'state': 'x'}, {'terms': {'state': ['y', 'x']}}]})
+        self.assertEqual(bool_lists['should'], [
+            {'terms': {'client_id': [1, 2, 3]}}, {'term': {'owner': 'a'}}])
+        self.assertEqual(bool_lists['must_not'], [
+            {'terms': {'state': ['x', 'y']}}])
+
+    def test_should_only_drop_duplicates_of_and_filters(self):
+        bool_lists = self.get_bool_lists({
+            'and': [{'tag': 'a'}, {'tag': 'b'}, {'tag': 'a'}]})
+        self.assertEqual(bool_lists['must'], [
+            {'term': {'tag': 'a'}}, {'term': {'tag': 'b'}}])
+
+    def test_should_keep_values_that_encode_differently(self):
+        bool_lists = self.get_bool_lists({
+            'and': [{'flag': 1}, {'flag': True}, {'flag': 1.0}]})
+        self.assertEqual(
+            json.dumps(bool_lists['must']),
+            '[{"term": {"flag": 1}}, {"term": {"flag": true}}, '
+            '{"term": {"flag": 1.0}}]')
+        bool_lists = self.get_bool_lists({
+            'or': [{'flag': 1}, {'flag': True}]})
+        self.assertEqual(json.dumps(bool_lists['should']),
+                         '[{"terms": {"flag": [1, true]}}]')
+
+    def test_should_accept_range_and_exists_filters(self):
+        age = {'range': {'age': {'gte': 18}}}
+        exists = {'exists': {'field': 'email'}}
+        bool_lists = self.get_bool_lists({'and': [age, exists, age]})
+        self.assertEqual(bool_lists['must'], [age, exists])
+
+    def test_should_fold_in_filters_the_query_implies(self):
+        query_dsl = emit_structured_dsl(parse_tree(u'type:help state:open'))
+        bool_lists = add_global_filters(query_dsl, {
+            'and': [{u'state': u'open'}, {'client_id': 1}],
+            'or': [{'client_id': 2}, {'client_id': 1}]})[
+            'query']['filtered']['filter']['bool']
+        self.assertEqual(bool_lists['must'], [
+            {'type': {'value': u'help'}}, {'term': {u'state': u'open'}},
+            {'term': {'client_id': 1}}])
+        self.assertEqual(bool_lists['should'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import random
+import unittest
+
+from plasticparser import plasticparser, fast_tokenizer, incremental
+from plasticparser.incremental import ParseSession
+
+from tests.test_fast_tokenizer import QUERIES, make_query, parse
+
+
+class ParseSessionTest(unittest.TestCase):
+    def assertSameParse(self, session, query_string):
+        partial = session.feed(query_string)
+        expected = parse(lambda query: fast_tokenizer.tokenize(
+            query, session.facets_query_size, session.default_operator),
+            query_string)
+        if expected[0]:
+            expected = (True, plasticparser.add_global_filters(
+                expected[1], session.global_filters))
+        self.assertEqual(
+            (True, partial.dsl) if partial.error is None
+            else (False, type(partial.error)),
+            expected, u'session differs on {!r}'.format(query_string))
+        return partial
+
+    def test_should_parse_each_keystroke_like_tokenize(self):
+        for query_string in QUERIES + [
+                u'type:help facets:[aaa(b:(c))] r title:"x y" AND z:1']:
+            session = ParseSession()
+            for end in range(len(query_string) + 1):
+                self.assertSameParse(session, query_string[:end])
+
+    def test_should_parse_edits_like_tokenize(self):
+        rng = random.Random(2015)
+        for _ in range(200):
+            session = ParseSession()
+            query_string = make_query(rng)
+            for _ in range(10):
+                self.assertSameParse(session, query_string)
+                index = rng.randint(0, len(query_string))
+                query_string = query_string[:index] + rng.choice(
+                    [u'a', u' ', u'"', u'(', u')', u']', u':']) + \
+                    query_string[index + rng.randint(0, 1):]
+
+    def test_should_reuse_clauses_before_edit(self):
+        session = ParseSession(global_filters={'and': [{'a': 'b'}]},
+                               default_operator='or')
+        query_string = u'title:hello OR description:world AND x:1 y:2 free'
+        session.feed(query_string)
+        partial = self.assertSameParse(session, query_string + u'dom')
+        self.assertGreater(partial.reused, len(u'title:hello OR'))
+
+    def test_should_report_partial_state(self):
+        session = ParseSession()
+        for query_string, state in [
+                (u'title:hello', incremental.COMPLETE),
+                (u'title:', incremental.AFTER_KEY),
+                (u'due:>=', incremental.AFTER_KEY),
+                (u'facets:[aaa(b:', incremental.INSIDE_FACETS),
+                (u'facets:[aaa] nested:[a', incremental.INSIDE_NESTED),
+                (u'name:"john sm', incremental.INSIDE_QUOTE),
+                (u'name:"john \\" sm', incremental.INSIDE_QUOTE),
+                (u'title:(a b', incremental.INSIDE_PARENS),
+                (u'facets:[a] facets:[b]', incremental.INVALID)]:
+            self.assertEqual(session.feed(query_string).state, state,
+                             query_string)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from plasticparser import plasticparser, instrumentation
+
+
+class InstrumentationTest(unittest.TestCase):
+    query_string = u'type:help facets:[aaa(b:(c))] r title:hello x:1 (y:2) free'
+
+    def tearDown(self):
+        instrumentation.clear_callback()
+        plasticparser.disable_cache()
+
+    def test_should_report_stages_and_elements_for_pyparsing(self):
+        with instrumentation.collect() as collected:
+            query_dsl = plasticparser.get_query_dsl(
+                self.query_string, {'and': [{'a': 'b'}]}, engine='pyparsing')
+        self.assertEqual(query_dsl, plasticparser.get_query_dsl(
+            self.query_string, {'and': [{'a': 'b'}]}))
+        stats, = collected
+        self.assertEqual(
+            (stats.operation, stats.engine, stats.input_length),
+            ('get_query_dsl', 'pyparsing', len(self.query_string)))
+        self.assertEqual(set(stats.timings), set(
+            ['sanitize', 'match', 'parse_actions', 'global_filters']))
+        self.assertEqual(stats.clause_count, 5)
+        compare = stats.elements['compare_expression']
+        self.assertEqual((compare['matches'], compare['actions']), (3, 3))
+        self.assertGreater(compare['attempts'], compare['matches'])
+        self.assertEqual(stats.elements['facet']['actions'], 1)
+
+    def test_should_report_stages_and_elements_for_fast_engine(self):
+        with instrumentation.collect() as collected:
+            plasticparser.get_query_dsl(self.query_string, engine='fast')
+        stats, = collected
+        self.assertEqual(set(stats.timings), set(
+            ['sanitize', 'match', 'global_filters']))
+        self.assertEqual(stats.clause_count, 5)
+        self.assertEqual(stats.elements['compare_expression']['matches'], 3)
+
+    def test_should_call_callback_for_sampled_parses(self):
+        reported = []
+        instrumentation.set_callback(reported.append)
+        plasticparser.is_facet_query(self.query_string)
+        plasticparser.get_query_dsl(u'a:b')
+        self.assertEqual([stats.operation for stats in reported],
+                         ['analyze', 'get_query_dsl'])
+        instrumentation.set_callback(reported.append, sample_rate=0.0)
+        plasticparser.get_query_dsl(u'a:b')
+        self.assertEqual(len(reported), 2)
+
+    def test_should_report_cache_hits_and_errors(self):
+        plasticparser.enable_cache()
+        with instrumentation.collect() as collected:
+            plasticparser.get_query_dsl(u'a:b')
+            plasticparser.get_query_dsl(u'a:b')
+            self.assertRaises(TypeError, plasticparser.get_query_dsl,
+                              u'facets:[a] facets:[b]')
+        self.assertEqual([stats.cached for stats in collected],
+                         [False, True, False])
+        self.assertIsInstance(collected[2].error, TypeError)
+        self.assertEqual(collected[2].as_dict()['error'], 'TypeError')
+
+    def test_should_not_measure_outside_collect(self):
+        with instrumentation.collect() as collected:
+            pass
+        plasticparser.get_query_dsl(u'a:b')
+        self.assertEqual(collected, [])
+        self.assertIsNone(
+            instrumentation.start('get_query_dsl', 'pyparsing', u'a:b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from plasticparser import plasticparser, instrumentation
+from plasticparser.exceptions import (
+    QueryError, QueryLimitExceeded, QueryTooLong, TooManyClauses,
+    QueryTooDeep, TooManyEntries, ParseBudgetExceeded, ParseStepsExceeded,
+    ParseTimeExceeded)
+from plasticparser.incremental import ParseSession
+from plasticparser.limits import QueryLimits, ParseBudget, parse_budget
+
+
+class QueryLimitsTest(unittest.TestCase):
+    def assertOverLimit(self, error_class, limits, query_string, value):
+        try:
+            limits.check(query_string)
+        except error_class as error:
+            self.assertEqual(error.value, value)
+            self.assertTrue(isinstance(error, QueryLimitExceeded))
+            self.assertTrue(isinstance(error, QueryError))
+        else:
+            self.fail("{} not raised".format(error_class.__name__))
+
+    def test_should_pass_queries_within_limits(self):
+        limits = QueryLimits(max_length=100, max_clauses=10, max_depth=2,
+                             max_entries=2)
+        limits.check(u'type:a title:(b OR "c d") AND e facets:[f, g(h:(i))]')
+
+    def test_should_reject_long_queries(self):
+        self.assertOverLimit(QueryTooLong, QueryLimits(max_length=5),
+                             u'title:a', 7)
+
+    def test_should_count_words_and_phrases_but_not_operators(self):
+        limits = QueryLimits(max_clauses=3)
+        limits.check(u'a:"b c d" AND (e OR f)')
+        self.assertOverLimit(TooManyClauses, limits,
+                             u'a:"b c d" AND (e OR f g)', 4)
+
+    def test_should_reject_deep_parens(self):
+        limits = QueryLimits(max_depth=2)
+        limits.check(u'(a:(b)) (c) ")))((("')
+        self.assertOverLimit(QueryTooDeep, limits, u'((a:(b)))', 3)
+
+    def test_should_count_entries_of_every_list(self):
+        limits = QueryLimits(max_entries=3)
+        limits.check(u'facets:[a, b(c:(d) e)] x nested:[f(g:(h))]')
+        self.assertOverLimit(TooManyEntries, limits,
+                             u'facets:[a b] x nested:[c(d:(e)), f(g:(h))]', 4)
+
+    def test_should_scan_unterminated_quotes_to_the_end(self):
+        limits = QueryLimits(max_clauses=1, max_depth=0)
+        limits.check(u'a:"(b c (d')
+
+
+class SetLimitsTest(unittest.TestCase):
+    def tearDown(self):
+        plasticparser.set_limits(None)
+
+    def test_should_parse_queries_within_limits(self):
+        query_string = u'type:a title:(b OR c) facets:[d]'
+        expected = plasticparser.get_query_dsl(query_string)
+        structured = plasticparser.get_query_dsl(
+            query_string, structured=True)
+        plasticparser.set_limits(max_length=100, max_steps=10,
+                                 max_seconds=1)
+        for engine in ('pyparsing', 'fast'):
+            self.assertEqual(
+                plasticparser.get_query_dsl(query_string, engine=engine),
+                expected)
+        self.assertEqual(
+            plasticparser.get_query_dsl(query_string, structured=True),
+            structured)
+
+    def test_should_reject_queries_over_limits(self):
+        plasticparser.set_limits(QueryLimits(max_depth=1))
+        self.assertRaises(QueryTooDeep, plasticparser.get_query_dsl,
+                          u'((a))')
+        self.assertRaises(QueryTooDeep, plasticparser.get_query_json,
+                          u'((a))')
+
+    def test_should_stop_parses_over_step_budget(self):
+        plasticparser.set_limits(max_steps=5)
+        query_string = u' '.join(u'a{}:b'.format(index)
+                                 for index in range(20))
+        for engine in ('pyparsing', 'fast'):
+            self.assertRaises(ParseStepsExceeded, plasticparser.get_query_dsl,
+                              query_string, engine=engine)
+        self.assertRaises(ParseStepsExceeded, plasticparser.get_query_dsl,
+                          query_string, structured=True)
+        self.assertRaises(ParseStepsExceeded, plasticparser.get_query_dsl,
+                          u'facets:[a, b, c, d, e, f] x')
+
+    def test_should_stop_analyses_over_step_budget(self):
+        plasticparser.set_limits(max_steps=5)
+        query_string = u' '.join(u'a{}:b'.format(index)
+                                 for index in range(20))
+        self.assertRaises(ParseStepsExceeded, plasticparser.analyze,
+                          query_string)
+        plasticparser.set_limits(max_depth=1)
+        self.assertRaises(QueryTooDeep, plasticparser.analyze, u'((a))')
+
+    def test_should_count_steps_against_enclosing_budgets(self):
+        plasticparser.set_limits(max_length=1000)
+        query_string = u' '.join(u'a{}:b'.format(index)
+                                 for index in range(20))
+        with parse_budget(ParseBudget(query_string, max_steps=5)):
+            for engine in ('pyparsing', 'fast'):
+                self.assertRaises(
+                    ParseStepsExceeded, plasticparser.get_query_dsl,
+                    query_string, engine=engine)
+
+    def test_should_stop_instrumented_parses_over_step_budget(self):
+        plasticparser.set_limits(max_steps=5)
+        query_string = u' '.join(u'a{}:b'.format(index)
+                                 for index in range(20))
+        with instrumentation.collect():
+            for engine in ('pyparsing', 'fast'):
+                self.assertRaises(
+                    ParseStepsExceeded, plasticparser.get_query_dsl,
+                    query_string, engine=engine)
+
+    def test_should_apply_limits_to_parse_sessions(self):
+        plasticparser.set_limits(max_steps=5)
+        query_string = u' '.join(u'a{}:b'.format(index)
+                                 for index in range(20))
+        session = ParseSession()
+        self.assertEqual(session.feed(u'a:b').error, None)
+        partial = session.feed(query_string)
+        self.assertEqual(partial.dsl, None)
+        self.assertTrue(isinstance(partial.error, ParseStepsExceeded))
+        plasticparser.set_limits()
+        self.assertEqual(session.feed(query_string).dsl,
+                         plasticparser.get_query_dsl(query_string))
+        session = ParseSession(limits=QueryLimits(max_length=5))
+        self.assertTrue(isinstance(session.feed(u'title:long').error,
+                                   QueryTooLong))
+
+    def test_should_stop_parses_over_time_budget(self):
+        plasticparser.set_limits(max_seconds=0)
+        query_string = u' '.join(u'a{}:b'.format(index)
+                                 for index in range(200))
+        with self.assertRaises(ParseBudgetExceeded) as context:
+            plasticparser.get_query_dsl(query_string)
+        self.assertTrue(isinstance(context.exception, ParseTimeExceeded))
+
+    def test_should_not_serve_cached_queries_over_new_limits(self):
+        plasticparser.enable_cache()
+        try:
+            plasticparser.get_query_dsl(u'((a))')
+            plasticparser.set_limits(max_depth=1)
+            self.assertRaises(QueryTooDeep, plasticparser.get_query_dsl,
+                              u'((a))')
+        finally:
+            plasticparser.disable_cache()
+
+    def test_should_yield_limit_errors_in_batches(self):
+        plasticparser.set_limits(max_length=5)
+        results = list(plasticparser.get_query_dsl_many(
+            [u'a:1', u'title:long'], workers=1))
+        self.assertEqual(results[0], plasticparser.get_query_dsl(u'a:1'))
+        self.assertTrue(isinstance(results[1], QueryTooLong))
+
+
+if __name__ == '__main__':
+    unittest.main()
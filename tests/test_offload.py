@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+
+from plasticparser import plasticparser
+from plasticparser.exceptions import (
+    QueryError, ParseCancelled, ParseTimeout)
+from plasticparser.offload import Offloader, estimate_cost
+
+
+class Gate(object):
+    """
+    a parse that blocks until it is opened, counting how many run at once
+    """
+    def __init__(self):
+        self.opened = threading.Event()
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most_running = 0
+
+    def __call__(self, value):
+        with self.lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        self.opened.wait(5)
+        with self.lock:
+            self.running -= 1
+        return value
+
+
+def wait_idle(offloader):
+    deadline = time.time() + 5
+    while offloader.in_flight and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def fail(query_string):
+    raise QueryError(query_string, "bad query")
+
+
+class OffloaderTest(unittest.TestCase):
+    def test_should_estimate_cost_from_length_and_parens(self):
+        self.assertEqual(estimate_cost(u'a:1'), 3)
+        self.assertEqual(estimate_cost(u'(a:1)'), 21)
+
+    def test_should_parse_cheap_queries_inline(self):
+        offloader = Offloader(inline_cost=10)
+        thread_names = []
+        future = offloader.submit(
+            lambda: thread_names.append(threading.current_thread().name),
+            (), u'a:1')
+        self.assertTrue(future.done())
+        self.assertEqual(thread_names, [threading.current_thread().name])
+
+    def test_should_cap_parses_in_flight(self):
+        gate = Gate()
+        offloader = Offloader(max_in_flight=2, inline_cost=0)
+        futures = [offloader.submit(gate, (index,), u'a:1')
+                   for index in range(5)]
+        time.sleep(0.05)
+        self.assertEqual(gate.running, 2)
+        gate.opened.set()
+        self.assertEqual([future.result(5) for future in futures],
+                         range(5))
+        self.assertEqual(gate.most_running, 2)
+        self.assertEqual(offloader.in_flight, 0)
+
+    def test_should_time_out_waiting_and_running_parses(self):
+        gate = Gate()
+        offloader = Offloader(max_in_flight=1, inline_cost=0)
+        running = offloader.submit(gate, (1,), u'a:1', timeout=0.05)
+        waiting = offloader.submit(gate, (2,), u'b:2', timeout=0.05)
+        self.assertRaises(ParseTimeout, running.result, 5)
+        self.assertRaises(ParseTimeout, waiting.result, 5)
+        gate.opened.set()
+        self.assertEqual(offloader.submit(gate, (3,), u'c:3').result(5), 3)
+        wait_idle(offloader)
+
+    def test_should_stop_thread_parses_that_time_out(self):
+        query_string = u' '.join(u'a{}:b'.format(index)
+                                 for index in range(20000))
+        offloader = Offloader(max_in_flight=1, inline_cost=0)
+        future = offloader.submit(plasticparser.get_query_dsl,
+                                  (query_string,), query_string,
+                                  timeout=0.05)
+        waiting = offloader.submit(lambda: 1, (), u'a:1')
+        self.assertRaises(ParseTimeout, future.result, 5)
+        started = time.time()
+        # the whole parse takes seconds
+        self.assertEqual(waiting.result(5), 1)
+        self.assertLess(time.time() - started, 0.5)
+        wait_idle(offloader)
+
+    def test_should_cancel_waiting_parses(self):
+        gate = Gate()
+        offloader = Offloader(max_in_flight=1, inline_cost=0)
+        running = offloader.submit(gate, (1,), u'a:1')
+        waiting = offloader.submit(gate, (2,), u'b:2')
+        self.assertTrue(waiting.cancel())
+        self.assertFalse(running.cancel())
+        gate.opened.set()
+        self.assertEqual(running.result(5), 1)
+        self.assertTrue(waiting.cancelled())
+        self.assertRaises(ParseCancelled, waiting.result)
+        wait_idle(offloader)
+
+    def test_should_pass_errors_and_call_callbacks(self):
+        offloader = Offloader(inline_cost=0)
+        done = threading.Event()
+        future = offloader.submit(fail, (u'a:(',), u'a:(')
+        future.add_done_callback(lambda future: done.set())
+        self.assertTrue(done.wait(5))
+        self.assertRaises(QueryError, future.result)
+        self.assertEqual(future.exception().reason, "bad query")
+        wait_idle(offloader)
+
+    def test_should_terminate_processes_that_time_out(self):
+        offloader = Offloader('process', inline_cost=0)
+        future = offloader.submit(time.sleep, (5,), u'a:1', timeout=0.2)
+        self.assertRaises(ParseTimeout, future.result, 5)
+        future._process.join(5)
+        self.assertFalse(future._process.is_alive())
+        wait_idle(offloader)
+
+    def test_should_reject_unknown_executor(self):
+        self.assertRaises(ValueError, Offloader, 'fiber')
+
+
+class QueryDslAsyncTest(unittest.TestCase):
+    def tearDown(self):
+        plasticparser.configure_async()
+
+    def test_should_return_query_dsl_of_get_query_dsl(self):
+        query_string = u'type:candidates title:(hello OR world) ' \
+                       u'facets:[location]'
+        expected = plasticparser.get_query_dsl(query_string, {'a': 1})
+        for executor in ('thread', 'process'):
+            for inline_cost in (0, 10000):
+                plasticparser.configure_async(executor,
+                                              inline_cost=inline_cost)
+                future = plasticparser.get_query_dsl_async(
+                    query_string, {'a': 1}, timeout=5)
+                self.assertEqual(future.result(5), expected)
+                wait_idle(plasticparser._offloader)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from plasticparser import plasticparser
+from plasticparser.exceptions import QueryError, UnsatisfiableQuery
+from plasticparser.nodes import Compare, Range
+from plasticparser.optimizer import optimize_tree
+from plasticparser.schema import Schema
+from plasticparser.tree_parser import parse_tree
+
+SCHEMA = Schema([('due', 'long'), ('code', 'keyword')], strict=False)
+
+
+def optimized(query_string, default_operator='and', schema=SCHEMA):
+    tree = optimize_tree(parse_tree(query_string), default_operator, schema)
+    return tree.query if tree is not None else None
+
+
+def get_query_string(query_string, **kwargs):
+    return plasticparser.get_query_dsl(query_string, optimize=True, **kwargs)[
+        'query']['filtered']['query']['query_string']['query']
+
+
+def get_filters(query_string, **kwargs):
+    return plasticparser.get_query_dsl(
+        query_string, optimize=True, structured=True, **kwargs)[
+        'query']['filtered']['filter']['bool']['must']
+
+
+class OptimizerTest(unittest.TestCase):
+    def test_should_drop_repeated_clauses(self):
+        self.assertEqual(get_query_string(u'status:open status:open x'),
+                         u'status:open x')
+        self.assertEqual(get_query_string(u'x OR y OR x'), u'x OR y')
+        self.assertEqual(get_query_string(u'(a:1 OR a:1) (b:2 c:3)'),
+                         u'a:1 b:2 c:3')
+
+    def test_should_drop_parens_that_change_nothing(self):
+        self.assertEqual(get_query_string(u'(a:1)'), u'a:1')
+        self.assertEqual(get_query_string(u'a:1 AND (b:2 AND c:3)'),
+                         u'a:1 AND b:2 AND c:3')
+        self.assertEqual(get_query_string(u'a:1 AND (b:2 OR c:3)'),
+                         u'a:1 AND (b:2 OR c:3)')
+        self.assertEqual(get_query_string(u'a:1 OR (b:2) AND c:3'),
+                         u'a:1 OR b:2 AND c:3')
+
+    def test_should_merge_ranges_on_a_field(self):
+        self.assertEqual(optimized(u'due:>1 due:>=3 due:<9'),
+                         Range(u'due', u'3', True, u'9', False))
+        self.assertEqual(optimized(u'due:<9 due:<=7'),
+                         Compare(u'due', u':<=', u'7'))
+        self.assertEqual(get_filters(u'due:>=5 due:<9', schema=SCHEMA),
+                         [{'range': {u'due': {'gte': u'5', 'lt': u'9'}}}])
+        self.assertEqual(
+            get_query_string(u'day:>=2015-01-01 day:<2015-02-01 x'),
+            u'day:[2015\\-01\\-01 TO 2015\\-02\\-01} x')
+        self.assertEqual(
+            get_filters(u'due:>2015-01-01 due:<=2015-02-01'),
+            [{'range': {u'due': {'gt': u'2015-01-01', 'lte': u'2015-02-01'}}}])
+
+    def test_should_not_merge_ranges_that_do_not_compare(self):
+        self.assertEqual(get_query_string(u'due:>a due:<9'), u'due:>a due:<9')
+        self.assertEqual(get_query_string(u'due:>5 OR due:<9'),
+                         u'due:>5 OR due:<9')
+
+    def test_should_only_compare_numbers_on_numeric_fields(self):
+        # "2" is within both bounds where they compare as strings
+        for query_string in [u'code:>10 code:<5', u'other:>10 other:<5']:
+            self.assertEqual(optimized(query_string),
+                             parse_tree(query_string).query)
+        self.assertEqual(optimized(u'due:>10 due:<5', schema=None),
+                         parse_tree(u'due:>10 due:<5').query)
+        self.assertEqual(get_query_string(u'due:>=5 due:<9 x'),
+                         u'due:>=5 due:<9 x')
+
+    def test_should_find_queries_no_document_can_match(self):
+        self.assertEqual(optimized(u'due:>10 due:<5'), None)
+        self.assertEqual(optimized(u'due:>5 due:<5'), None)
+        self.assertEqual(optimized(u'due:>=5 due:<=5'),
+                         Range(u'due', u'5', True, u'5', True))
+        self.assertEqual(
+            get_filters(u'a:1 OR (due:>10 due:<5)', schema=SCHEMA),
+            [{'term': {u'a': u'1'}}])
+        try:
+            plasticparser.get_query_dsl(u'x due:>10 due:<5', optimize=True,
+                                        schema=SCHEMA)
+        except UnsatisfiableQuery as error:
+            self.assertEqual(error.query_string, u'x due:>10 due:<5')
+            self.assertTrue(isinstance(error, QueryError))
+        else:
+            self.fail("unsatisfiable query not rejected")
+
+    def test_should_leave_chains_the_grammar_split_up(self):
+        for query_string in [u'(a b) (a c)', u'd:(e OR f) d:(e OR f)']:
+            self.assertEqual(
+                plasticparser.get_query_dsl(query_string, optimize=True),
+                plasticparser.get_query_dsl(query_string))
+
+    def test_should_leave_chains_with_negations(self):
+        for query_string in [
+                u'status:open AND NOT owner:bob AND NOT owner:alice',
+                u'due:<5 AND NOT due:>10', u'-due:>10 -due:<5 x',
+                u'a:1 AND (b:2 AND NOT c:3)', u'x !x +y']:
+            self.assertEqual(
+                plasticparser.get_query_dsl(query_string, optimize=True),
+                plasticparser.get_query_dsl(query_string))
+
+    def test_should_cache_optimized_queries_apart(self):
+        plasticparser.enable_cache()
+        try:
+            self.assertEqual(get_query_string(u'x x'), u'x')
+            self.assertEqual(plasticparser.get_query_dsl(u'x x')['query'][
+                'filtered']['query']['query_string']['query'], u'x x')
+        finally:
+            plasticparser.disable_cache()
+
+
+if __name__ == '__main__':
+    unittest.main()
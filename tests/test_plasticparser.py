@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import io
+import json
+import sys
+import threading
 import unittest
 from plasticparser import plasticparser
+from plasticparser.exceptions import QueryError
+from plasticparser.tree_parser import TreeParser
 
 
 class PlasticParserTestCase(unittest.TestCase):
@@ -289,6 +295,51 @@ class PlasticParserTestCase(unittest.TestCase):
 
 
 
+class QueryCacheTest(unittest.TestCase):
+    def setUp(self):
+        plasticparser.enable_cache(maxsize=2)
+
+    def tearDown(self):
+        plasticparser.disable_cache()
+
+    def test_should_not_share_global_filters_between_cached_queries(self):
+        query_string = 'type:help title:hello'
+        first = plasticparser.get_query_dsl(
+            query_string, {'and': [{"client_id": 1}]})
+        second = plasticparser.get_query_dsl(
+            ' type:help\ttitle:hello ', {'and': [{"client_id": 2}]})
+        self.assertEqual(
+            first['query']['filtered']['filter']['bool']['must'],
+            [{'type': {'value': 'help'}}, {'term': {'client_id': 1}}])
+        self.assertEqual(
+            second['query']['filtered']['filter']['bool']['must'],
+            [{'type': {'value': 'help'}}, {'term': {'client_id': 2}}])
+        self.assertEqual(plasticparser.get_cache_stats(), {
+            'hits': 1, 'misses': 1, 'evictions': 0, 'size': 1, 'maxsize': 2})
+
+    def test_should_key_cache_on_query_options(self):
+        query_string = 'facets:[location] title:hello'
+        plasticparser.get_query_dsl(query_string)
+        dsl = plasticparser.get_query_dsl(
+            query_string, facets_query_size=5, default_operator='or')
+        self.assertEqual(dsl['facets']['location']['terms']['size'], 5)
+        self.assertEqual(
+            dsl['query']['filtered']['query']['query_string'][
+                'default_operator'], 'or')
+        self.assertEqual(plasticparser.get_cache_stats()['misses'], 2)
+
+    def test_should_share_entries_between_equivalent_queries(self):
+        plasticparser.enable_cache(maxsize=8, canonical=True)
+        first = plasticparser.get_query_dsl(u'title:"hello" AND b:2')
+        second = plasticparser.get_query_dsl(u'b:2  and title:hello')
+        self.assertEqual(first, second)
+        self.assertEqual(
+            first['query']['filtered']['query']['query_string']['query'],
+            u'b:2 AND title:hello')
+        plasticparser.get_query_dsl(u'b:2  and title:hello')
+        self.assertEqual(plasticparser.get_cache_stats()['hits'], 2)
+
+
 class GetDocTypesTest(unittest.TestCase):
     def test_should_return_doc_types_of_query_string_if_any(self):
         query_string = 'type:help and title:hello description:"world"'
@@ -307,5 +358,409 @@ class IsFacetQueryTest(unittest.TestCase):
         self.assertEqual(is_facet_query, True)
 
 
+class ThreadSafetyTest(unittest.TestCase):
+    def setUp(self):
+        self.check_interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+
+    def tearDown(self):
+        sys.setcheckinterval(self.check_interval)
+
+    def test_should_keep_query_options_of_concurrent_parses_apart(self):
+        query_string = 'type:help facets:[location(city:(x))] title:hello'
+        errors = []
+
+        def parse(facets_query_size, default_operator, engine):
+            for _ in range(30):
+                dsl = plasticparser.get_query_dsl(
+                    query_string, {'and': [{'size': facets_query_size}]},
+                    facets_query_size=facets_query_size,
+                    default_operator=default_operator, engine=engine)
+                options = (
+                    dsl['facets']['location']['terms']['size'],
+                    dsl['query']['filtered']['query']['query_string'][
+                        'default_operator'],
+                    dsl['query']['filtered']['filter']['bool']['must'][-1])
+                expected = (facets_query_size, default_operator,
+                            {'term': {'size': facets_query_size}})
+                if options != expected:
+                    errors.append((expected, options))
+
+        threads = [
+            threading.Thread(target=parse, args=(
+                size, ('and', 'or')[size % 2],
+                ('pyparsing', 'fast')[size // 2 % 2]))
+            for size in range(1, 17)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+class FastEngineMixin(object):
+    def setUp(self):
+        super(FastEngineMixin, self).setUp()
+        plasticparser.set_default_engine('fast')
+
+    def tearDown(self):
+        plasticparser.set_default_engine('pyparsing')
+        super(FastEngineMixin, self).tearDown()
+
+
+class FastEnginePlasticParserTestCase(FastEngineMixin, PlasticParserTestCase):
+    pass
+
+
+class FastEngineGetDocTypesTest(FastEngineMixin, GetDocTypesTest):
+    pass
+
+
+class FastEngineIsFacetQueryTest(FastEngineMixin, IsFacetQueryTest):
+    pass
+
+
+class EngineSelectionTest(unittest.TestCase):
+    def test_should_reject_unknown_engine(self):
+        self.assertRaises(
+            ValueError, plasticparser.set_default_engine, 'regex')
+        self.assertRaises(
+            ValueError, plasticparser.get_query_dsl, 'abc', engine='regex')
+
+    def test_should_parse_with_engine_named_in_call(self):
+        query_string = 'type:help title:hello facets:[aaa]'
+        self.assertEqual(
+            plasticparser.get_query_dsl(query_string, engine='fast'),
+            plasticparser.get_query_dsl(query_string, engine='pyparsing'))
+
+
+class BatchTest(unittest.TestCase):
+    workers = 1
+    queries = [u'title:hello', u'type:help x', u'facets:[a] facets:[b]',
+               u' title:hello ', None, u'y:1 OR z:2', u'title:hello']
+
+    def get_query_dsl_many(self, queries, **kwargs):
+        return plasticparser.get_query_dsl_many(
+            queries, workers=self.workers, chunksize=2, **kwargs)
+
+    def test_should_yield_results_in_order(self):
+        results = list(self.get_query_dsl_many(self.queries))
+        self.assertEqual(len(results), len(self.queries))
+        for query_string, result in zip(self.queries, results):
+            try:
+                expected = plasticparser.get_query_dsl(query_string)
+            except Exception:
+                self.assertIsInstance(result, QueryError)
+                self.assertEqual(result.query_string, query_string)
+            else:
+                self.assertEqual(result, expected)
+
+    def test_should_not_share_dsl_between_duplicates(self):
+        global_filters = {'and': [{'a': 'b'}], 'sort': [{'c': 'desc'}]}
+        results = list(self.get_query_dsl_many(
+            [u'title:hello'] * 3, global_filters=global_filters))
+        expected = plasticparser.get_query_dsl(u'title:hello', global_filters)
+        self.assertEqual(results, [expected] * 3)
+        results[0]['query']['filtered']['filter']['bool']['must'].append(1)
+        self.assertEqual(results[1], expected)
+        self.assertEqual(global_filters['and'], [{'a': 'b'}])
+
+    def test_should_pass_query_options_to_every_query(self):
+        results = self.get_query_dsl_many(
+            [u'facets:[aaa] x', u'facets:[bbb] y'],
+            facets_query_size=3, default_operator='or', engine='fast')
+        for result in results:
+            self.assertEqual(result['query']['filtered']['query'][
+                'query_string']['default_operator'], 'or')
+            self.assertEqual(result['facets'].values()[0]['terms']['size'], 3)
+
+    def test_should_stream_results(self):
+        results = self.get_query_dsl_many([u'a:1', u'b:2', u'c:3'])
+        self.assertEqual(next(results), plasticparser.get_query_dsl(u'a:1'))
+        results.close()
+
+    def test_should_yield_before_reading_every_query(self):
+        read = []
+
+        def queries():
+            for index in range(1000):
+                read.append(index)
+                yield u'a:{}'.format(index % 10)
+        results = self.get_query_dsl_many(queries())
+        self.assertEqual(next(results), plasticparser.get_query_dsl(u'a:0'))
+        self.assertTrue(len(read) < 20)
+        self.assertEqual(len(list(results)), 999)
+
+
+class ProcessPoolBatchTest(BatchTest):
+    workers = 2
+
+
+class AnalyzeTest(unittest.TestCase):
+    query_string = (u'type:help facets:[aaa(b:(c) AND d:(e f)), x.y] r '
+                    u'nested:[n.p(m:(1))] title:hello foo-bar OR a:"x y" baz')
+
+    def test_should_report_parts_of_query(self):
+        analysis = plasticparser.analyze(self.query_string)
+        self.assertEqual(analysis.document_types, [u'help'])
+        self.assertEqual(analysis.facet_names, [u'aaa', u'x.y'])
+        self.assertEqual(analysis.nested_paths, [u'n.p'])
+        self.assertTrue(analysis.is_facet_query)
+        self.assertEqual(analysis.free_text_terms, [u'r', u'foo\\-bar', u'baz'])
+        self.assertEqual(analysis.field_names,
+                         [u'title', u'a', u'm', u'b', u'd'])
+
+    def test_should_build_same_dsl_as_get_query_dsl(self):
+        global_filters = {'and': [{'a': 'b'}], 'sort': [{'c': 'desc'}]}
+        analysis = plasticparser.analyze(
+            self.query_string, global_filters, facets_query_size=3,
+            default_operator='or')
+        self.assertEqual(analysis.dsl, plasticparser.get_query_dsl(
+            self.query_string, global_filters, facets_query_size=3,
+            default_operator='or'))
+
+    def test_should_report_empty_query(self):
+        analysis = plasticparser.analyze(u'')
+        self.assertEqual(analysis.document_types, [])
+        self.assertFalse(analysis.is_facet_query)
+        self.assertEqual(analysis.free_text_terms, [])
+        self.assertEqual(analysis.field_names, [])
+
+    def test_should_report_terms_and_fields_of_groups(self):
+        analysis = plasticparser.analyze(
+            u'(a OR b) NOT c (d:1 AND -e:2) f:(g OR h)')
+        self.assertEqual(analysis.free_text_terms, [u'a', u'b', u'c'])
+        self.assertEqual(analysis.field_names, [u'd', u'e', u'f'])
+
+    def _count_parses(self, analyze):
+        calls = []
+        tokenize = plasticparser.ENGINES['pyparsing']
+        parse = TreeParser.parse
+
+        def counting_tokenize(*args):
+            calls.append(args)
+            return tokenize(*args)
+
+        def counting_parse(*args):
+            calls.append(args)
+            return parse(*args)
+        plasticparser.ENGINES['pyparsing'] = counting_tokenize
+        TreeParser.parse = counting_parse
+        try:
+            analyze()
+        finally:
+            plasticparser.ENGINES['pyparsing'] = tokenize
+            TreeParser.parse = parse
+        return len(calls)
+
+    def test_should_parse_once(self):
+        analyses = []
+
+        def analyze():
+            analysis = plasticparser.analyze(self.query_string,
+                                             engine='pyparsing')
+            analysis.dsl, analysis.document_types, analysis.field_names
+            analysis.is_facet_query, analysis.free_text_terms
+            analyses.append(analysis)
+        self.assertEqual(self._count_parses(analyze), 1)
+        self.assertIs(analyses[0].dsl, analyses[0].dsl)
+
+    def test_should_not_parse_cached_analyses_again(self):
+        def analyze():
+            for i in range(3):
+                analysis = plasticparser.analyze(self.query_string)
+                analysis.field_names, analysis.free_text_terms
+        plasticparser.enable_cache()
+        try:
+            self.assertEqual(self._count_parses(analyze), 1)
+        finally:
+            plasticparser.disable_cache()
+
+
+class StructuredQueryTest(unittest.TestCase):
+    def get_filtered(self, query_string, **kwargs):
+        return plasticparser.get_query_dsl(
+            query_string, structured=True, **kwargs)['query']['filtered']
+
+    def test_should_compile_compare_expressions_into_filters(self):
+        filtered = self.get_filtered(
+            u'type:help title:hello due:>=5 due:<9 name:"a \\"b\\"" '
+            u'(x:1 OR y:2)', global_filters={'and': [{'client_id': 1}]})
+        self.assertEqual(filtered['filter']['bool']['must'], [
+            {'type': {'value': u'help'}},
+            {'term': {u'title': u'hello'}},
+            {'range': {u'due': {'gte': u'5'}}},
+            {'range': {u'due': {'lt': u'9'}}},
+            {'term': {u'name': u'a "b"'}},
+            {'bool': {'should': [{'term': {u'x': u'1'}},
+                                 {'term': {u'y': u'2'}}]}},
+            {'term': {'client_id': 1}}])
+        self.assertNotIn('query', filtered)
+
+    def test_should_leave_free_text_in_query_string(self):
+        filtered = self.get_filtered(u'title:hello big c++ AND data')
+        self.assertEqual(filtered['filter']['bool']['must'],
+                         [{'term': {u'title': u'hello'}}])
+        self.assertEqual(filtered['query']['query_string']['query'],
+                         u'big c\\+\\+ data')
+
+    def test_should_join_clauses_with_default_operator(self):
+        filtered = self.get_filtered(u'a:1 b:2', default_operator='or')
+        self.assertEqual(filtered['filter']['bool']['must'], [
+            {'bool': {'should': [{'term': {u'a': u'1'}},
+                                 {'term': {u'b': u'2'}}]}}])
+
+    def test_should_keep_query_string_when_free_text_is_or_ed(self):
+        for query_string in [u'a:1 OR data', u'a:1 AND b:2 OR c:3']:
+            filtered = self.get_filtered(query_string)
+            self.assertEqual(filtered['filter']['bool']['must'], [])
+            self.assertEqual(filtered['query']['query_string']['query'],
+                             query_string)
+
+    def test_should_compile_negated_clauses_into_must_not(self):
+        for query_string in [u'-status:open x', u'NOT status:open x',
+                             u'x AND NOT status:open', u'! status:open x']:
+            filtered = self.get_filtered(query_string)
+            self.assertEqual(filtered['filter']['bool']['must'], [])
+            self.assertEqual(filtered['filter']['bool']['must_not'],
+                             [{'term': {u'status': u'open'}}])
+            self.assertEqual(filtered['query']['query_string']['query'],
+                             u'x')
+        filtered = self.get_filtered(u'+a:1 NOT (b:2 c:3)')
+        self.assertEqual(filtered['filter']['bool']['must'],
+                         [{'term': {u'a': u'1'}}])
+        self.assertEqual(filtered['filter']['bool']['must_not'], [
+            {'bool': {'must': [{'term': {u'b': u'2'}},
+                               {'term': {u'c': u'3'}}]}}])
+
+    def test_should_keep_values_filters_cannot_match_in_query_string(self):
+        for query_string, query in [
+                (u'a:1 name:jo*', u'name:jo\\*'),
+                (u'a:1 NOT name:jo?', u'NOT name:jo\\?'),
+                (u'a:1 -name:jo~', u'-name:jo\\~'),
+                (u'a:1 _exists_:title', u'_exists_:title'),
+                (u'a:1 b:=2', u'b:=2')]:
+            filtered = self.get_filtered(query_string)
+            self.assertEqual(filtered['filter']['bool']['must'],
+                             [{'term': {u'a': u'1'}}])
+            self.assertEqual(filtered['filter']['bool']['must_not'], [])
+            self.assertEqual(filtered['query']['query_string']['query'],
+                             query)
+
+    def test_should_keep_split_up_parens_in_query_string(self):
+        for query_string in [u'title:(foo bar)', u'a:1 title:(foo bar)',
+                             u'x OR NOT a:1', u'a:1 NOT']:
+            self.assertEqual(
+                self.get_filtered(query_string),
+                plasticparser.get_query_dsl(query_string)['query'][
+                    'filtered'])
+
+    def test_should_cache_structured_and_query_string_dsl_apart(self):
+        plasticparser.enable_cache()
+        try:
+            plasticparser.get_query_dsl(u'a:1')
+            filtered = self.get_filtered(u'a:1')
+        finally:
+            plasticparser.disable_cache()
+        self.assertEqual(filtered['filter']['bool']['must'],
+                         [{'term': {u'a': u'1'}}])
+
+
+class QueryJsonTest(unittest.TestCase):
+    global_filters = {
+        'and': [{'client_id': 1}, {'range': {'age': {'gte': 18}}}],
+        'or': [{'org': 1}, {'org': 2}],
+        'not': [{'state': 'closed'}],
+        'sort': [{'created_on': 'desc'}]}
+    query_strings = [
+        u'type:help title:hello OR description:"w\u00f6rld"',
+        u'facets:[location(a:(b))] r nested:[n(m:(1))] x:>=1', u'']
+
+    def assertSameJson(self, query_string, **kwargs):
+        self.assertEqual(
+            json.loads(plasticparser.get_query_json(query_string, **kwargs)),
+            json.loads(json.dumps(
+                plasticparser.get_query_dsl(query_string, **kwargs))))
+
+    def test_should_encode_query_dsl(self):
+        for query_string in self.query_strings:
+            for global_filters in (None, self.global_filters):
+                self.assertSameJson(query_string,
+                                    global_filters=global_filters)
+
+    def test_should_encode_aggregations(self):
+        self.assertSameJson(u'facets:[a, b.c(d:(e))] r',
+                            global_filters=self.global_filters,
+                            aggregations=True)
+        self.assertSameJson(u'a:1 facets:[a] r', structured=True,
+                            global_filters=self.global_filters,
+                            aggregations=plasticparser.Aggregations(size=3))
+
+    def test_should_encode_structured_query_dsl(self):
+        self.assertSameJson(u'client_id:1 org:2 title:hello',
+                            global_filters=self.global_filters,
+                            structured=True)
+
+    def test_should_not_reuse_global_filters_encoded_differently(self):
+        for flag, encoded in ((1, b'1'), (True, b'true'), (1.0, b'1.0')):
+            self.assertIn(
+                b'{"term":{"flag":' + encoded + b'}}',
+                plasticparser.get_query_json(
+                    u'title:hello', {'and': [{'flag': flag}]}))
+
+    def test_should_write_into_buffer(self):
+        expected = plasticparser.get_query_json(u'title:hello')
+        buffer = bytearray(b'[')
+        self.assertIs(plasticparser.get_query_json(
+            u'title:hello', buffer=buffer), buffer)
+        self.assertEqual(bytes(buffer), b'[' + expected)
+        stream = io.BytesIO()
+        plasticparser.get_query_json(u'title:hello', buffer=stream)
+        self.assertEqual(stream.getvalue(), expected)
+
+
+class AggregationsTest(unittest.TestCase):
+    query_string = (u'facets:[skills, location.city(country:(in)), '
+                    u'company(size:(big))] r')
+
+    def test_should_compile_facets_into_aggregations(self):
+        query_dsl = plasticparser.get_query_dsl(
+            self.query_string, facets_query_size=5, aggregations=True)
+        self.assertNotIn('facets', query_dsl)
+        country_filter = {'query': {'query_string': {
+            'query': u'country:(in)', 'default_operator': 'and'}}}
+        self.assertEqual(query_dsl['aggs'], {
+            u'skills': {'terms': {'field': 'skills_nonngram', 'size': 5}},
+            u'location.city': {
+                'nested': {'path': u'location'},
+                'aggs': {u'location.city': {
+                    'filter': country_filter,
+                    'aggs': {u'location.city': {'terms': {
+                        'field': 'city_nonngram', 'size': 5}}}}}},
+            u'company': {
+                'filter': {'query': {'query_string': {
+                    'query': u'size:(big)', 'default_operator': 'and'}}},
+                'aggs': {u'company': {'terms': {
+                    'field': 'company_nonngram', 'size': 5}}}}})
+
+    def test_should_apply_aggregation_options(self):
+        aggregations = plasticparser.Aggregations(
+            size=10, sizes={u'skills': 50},
+            field_names={u'skills': u'skills.raw'}, shard_size=100,
+            execution_hint='map')
+        aggs = plasticparser.get_query_dsl(
+            self.query_string, aggregations=aggregations)['aggs']
+        self.assertEqual(aggs[u'skills'], {'terms': {
+            'field': u'skills.raw', 'size': 50, 'shard_size': 100,
+            'execution_hint': 'map'}})
+        self.assertEqual(aggs[u'company']['aggs'][u'company'], {'terms': {
+            'field': 'company_nonngram', 'size': 10, 'shard_size': 100,
+            'execution_hint': 'map'}})
+        aggs = plasticparser.get_query_dsl(
+            self.query_string, aggregations=plasticparser.Aggregations(
+                field_names=lambda name: name + u'.keyword'))['aggs']
+        self.assertEqual(aggs[u'skills']['terms']['field'], u'skills.keyword')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+
+from plasticparser import plasticparser
+from plasticparser.nodes import Compare, Term, TypeFilter, TypeTerms
+from plasticparser.tree_parser import flatten, parse_tree
+
+
+def must_list(query_dsl):
+    return query_dsl['query']['filtered']['filter']['bool']['must']
+
+
+class TypeParsingTest(unittest.TestCase):
+    def test_should_read_type_lists_and_repeated_types(self):
+        tree = parse_tree(u'type:(job OR person) title:x type:person', True)
+        self.assertEqual(tree.type_filter, TypeTerms((u'job', u'person')))
+        self.assertEqual(tree.query, Compare(u'title', u':', u'x'))
+        self.assertEqual(
+            parse_tree(u'x AND type:job AND y', True).query.fields(),
+            (u'AND', Term(u'x'), Term(u'y')))
+        self.assertEqual(parse_tree(u'type:job type:job', True).type_filter,
+                         TypeFilter(u'job'))
+
+    def test_should_leave_types_joined_by_or_in_the_query(self):
+        for query_string in [u'x OR type:job', u'(x type:job)',
+                             u'x type:job OR y']:
+            self.assertEqual(parse_tree(query_string, True),
+                             parse_tree(query_string))
+
+    def test_should_leave_negated_types_in_the_query(self):
+        for query_string in [u'type:a NOT type:b', u'type:a x ! type:b']:
+            tree = parse_tree(query_string, True)
+            self.assertEqual(tree.type_filter, TypeFilter(u'a'))
+            self.assertEqual(flatten(tree.query)[-1],
+                             Compare(u'type', u':', u'b'))
+
+    def test_should_leave_leading_types_joined_by_or_in_the_query(self):
+        query_dsl = plasticparser.get_query_dsl(u'type:a OR type:b',
+                                                routing=True)
+        self.assertEqual(must_list(query_dsl), [])
+        self.assertEqual(
+            query_dsl['query']['filtered']['query']['query_string']['query'],
+            u'type:a OR type:b')
+        self.assertEqual(query_dsl['routing']['types'], [])
+
+    def test_should_read_one_type_without_types(self):
+        tree = parse_tree(u'type:job title:x type:person')
+        self.assertEqual(tree.type_filter, TypeFilter(u'job'))
+
+
+class RoutingTest(unittest.TestCase):
+    def test_should_filter_on_every_type(self):
+        query_dsl = plasticparser.get_query_dsl(
+            u'type:(job OR person) title:x type:company', routing=True)
+        self.assertEqual(must_list(query_dsl), [
+            {'terms': {'_type': [u'job', u'person', u'company']}}])
+        self.assertEqual(query_dsl['routing'], {
+            'types': [u'job', u'person', u'company'], 'indices': None})
+
+    def test_should_keep_the_type_filter_of_one_type(self):
+        query_string = u'type:job title:x'
+        query_dsl = plasticparser.get_query_dsl(query_string, routing=True)
+        self.assertEqual(query_dsl.pop('routing'),
+                         {'types': [u'job'], 'indices': None})
+        self.assertEqual(query_dsl,
+                         plasticparser.get_query_dsl(query_string))
+
+    def test_should_target_the_indices_of_the_types(self):
+        routing = plasticparser.Routing(
+            {'job': 'jobs', 'person': ['people', 'people-2015']})
+        self.assertEqual(routing.target([u'job', u'person']), {
+            'types': [u'job', u'person'],
+            'indices': ['jobs', 'people', 'people-2015']})
+        self.assertEqual(routing.target([u'job', u'company'])['indices'],
+                         None)
+        self.assertEqual(routing.target([])['indices'], None)
+
+    def test_should_write_the_routing_hint_as_json(self):
+        routing = plasticparser.Routing({'job': 'jobs'})
+        for query_string, global_filters in [
+                (u'type:job x', {'client': 1}),
+                (u'type:(job OR person) x', {'and': [{'client': 1}]})]:
+            self.assertEqual(
+                json.loads(plasticparser.get_query_json(
+                    query_string, global_filters, routing=routing)),
+                plasticparser.get_query_dsl(
+                    query_string, global_filters, routing=routing))
+
+    def test_should_return_every_document_type(self):
+        query_string = u'type:(job OR person) x type:company'
+        self.assertEqual(plasticparser.get_document_types(query_string),
+                         [])
+        self.assertEqual(
+            plasticparser.get_document_types(query_string, routing=True),
+            [u'job', u'person', u'company'])
+
+    def test_should_cache_queries_read_for_routing_apart(self):
+        plasticparser.enable_cache()
+        try:
+            query_string = u'type:job type:person'
+            self.assertEqual(must_list(plasticparser.get_query_dsl(
+                query_string, routing=True)),
+                [{'terms': {'_type': [u'job', u'person']}}])
+            self.assertEqual(must_list(plasticparser.get_query_dsl(
+                query_string)), [{'type': {'value': u'job'}}])
+        finally:
+            plasticparser.disable_cache()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+
+from plasticparser import plasticparser
+from plasticparser.exceptions import QueryError, UnknownFieldError
+from plasticparser.schema import Field, Schema
+
+MAPPING = {
+    "properties": {
+        "status": {"type": "keyword"},
+        "title": {"type": "text",
+                  "fields": {"raw": {"type": "keyword"}}},
+        "city": {"type": "string", "index": "not_analyzed"},
+        "due": {"type": "date"},
+        "skills": {
+            "type": "nested",
+            "properties": {
+                "name": {"type": "keyword"},
+                "years": {"type": "integer"},
+            }
+        },
+        "owner": {
+            "properties": {"name": {"type": "keyword"}}
+        },
+    }
+}
+
+
+class SchemaTest(unittest.TestCase):
+    def test_should_read_fields_of_a_mapping(self):
+        schema = Schema.from_mapping(MAPPING)
+        self.assertEqual(len(schema), 7)
+        self.assertEqual(schema.field('title').describe(),
+                         ['title', 'text', True, None, 'title.raw'])
+        self.assertEqual(schema.field('city').describe(),
+                         ['city', 'string', False, None, 'city'])
+        self.assertEqual(schema.field('skills.years').describe(),
+                         ['skills.years', 'integer', False, 'skills',
+                          'skills.years'])
+        self.assertEqual(schema.field('owner.name').nested_path, None)
+        self.assertEqual(schema.nested_paths, frozenset(['skills']))
+
+    def test_should_find_nested_paths_of_dotted_fields(self):
+        schema = Schema([('a.b.c', 'keyword'), Field('a.d', 'long')],
+                        nested_paths=['a', 'a.b'])
+        self.assertEqual(schema.field('a.b.c').nested_path, 'a.b')
+        self.assertEqual(schema.field('a.d').nested_path, 'a')
+
+    def test_should_reject_unknown_fields_when_strict(self):
+        self.assertRaises(UnknownFieldError, Schema([]).field, 'a')
+        self.assertEqual(Schema([], strict=False).field('a'), None)
+        self.assertEqual(Schema([], strict=False).facet_field('a'), None)
+
+    def test_should_fingerprint_fields(self):
+        self.assertEqual(Schema([('a', 'text')]).fingerprint,
+                         Schema([Field('a', 'text')]).fingerprint)
+        self.assertNotEqual(Schema([('a', 'text')]).fingerprint,
+                            Schema([('a', 'keyword')]).fingerprint)
+
+
+class SchemaQueryTest(unittest.TestCase):
+    def setUp(self):
+        self.schema = Schema.from_mapping(MAPPING)
+
+    def get_query_dsl(self, query_string, **kwargs):
+        return plasticparser.get_query_dsl(
+            query_string, schema=self.schema, **kwargs)
+
+    def test_should_pick_the_filter_of_each_field(self):
+        dsl = self.get_query_dsl(
+            u'status:open title:hello title:"big data" due:>=2015-01-01 '
+            u'skills.years:>3 owner.name:x (city:Paris OR skills.name:go)')
+        self.assertEqual(dsl['query']['filtered']['filter']['bool']['must'], [
+            {'term': {u'status': u'open'}},
+            {'query': {'match': {u'title': u'hello'}}},
+            {'query': {'match_phrase': {u'title': u'big data'}}},
+            {'range': {u'due': {'gte': u'2015-01-01'}}},
+            {'nested': {'path': 'skills', 'filter': {
+                'range': {u'skills.years': {'gt': u'3'}}}}},
+            {'term': {u'owner.name': u'x'}},
+            {'bool': {'should': [
+                {'term': {u'city': u'Paris'}},
+                {'nested': {'path': 'skills', 'filter': {
+                    'term': {u'skills.name': u'go'}}}}]}}])
+        self.assertNotIn('query', dsl['query']['filtered'])
+
+    def test_should_compile_negated_clauses_into_must_not(self):
+        filtered = self.get_query_dsl(
+            u'status:open NOT title:hello -skills.name:go '
+            u'NOT (city:Paris OR due:>=2015-01-01)')['query']['filtered']
+        self.assertEqual(filtered['filter']['bool']['must'],
+                         [{'term': {u'status': u'open'}}])
+        self.assertEqual(filtered['filter']['bool']['must_not'], [
+            {'query': {'match': {u'title': u'hello'}}},
+            {'nested': {'path': 'skills', 'filter': {
+                'term': {u'skills.name': u'go'}}}},
+            {'bool': {'should': [
+                {'term': {u'city': u'Paris'}},
+                {'range': {u'due': {'gte': u'2015-01-01'}}}]}}])
+        self.assertNotIn('query', filtered)
+        self.assertRaises(UnknownFieldError, self.get_query_dsl, u'-age:3')
+
+    def test_should_keep_grouped_values_and_wildcards_in_query_string(self):
+        for query_string, query in [
+                (u'title:(big data) status:open',
+                 u'title:(big data) status:open'),
+                (u'status:op* city:Paris', u'status:op\\*')]:
+            filtered = self.get_query_dsl(query_string)['query']['filtered']
+            self.assertEqual(filtered['query']['query_string']['query'],
+                             query)
+            self.assertNotIn({'term': {u'status': u'op*'}},
+                             filtered['filter']['bool']['must'])
+
+    def test_should_count_facet_fields_of_the_schema(self):
+        dsl = self.get_query_dsl(u'facets:[title, skills.name] x')
+        self.assertEqual(dsl['facets'], {
+            u'title': {'terms': {'field': 'title.raw', 'size': 20}},
+            u'skills.name': {'terms': {'field': 'skills.name', 'size': 20},
+                             'nested': 'skills'}})
+        aggs = self.get_query_dsl(u'facets:[title] x',
+                                  aggregations=True)['aggs']
+        self.assertEqual(aggs['title']['terms']['field'], 'title.raw')
+
+    def test_should_reject_unknown_fields(self):
+        for query_string in [u'age:>3', u'status:open OR x:(a OR b) c',
+                             u'facets:[age] x', u'facets:[city(age:(3))] x',
+                             u'nested:[owner(name:(a))] x']:
+            try:
+                self.get_query_dsl(query_string)
+            except UnknownFieldError as error:
+                self.assertEqual(error.query_string, query_string)
+                self.assertTrue(isinstance(error, QueryError))
+            else:
+                self.fail("{!r} not rejected".format(query_string))
+
+    def test_should_accept_unknown_fields_when_not_strict(self):
+        self.schema = Schema.from_mapping(MAPPING, strict=False)
+        self.assertEqual(
+            self.get_query_dsl(u'age:>3 facets:[a.b(c:(d))] x'),
+            plasticparser.get_query_dsl(u'age:>3 facets:[a.b(c:(d))] x',
+                                        structured=True))
+
+    def test_should_cache_queries_of_each_schema_apart(self):
+        plasticparser.enable_cache()
+        try:
+            self.assertEqual(
+                self.get_query_dsl(u'title:a')['query']['filtered'][
+                    'filter']['bool']['must'],
+                [{'query': {'match': {u'title': u'a'}}}])
+            self.schema = Schema([('title', 'keyword')])
+            self.assertEqual(
+                self.get_query_dsl(u'title:a')['query']['filtered'][
+                    'filter']['bool']['must'],
+                [{'term': {u'title': u'a'}}])
+        finally:
+            plasticparser.disable_cache()
+
+    def test_should_encode_json_and_templates_with_schema(self):
+        query_string = u'title:hello skills.name:go status:open'
+        global_filters = {'and': [{'status': 'open'}, {'client': 1}]}
+        expected = self.get_query_dsl(
+            query_string, global_filters=global_filters)
+        self.assertEqual(json.loads(plasticparser.get_query_json(
+            query_string, global_filters, schema=self.schema)), expected)
+        template = plasticparser.compile_template(
+            u'title:{title} skills.name:{skill} status:open',
+            global_filters, schema=self.schema)
+        self.assertEqual(template.render(title=u'hello', skill=u'go'),
+                         expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
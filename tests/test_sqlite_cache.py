@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from plasticparser import plasticparser, sqlite_cache
+from plasticparser.sqlite_cache import SQLiteCache
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def _set_in_child(path, key, value):
+    SQLiteCache(path).set(key, value)
+
+
+class SQLiteCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_should_store_query_dsls(self):
+        cache = SQLiteCache(self.path)
+        key = (u'title:h\xe9llo', 20, 'and', False)
+        value = {'query': {'filtered': {'filter': {'bool': {
+            'must': [{'term': {u'a': 1}}]}}}}}
+        self.assertEqual(cache.get(key), None)
+        cache.set(key, value)
+        self.assertEqual(cache.get(key), value)
+        self.assertEqual(SQLiteCache(self.path).get(key), value)
+        self.assertEqual(cache.stats(), {
+            'hits': 1, 'misses': 1, 'evictions': 0, 'errors': 0,
+            'size': 1, 'maxsize': 10000})
+
+    def test_should_share_entries_between_processes(self):
+        cache = SQLiteCache(self.path)
+        cache.get(('warm',))
+        process = multiprocessing.Process(
+            target=_set_in_child, args=(self.path, ('a',), {'b': [1]}))
+        process.start()
+        process.join()
+        self.assertEqual(cache.get(('a',)), {'b': [1]})
+
+    def test_should_drop_entries_of_other_versions(self):
+        SQLiteCache(self.path).set(('a',), 1)
+        version = sqlite_cache.cache_version()
+        sqlite_cache._version = version + u'-changed'
+        try:
+            cache = SQLiteCache(self.path)
+            self.assertEqual(cache.get(('a',)), None)
+            self.assertEqual(len(cache), 0)
+        finally:
+            sqlite_cache._version = version
+
+    def test_should_evict_least_recently_used_entries(self):
+        timer = FakeTimer()
+        cache = SQLiteCache(self.path, maxsize=2, timer=timer)
+        for index in range(3):
+            timer.now += sqlite_cache.TOUCH_INTERVAL + 1
+            cache.set((index,), index)
+        timer.now += sqlite_cache.TOUCH_INTERVAL + 1
+        self.assertEqual(cache.get((0,)), 0)
+        cache.evict()
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get((1,)), None)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_should_expire_entries_older_than_ttl(self):
+        timer = FakeTimer()
+        cache = SQLiteCache(self.path, ttl=10, timer=timer)
+        cache.set(('a',), 1)
+        timer.now = 10
+        self.assertEqual(cache.get(('a',)), 1)
+        timer.now = 11
+        self.assertEqual(cache.get(('a',)), None)
+
+    def test_should_miss_while_another_process_locks_the_file(self):
+        cache = SQLiteCache(self.path, timeout=0)
+        cache.set(('a',), 1)
+        locker = sqlite3.connect(self.path)
+        locker.execute('BEGIN EXCLUSIVE')
+        try:
+            cache.set(('b',), 2)
+            self.assertEqual(cache.errors, 1)
+        finally:
+            locker.rollback()
+            locker.close()
+        self.assertEqual(cache.get(('b',)), None)
+        self.assertEqual(cache.get(('a',)), 1)
+
+
+class SharedQueryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.sqlite')
+
+    def tearDown(self):
+        plasticparser.disable_cache()
+        shutil.rmtree(self.directory)
+
+    def test_should_parse_queries_once_per_host(self):
+        query_string = u'type:a title:(b OR c) facets:[d(e:(f))]'
+        expected = plasticparser.get_query_dsl(query_string, {'g': 1})
+        plasticparser.enable_cache(path=self.path)
+        self.assertEqual(
+            plasticparser.get_query_dsl(query_string, {'g': 1}), expected)
+        # another process starts with an empty memory cache
+        plasticparser.enable_cache(path=self.path)
+        self.assertEqual(
+            plasticparser.get_query_dsl(query_string, {'g': 1}), expected)
+        stats = plasticparser.get_cache_stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['shared']['hits'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from plasticparser import plasticparser
+
+
+class QueryTemplateTest(unittest.TestCase):
+    global_filters = {'and': [{'client_id': 1}], 'sort': [{'c': 'desc'}]}
+
+    def test_should_render_same_dsl_as_query_string(self):
+        template = plasticparser.compile_template(
+            u'type:{type} facets:[location(city:({city}))] {text} '
+            u'nested:[m(a:({a}))] r status:{status} owner:{user}',
+            self.global_filters)
+        for values, query_string in [
+                (dict(type=u'candidates', city=u'x', text=u'c++', a=3,
+                      status=u'open', user=u'John Doe'),
+                 u'type:candidates facets:[location(city:(x))] c++ '
+                 u'nested:[m(a:(3))] r status:open owner:"John Doe"'),
+                (dict(type=u'jobs', city=u'y', text=u'data', a=u'b',
+                      status=u'closed', user=u'c++'),
+                 u'type:jobs facets:[location(city:(y))] data '
+                 u'nested:[m(a:(b))] r status:closed owner:c++')]:
+            self.assertEqual(
+                template.render(**values),
+                plasticparser.get_query_dsl(query_string, self.global_filters))
+
+    def test_should_keep_values_from_changing_the_query(self):
+        template = plasticparser.compile_template(u'title:{title} b:1')
+        query_dsl = template.render(title=u'x OR (y:1')
+        self.assertEqual(
+            query_dsl['query']['filtered']['query']['query_string']['query'],
+            u'title:"x OR (y:1" b:1')
+        query_dsl = template.render(title=u'o"neil')
+        self.assertEqual(
+            query_dsl['query']['filtered']['query']['query_string']['query'],
+            u'title:"o\\"neil" b:1')
+
+    def test_should_escape_values_inside_phrases(self):
+        template = plasticparser.compile_template(
+            u'title:"{title}" "{word} data" b:1')
+        query_dsl = template.render(title=u'hello world', word=u'a"b\\c')
+        self.assertEqual(
+            query_dsl['query']['filtered']['query']['query_string']['query'],
+            u'title:"hello world" "a\\"b\\\\c data" b:1')
+
+    def test_should_fill_filters_with_values_as_they_are(self):
+        template = plasticparser.compile_template(
+            u'status:{status} due:>={due}', structured=True)
+        self.assertEqual(
+            template.render(status=u'a b', due=5)[
+                'query']['filtered']['filter']['bool']['must'],
+            [{'term': {u'status': u'a b'}}, {'range': {u'due': {'gte': 5}}}])
+
+    def test_should_not_share_rendered_dsl(self):
+        template = plasticparser.compile_template(u'title:{title}')
+        first = template.render(title=u'a')
+        first['query']['filtered']['filter']['bool']['must'].append({})
+        self.assertEqual(template.render(title=u'a')['query']['filtered'][
+            'filter']['bool']['must'], [])
+
+    def test_should_reject_placeholders_that_are_not_values(self):
+        for template_string in [u'facets:[{field}]', u'a:{0:>3}',
+                                u'a:{} b', u'a:plasticslot0x']:
+            self.assertRaises(ValueError, plasticparser.compile_template,
+                              template_string)
+        self.assertRaises(KeyError, plasticparser.compile_template(
+            u'a:{a}').render, b=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,11 @@
 import unittest
 
-from plasticparser import tokenizer, grammar_parsers
+from plasticparser import tokenizer, fast_tokenizer, grammar_parsers
 
 
 class TokenizerTest(unittest.TestCase):
+    tokenize = staticmethod(tokenizer.tokenize)
+
     def test_should_sanitize_value(self):
         for char in grammar_parsers.RESERVED_CHARS:
             if char not in '(':
@@ -17,58 +19,73 @@ class TokenizerTest(unittest.TestCase):
 
     def test_should_tokenize_and_parse_logical_expression(self):
         query_string = "abc:>def"
-        parsed_string = tokenizer.tokenize(query_string)
+        parsed_string = self.tokenize(query_string)
         self.assertEqual(self.get_query_string(parsed_string), "abc:>def")
 
         query_string = "abc:>def and mms:>asd"
-        parsed_string = tokenizer.tokenize(query_string)
+        parsed_string = self.tokenize(query_string)
         self.assertEqual(
             self.get_query_string(parsed_string),
             "abc:>def AND mms:>asd")
 
         query_string = "abc:>def mms:>asd"
-        parsed_string = tokenizer.tokenize(query_string)
+        parsed_string = self.tokenize(query_string)
         self.assertEqual(
             self.get_query_string(parsed_string),
             "abc:>def mms:>asd")
 
         query_string = "(abc:>def mms:>asd)"
-        parsed_string = tokenizer.tokenize(query_string)
+        parsed_string = self.tokenize(query_string)
         self.assertEqual(
             self.get_query_string(parsed_string),
             "(abc:>def mms:>asd)")
 
         query_string = "abc:>def mms:>asd (abc:def or pqe:123) and blab:blab"
-        parsed_string = tokenizer.tokenize(query_string)
+        parsed_string = self.tokenize(query_string)
         self.assertEqual(
             self.get_query_string(parsed_string),
             "abc:>def mms:>asd (abc:def OR pqe:123) AND blab:blab")
 
         query_string = "( abc:>def mms:>asd ) (abc:>def mms:>asd) "
-        parsed_string = tokenizer.tokenize(query_string)
+        parsed_string = self.tokenize(query_string)
         self.assertEqual(
             self.get_query_string(parsed_string),
             "(abc:>def mms:>asd) (abc:>def mms:>asd)")
 
         query_string = "( abc:>def mms:>asd ) and (abc:>def mms:>asd) "
-        parsed_string = tokenizer.tokenize(query_string)
+        parsed_string = self.tokenize(query_string)
         self.assertEqual(
             self.get_query_string(parsed_string),
             "(abc:>def mms:>asd) AND (abc:>def mms:>asd)")
 
         query_string = "abc def"
-        parsed_string = tokenizer.tokenize(query_string)
+        parsed_string = self.tokenize(query_string)
         self.assertEqual(self.get_query_string(parsed_string), "abc def")
 
         query_string = 'abc (python or london) (abc:def dd:ff) [fgdgdfg]'
-        parsed_string = tokenizer.tokenize(query_string)
+        parsed_string = self.tokenize(query_string)
         self.assertEqual(
             self.get_query_string(parsed_string),
             u'abc (python OR london) (abc:def dd:ff) \[fgdgdfg\]')
 
+    def test_should_parse_compare_expression_not_followed_by_another(self):
+        query_string = "abc:def ghi jkl:mno"
+        parsed_string = self.tokenize(query_string)
+        self.assertEqual(
+            self.get_query_string(parsed_string), "abc:def ghi jkl:mno")
+
+        query_string = "abc:def and"
+        parsed_string = self.tokenize(query_string)
+        self.assertEqual(self.get_query_string(parsed_string), "abc:def AND")
+
+        query_string = "abc:def or (ghi)"
+        parsed_string = self.tokenize(query_string)
+        self.assertEqual(
+            self.get_query_string(parsed_string), "abc:def OR (ghi)")
+
     def test_should_parse_logical_expression_with_type_and_facets(self):
         query_string = "type:def facets: [ aaa(abc:def) ] (abc:>def mms:>asd)"
-        parsed_string = tokenizer.tokenize(query_string)
+        parsed_string = self.tokenize(query_string)
         expected_query_string = {
             'query': {
                 'filtered': {
@@ -93,7 +110,7 @@ class TokenizerTest(unittest.TestCase):
 
     def test_should_parse_logical_expression_with_type(self):
         query_string = "type:def (abc:>def mms:>asd)"
-        parsed_string = tokenizer.tokenize(query_string)
+        parsed_string = self.tokenize(query_string)
         expected_query_string = {
             'query': {
                 'filtered': {
@@ -114,7 +131,7 @@ class TokenizerTest(unittest.TestCase):
 
     def test_should_parse_logical_expression_with_type_multi_facets(self):
         query_string = "type:def (abc:>def mms:>asd)    facets: [ aaa.bb(abc:def) bbb(cc:ddd) ] "
-        parsed_string = tokenizer.tokenize(query_string)
+        parsed_string = self.tokenize(query_string)
         expected_query_string = {
             'query': {
                 'filtered': {
@@ -144,7 +161,7 @@ class TokenizerTest(unittest.TestCase):
 
     def test_should_parse_basic_logical_expression(self):
         query_string = 'title:hello OR description:"world"'
-        parsed_string = tokenizer.tokenize(query_string)
+        parsed_string = self.tokenize(query_string)
         expected_query_string = {
             'query': {
                 'filtered': {
@@ -163,7 +180,7 @@ class TokenizerTest(unittest.TestCase):
     def test_should_parse_basic_logical_expression_facets_with_no_facet_filters(
             self):
         query_string = "type:def (abc:>def mms:>asd) facets: [ aaa.bb ]"
-        parsed_string = tokenizer.tokenize(query_string)
+        parsed_string = self.tokenize(query_string)
         self.assertEqual(
             parsed_string, {'query': {
                 'filtered': {'filter': {'bool': {'should': [], 'must_not': [], 'must': [{'type': {'value': 'def'}}]}},
@@ -173,7 +190,7 @@ class TokenizerTest(unittest.TestCase):
     def test_should_parse_basic_logical_expression_facets_with_simple_field(
             self):
         query_string = "type:def (abc:>def mms:>asd) facets: [ aaa ]"
-        parsed_string = tokenizer.tokenize(query_string)
+        parsed_string = self.tokenize(query_string)
         self.assertEqual(
             parsed_string, {
                 'query': {
@@ -194,13 +211,13 @@ class TokenizerTest(unittest.TestCase):
 
     def test_should_parse_multiword_field_value(self):
         query_string = "name:(krace OR kumar) abc:>def"
-        parsed_string = tokenizer.tokenize(query_string)
+        parsed_string = self.tokenize(query_string)
         self.assertEqual(parsed_string['query']['filtered']['query']['query_string']['query'],
                          u'name:(krace OR kumar) abc:>def')
 
     def test_should_parse_logical_expression_with_type_and_facets_2(self):
         query_string = "facets: [aaa(a:b abc:(def fff) c:d e:(f))]"
-        parsed_string = tokenizer.tokenize(query_string)
+        parsed_string = self.tokenize(query_string)
         expected_parse_string = {
             'query': {'filtered': {'filter': {'bool': {'should': [], 'must_not': [], 'must': []}}}}, 'facets': {
             'aaa': {'facet_filter': {
@@ -210,7 +227,7 @@ class TokenizerTest(unittest.TestCase):
 
     def test_should_parse_nested_expression(self):
         query_string = "nested:[aaa(a:(bb) abc:(def fff))]"
-        parsed_string = tokenizer.tokenize(query_string)
+        parsed_string = self.tokenize(query_string)
         self.assertEqual(parsed_string, {'query': {'filtered': {'filter': {'bool': {'should': [], 'must_not': [],
                                                                                     'must': [{'nested': {'path': 'aaa',
                                                                                                          'query': {
@@ -219,3 +236,6 @@ class TokenizerTest(unittest.TestCase):
                                                                                                          'default_operator': 'and'}}}}]}}}},
                                          'facets': {}})
 
+
+class FastTokenizerTest(TokenizerTest):
+    tokenize = staticmethod(fast_tokenizer.tokenize)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import pickle
+import random
+import unittest
+
+from plasticparser import plasticparser
+from plasticparser.nodes import (
+    Term, Phrase, Compare, Bool, Paren, TypeFilter, Facet, NestedClause,
+    SearchQuery)
+
+from tests.test_fast_tokenizer import QUERIES, make_query, parse
+
+
+class TreeParserTest(unittest.TestCase):
+    def test_should_build_tree(self):
+        tree = plasticparser.parse_tree(
+            u'type:help facets:[aaa(b:(c) AND d:(e)), x.y] r '
+            u'nested:[n.p(m:(1))] title:"a \\" b" OR (x:>=1 y:2) free')
+        self.assertEqual(tree, SearchQuery(
+            TypeFilter(u'help'),
+            (Facet(u'aaa', Bool(u'AND', Compare(u'b', u':', u'(c)'),
+                                Compare(u'd', u':', u'(e)'))),
+             Facet(u'x.y', None)),
+            (NestedClause(u'n.p', Compare(u'm', u':', u'(1)')),),
+            Bool(None, Bool(u'OR', Bool(
+                None, Term(u'r'),
+                Compare(u'title', u':', Phrase(u'a \\" b'))),
+                Paren(Bool(None, Compare(u'x', u':>=', u'1'),
+                           Compare(u'y', u':', u'2')))),
+                Term(u'free'))))
+
+    def test_should_emit_same_dsl_as_get_query_dsl(self):
+        rng = random.Random(2015)
+        global_filters = {'and': [{'a': 'b'}], 'sort': [{'c': 'desc'}]}
+        for query_string in QUERIES + [make_query(rng) for _ in range(1000)]:
+            self.assertEqual(
+                parse(lambda query: plasticparser.emit_query_dsl(
+                    plasticparser.parse_tree(query), global_filters, 3, 'or'),
+                    query_string),
+                parse(lambda query: plasticparser.get_query_dsl(
+                    query, global_filters, 3, 'or', engine='fast'),
+                    query_string),
+                u'tree differs on {!r}'.format(query_string))
+
+    def test_should_compare_pickle_and_hash_trees(self):
+        tree = plasticparser.parse_tree(u'facets:[a(b:(c))] x:"y" z')
+        for protocol in (0, 2):
+            copy = pickle.loads(pickle.dumps(tree, protocol))
+            self.assertEqual(copy, tree)
+            self.assertEqual(hash(copy), hash(tree))
+        self.assertNotEqual(Term(u'a'), Phrase(u'a'))
+
+    def test_should_replace_fields(self):
+        tree = plasticparser.parse_tree(u'title:hello')
+        changed = tree.replace(query=tree.query.replace(value=u'world'))
+        self.assertEqual(tree.query.value, u'hello')
+        self.assertEqual(plasticparser.emit_query_dsl(changed),
+                         plasticparser.get_query_dsl(u'title:world'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import pickle
+import time
+import unittest
+
+from plasticparser import plasticparser
+from plasticparser.exceptions import QuerySyntaxError
+
+
+class ValidateTest(unittest.TestCase):
+    def assertRejected(self, query_string, offset, expected):
+        error = plasticparser.validate(query_string)
+        self.assertIsInstance(error, QuerySyntaxError)
+        self.assertEqual((error.offset, error.expected), (offset, expected),
+                         query_string)
+        self.assertEqual(error.query_string, query_string)
+
+    def test_should_accept_well_formed_queries(self):
+        for query_string in [
+                u'', u'title:hello', u'title: hello OR description:"a (b"',
+                u'type:help facets:[aaa(b:(c) AND d:(e)), x.y] r '
+                u'nested:[n.p(m:(1))] (x:1 OR y:2)',
+                u'facets:[a b,c]', u'facets:[a] AND nested:[b(c:(d))]',
+                u'name:"x \\" y"', u'due_date:>=1234']:
+            self.assertIsNone(plasticparser.validate(query_string),
+                              query_string)
+
+    def test_should_reject_unbalanced_parens_brackets_and_quotes(self):
+        self.assertRejected(u'a:(b', 4, u"')'")
+        self.assertRejected(u'a) b', 1, u"'('")
+        self.assertRejected(u'x[1', 3, u"']'")
+        self.assertRejected(u'a ]', 2, u"'['")
+        self.assertRejected(u'title:"abc', 10, u"'\"'")
+
+    def test_should_reject_malformed_lists(self):
+        self.assertRejected(u'facets:[]', 8, u'field name')
+        self.assertRejected(u'facets: [a(b:(c)', 16, u"')'")
+        self.assertRejected(u'facets:[a( )]', 11, u'filter')
+        self.assertRejected(u'nested:[a]', 9, u"'('")
+        self.assertRejected(u'facets:[a;]', 9, u"',' or ']'")
+        self.assertRejected(u'facets:[a] nested:[b(c:(d))]', 11,
+                            u'expression')
+
+    def test_should_reject_compare_without_value(self):
+        self.assertRejected(u'title:', 6, u'value')
+        self.assertRejected(u'a:1 due:>= ', 11, u'value')
+
+    def test_should_check_long_words_in_linear_time(self):
+        started = time.time()
+        for query_string in [u'a' * 40000, u'a' * 40000 + u':',
+                             u'a:' * 20000 + u'b', u'a ' * 20000 + u':']:
+            plasticparser.validate(query_string)
+        self.assertLess(time.time() - started, 1)
+        self.assertRejected(u'a' * 40000 + u' :<= ', 40005, u'value')
+
+    def test_should_pickle_errors(self):
+        error = pickle.loads(pickle.dumps(plasticparser.validate(u'a:(b')))
+        self.assertEqual((error.query_string, error.offset, error.expected),
+                         (u'a:(b', 4, u"')'"))
+
+
+if __name__ == '__main__':
+    unittest.main()